@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""DartFileManager save/load throughput and compression ratio per codec.
+
+    Uses real statements cached under DART_RESULT_DIR/corp_data.
+
+    ./benchmark/bench_dart_file.py --data-dir ./data/dart --corps 50
+"""
+import argparse
+import itertools
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from manage_dart_file import DartFileManager, COMPRESSION_CODECS  # noqa: E402
+
+CASES = [
+    ('stored', None),
+    ('deflate', 1),
+    ('deflate', 6),
+    ('deflate', 9),
+    ('bzip2', 9),
+    ('lzma', None),
+]
+
+
+def load_samples(data_dir, ncorps):
+    """Returns: list of (corp_code, corp_name, corp_data)"""
+    samples = []
+    zips = Path(data_dir).joinpath('corp_data').glob('*/financial-statements-*.zip')
+    for zf in itertools.islice(zips, ncorps):
+        corp_code, corp_name = zf.parent.name.split('-', 1)
+        dfm = DartFileManager(data_dir=data_dir, corp_code=corp_code, corp_name=corp_name,
+                              data_file_prefix='financial-statements')
+        corp_data = dfm.load()
+        if corp_data:
+            samples.append((corp_code, corp_name, corp_data))
+    return samples
+
+
+def run(samples, compression, compresslevel, repeat):
+    raw = sum(len(q.encode()) for _, _, corp_data in samples for ydata in corp_data.values() for q in ydata)
+    save_time = load_time = 0.0
+    compressed = 0
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as d:
+            dfms = [DartFileManager(data_dir=d, corp_code=corp_code, corp_name=corp_name,
+                                    data_file_prefix='financial-statements', compression=compression,
+                                    compresslevel=compresslevel)
+                    for corp_code, corp_name, _ in samples]
+            t = time.perf_counter()
+            for dfm, (_, _, corp_data) in zip(dfms, samples):
+                dfm.save(corp_data)
+            save_time += time.perf_counter() - t
+
+            t = time.perf_counter()
+            for dfm in dfms:
+                dfm.load()
+            load_time += time.perf_counter() - t
+            compressed = sum(Path(dfm._zipfile).stat().st_size for dfm in dfms)
+
+    mb = raw * repeat / 1024 / 1024
+    return {
+        'codec': compression if compresslevel is None else f'{compression}-{compresslevel}',
+        'save MB/s': mb / save_time,
+        'load MB/s': mb / load_time,
+        'ratio': raw / compressed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DartFileManager codec benchmark')
+    parser.add_argument('--data-dir', help='DART_RESULT_DIR with cached corp_data', required=True)
+    parser.add_argument('--corps', help='Number of corps to sample', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    samples = load_samples(args.data_dir, args.corps)
+    if not samples:
+        print(f'No cached corp_data under {args.data_dir}/corp_data')
+        return 1
+    nq = sum(len(ydata) for _, _, corp_data in samples for ydata in corp_data.values())
+    print(f'{len(samples)} corps, {nq} quarters')
+    print(f'{"codec":<12}{"save MB/s":>12}{"load MB/s":>12}{"ratio":>8}')
+    for compression, compresslevel in CASES:
+        assert compression in COMPRESSION_CODECS
+        r = run(samples, compression, compresslevel, args.repeat)
+        print(f'{r["codec"]:<12}{r["save MB/s"]:>12.1f}{r["load MB/s"]:>12.1f}{r["ratio"]:>8.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
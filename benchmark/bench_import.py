@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""End to end importer benchmark against local DART and Elasticsearch stubs.
+
+    Runs the real import_corp_code and import_all_corp_data paths. Nothing
+    leaves the machine, so runs are comparable before and after a change.
+
+    ./benchmark/bench_import.py --corps 2000 --fetch-concurrency 8
+    ./benchmark/bench_import.py --fixtures benchmark/fixtures --latency-ms 80 --error-rate 0.01
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stub_servers import StubServer  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    # linux 는 KB, macOS 는 byte
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def configure_env(dart_url, result_dir, response_cache):
+    """Points the importer at the stubs. Must run before the importer reads its config."""
+    os.environ.update({
+        'DART_API_URL': f'{dart_url}/api',
+        'DART_API_KEY': 'benchmark',
+        'DART_RESULT_DIR': result_dir,
+        'DART_DAILY_LIMIT': str(10 ** 9),
+        'DART_REQUESTS_PER_SECOND': str(10 ** 6),
+        'DART_RESPONSE_CACHE': 'on' if response_cache else 'off',
+    })
+
+
+def run(args) -> dict:
+    stub_options = dict(corps=args.corps, listed_ratio=args.listed_ratio, data_ratio=args.data_ratio,
+                        rows=args.rows, latency=args.latency_ms / 1000, error_rate=args.error_rate,
+                        fixtures=args.fixtures)
+    with StubServer('dart', **stub_options) as dart, \
+            StubServer('es', bulk_latency=args.bulk_latency_ms / 1000) as es, \
+            tempfile.TemporaryDirectory() as result_dir:
+        configure_env(dart.url, result_dir, args.response_cache)
+
+        t = time.monotonic()
+        import import_dart_data
+        from elasticsearch import Elasticsearch
+        stages = {'startup': time.monotonic() - t}
+        import_dart_data.logger.setLevel(args.log_level)
+        if args.profile:
+            import_dart_data.configure_profiler(args.profile, sample_rate=args.profile_sample,
+                                                memory=args.profile_memory)
+        client = Elasticsearch(es.url)
+
+        t = time.monotonic()
+        import_dart_data.import_corp_code(client)
+        stages['corp_code'] = time.monotonic() - t
+        corp_code_requests = dart.stats().get('requests', 0)
+
+        t = time.monotonic()
+        with import_dart_data.profiler.stage('corp_data'):
+            stats = import_dart_data.import_all_corp_data(
+                client, fetch_concurrency=args.fetch_concurrency, bulk_chunk_size=args.bulk_chunk_size,
+                bulk_threads=args.bulk_threads, queue_size=args.queue_size, corp_source='xml', show_progress=False,
+                years=list(range(args.first_year, args.last_year + 1)))
+        stages['corp_data'] = time.monotonic() - t
+        import_dart_data.profiler.save()
+
+        dart_stats = dart.stats()
+        es_stats = es.stats()
+        latency = import_dart_data.get_dart_http().latency.summary()
+
+    requests = dart_stats.get('requests', 0) - corp_code_requests
+    documents = stats['documents'] + stats['derived']
+    return {
+        'corps': stats['corps'],
+        'quarters': stats['quarters'],
+        'documents': stats['documents'],
+        'derived': stats['derived'],
+        'failures': stats['failures'],
+        'docs_per_sec': documents / stages['corp_data'] if stages['corp_data'] else 0,
+        'requests_per_sec': requests / stages['corp_data'] if stages['corp_data'] else 0,
+        'dart_requests': dart_stats.get('requests', 0),
+        'dart_injected_errors': dart_stats.get('injected_errors', 0),
+        'dart_latency_p50_ms': latency.get('p50', 0) * 1000,
+        'dart_latency_p95_ms': latency.get('p95', 0) * 1000,
+        'es_bulk_requests': es_stats.get('bulk_requests', 0),
+        'es_bulk_mb': es_stats.get('bulk_bytes', 0) / (1024 * 1024),
+        'peak_rss_mb': peak_rss_mb(),
+        # thread 별 합계. stage 가 겹치면 corp_data 보다 클 수 있다
+        'stage_seconds': import_dart_data.stage_seconds(),
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='importer benchmark with local stubs')
+    parser.add_argument('--corps', type=int, default=1000, help='corps in the synthesized corpCode.xml')
+    parser.add_argument('--listed-ratio', type=float, default=0.1)
+    parser.add_argument('--data-ratio', type=float, default=0.2, help='share of corps with statements')
+    parser.add_argument('--rows', type=int, default=150, help='accounts per synthesized quarter')
+    parser.add_argument('--first-year', type=int, default=2021)
+    parser.add_argument('--last-year', type=int, default=2022)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every DART response')
+    parser.add_argument('--bulk-latency-ms', type=float, default=0, help='added to every ES bulk response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of DART responses which are 503')
+    parser.add_argument('--fixtures', help='recorded responses, see record_fixtures.py')
+    parser.add_argument('--fetch-concurrency', type=int, default=1)
+    parser.add_argument('--bulk-chunk-size', type=int, default=500)
+    parser.add_argument('--bulk-threads', type=int, default=1)
+    parser.add_argument('--queue-size', type=int, default=32, help='quarters queued between stages. 0 is sequential')
+    parser.add_argument('--response-cache', action='store_true', help='use the DART response cache')
+    parser.add_argument('--log-level', default='CRITICAL', help='importer log level. 013 responses log errors')
+    parser.add_argument('--profile', metavar='DIR', help='write CPU profiles of the import to DIR')
+    parser.add_argument('--profile-sample', type=float, default=1.0, help='fraction of corps profiled')
+    parser.add_argument('--profile-memory', action='store_true', help='also take tracemalloc snapshots')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f'{report["corps"]} corps, {report["quarters"]} quarters, {report["documents"]} documents, '
+          f'{report["derived"]} metrics, {report["failures"]} failed')
+    print(f'{report["docs_per_sec"]:10.1f} docs/s')
+    print(f'{report["requests_per_sec"]:10.1f} DART req/s  (p50 {report["dart_latency_p50_ms"]:.1f} ms, '
+          f'p95 {report["dart_latency_p95_ms"]:.1f} ms, {report["dart_injected_errors"]} injected errors)')
+    print(f'{report["es_bulk_requests"]:10d} bulk requests ({report["es_bulk_mb"]:.1f} MB)')
+    print(f'{report["peak_rss_mb"]:10.1f} MB peak RSS')
+    for stage, seconds in report['stages'].items():
+        print(f'{seconds:10.2f} s  {stage}')
+    print('seconds per pipeline stage : ' + ', '.join(f'{k} {v}' for k, v in report['stage_seconds'].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Cold start of the importer command line.
+
+    Every run is a fresh interpreter without credentials, like a spawned
+    worker or a --help call. Fails when the median is over the budget, or
+    when the import of import_dart_data (-X importtime) is over its budget.
+
+    ./benchmark/bench_startup.py --runs 20 --budget-ms 300 --import-budget-ms 300
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+def cold_start_seconds(args, runs) -> list:
+    times = []
+    with tempfile.TemporaryDirectory() as d:
+        for _ in range(runs):
+            t = time.perf_counter()
+            subprocess.run([sys.executable, str(REPO / 'import_dart_data.py'), *args], cwd=d, env={},
+                           stdout=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - t)
+    return times
+
+
+def import_seconds(runs) -> list:
+    """Cumulative -X importtime of import_dart_data per run."""
+    times = []
+    with tempfile.TemporaryDirectory() as d:
+        for _ in range(runs):
+            p = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import import_dart_data'], cwd=d,
+                               env={'PYTHONPATH': str(REPO)}, capture_output=True, text=True, check=True)
+            line = next(line for line in p.stderr.splitlines() if line.endswith('| import_dart_data'))
+            times.append(int(line.split('|')[1]) / 1e6)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='importer cold start benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=300, help='limit of the median --help time')
+    parser.add_argument('--import-budget-ms', type=float, default=300,
+                        help='limit of the median cumulative import time of import_dart_data')
+    args = parser.parse_args()
+
+    # python 자체의 시작 시간과 비교한다
+    t = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    baseline = time.perf_counter() - t
+    results = {' '.join(a): cold_start_seconds(a, args.runs) for a in (['--help'], ['import', '--help'])}
+    print(f'{baseline * 1000:8.1f} ms  python -c pass')
+    for name, times in results.items():
+        print(f'{statistics.median(times) * 1000:8.1f} ms  {name} (median of {args.runs}, max {max(times) * 1000:.1f})')
+    imports = import_seconds(args.runs)
+    print(f'{statistics.median(imports) * 1000:8.1f} ms  import import_dart_data (median of {args.runs})')
+    if statistics.median(results['--help']) * 1000 > args.budget_ms:
+        sys.exit(f'--help is over the budget of {args.budget_ms} ms')
+    if statistics.median(imports) * 1000 > args.import_budget_ms:
+        sys.exit(f'import import_dart_data is over the budget of {args.import_budget_ms} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Per-row vs batch corp_data transform.
+
+    The per-row path is the one the importer used before corp_data_transform:
+    four pendulum datetimes and a string amount per row.
+
+    ./benchmark/bench_transform.py --rows 200 --quarters 200
+"""
+import argparse
+import copy
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pendulum  # noqa: E402
+
+from corp_data_transform import AMOUNT_FIELDS, QUARTER_CODES, transform_quarter  # noqa: E402
+
+
+def per_row_transform(rows):
+    for doc in rows:
+        qc = doc['reprt_code']
+        y = int(doc['bsns_year'])
+        month = QUARTER_CODES.index(qc) * 3 + 1
+        tf = {
+            'gte': pendulum.datetime(y, month, 1).start_of('month').start_of('day').in_tz(
+                'Asia/Seoul').to_iso8601_string(),
+            'lte': pendulum.datetime(y, month + 2, 1).end_of('month').end_of('day').in_tz(
+                'Asia/Seoul').to_iso8601_string()
+        }
+        doc.update({'time_frame': tf})
+        for f in AMOUNT_FIELDS:
+            if f in doc:
+                v = doc[f].replace(',', '').strip()
+                doc[f] = int(v) if v not in ('', '-') else None
+    return rows
+
+
+def make_quarters(nquarters, nrows):
+    quarters = []
+    for q in range(nquarters):
+        rows = []
+        for i in range(nrows):
+            rows.append({
+                'rcept_no': '20220516001751', 'reprt_code': QUARTER_CODES[q % 4], 'bsns_year': str(2017 + q % 6),
+                'corp_code': '00126380', 'sj_div': 'BS', 'sj_nm': '재무상태표', 'account_id': f'ifrs-full_X{i}',
+                'account_nm': '유동부채', 'account_detail': '-', 'thstrm_nm': '제 54 기 1분기말',
+                'thstrm_amount': f'{random.randint(-10 ** 12, 10 ** 13):,}', 'frmtrm_nm': '제 53 기말',
+                'frmtrm_amount': random.choice(['-', '', str(random.randint(0, 10 ** 12))]), 'ord': str(i),
+                'currency': 'KRW'
+            })
+        quarters.append(rows)
+    return quarters
+
+
+def measure(transform, quarters):
+    quarters = copy.deepcopy(quarters)
+    t = time.perf_counter()
+    for rows in quarters:
+        transform(rows)
+    return time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser(description='corp_data transform micro-benchmark')
+    parser.add_argument('--rows', help='Rows per quarter', type=int, default=200)
+    parser.add_argument('--quarters', type=int, default=200)
+    args = parser.parse_args()
+
+    quarters = make_quarters(args.quarters, args.rows)
+    n = args.quarters * args.rows
+    per_row = measure(per_row_transform, quarters)
+    batch = measure(transform_quarter, quarters)
+    print(f'{n} rows')
+    print(f'per-row : {n / per_row:12.0f} rows/s')
+    print(f'batch   : {n / batch:12.0f} rows/s')
+    print(f'speedup : {per_row / batch:12.1f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
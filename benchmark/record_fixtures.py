@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Records real DART responses for the benchmark stubs.
+
+    Needs DART_API_KEY. Every quarter costs one request of the daily quota,
+    responses which are already recorded are skipped.
+
+    ./benchmark/record_fixtures.py --output benchmark/fixtures --corps 00126380 00164779 --years 2021 2022
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stub_servers import QUARTER_CODES, quarter_fixture_name  # noqa: E402
+
+
+def record(output, corps, years, with_corp_code=True) -> dict:
+    """Writes corp-code.zip and fnlttSinglAcntAll/<corp_code>-<bsns_year>-<reprt_code>.json under output.
+
+    Returns:
+        dict: counts of recorded and skipped responses
+    """
+    import import_dart_data
+
+    output = Path(output)
+    output.joinpath('fnlttSinglAcntAll').mkdir(parents=True, exist_ok=True)
+    counts = {'recorded': 0, 'skipped': 0}
+    if with_corp_code:
+        import_dart_data.fetch_corp_code_from_dart(str(output / 'corp-code.zip'), force=True)
+        counts['recorded'] += 1
+    for corp_code in corps:
+        for year in years:
+            for reprt_code in QUARTER_CODES:
+                p = output / 'fnlttSinglAcntAll' / quarter_fixture_name(corp_code, year, reprt_code)
+                if p.exists():
+                    counts['skipped'] += 1
+                    continue
+                data = import_dart_data.get_quarter_corp_data_from_dart(corp_code, year, reprt_code, refresh=True)
+                p.write_text(json.dumps(data, ensure_ascii=False))
+                counts['recorded'] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='record DART responses for bench_import.py --fixtures')
+    parser.add_argument('--output', default=str(Path(__file__).resolve().parent / 'fixtures'))
+    parser.add_argument('--corps', nargs='+', required=True, help='corp_code list')
+    parser.add_argument('--years', nargs='+', type=int, required=True)
+    parser.add_argument('--no-corp-code', action='store_true', help='do not record corpCode.xml')
+    args = parser.parse_args()
+    print(record(args.output, args.corps, args.years, with_corp_code=not args.no_corp_code))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+"""Local stand-ins for OpenDART and Elasticsearch used by the benchmarks.
+
+    DartStub replays recorded responses from a fixtures directory
+    (see record_fixtures.py) and synthesizes deterministic ones for
+    everything that is not recorded:
+
+        fixtures/corp-code.zip
+        fixtures/fnlttSinglAcntAll/<corp_code>-<bsns_year>-<reprt_code>.json
+
+    EsStub accepts what the importer sends (bulk, index, alias, template,
+    search, scroll and point in time requests), keeps only counters and
+    answers like Elasticsearch 8.
+
+    Both run in their own process so that they do not share the GIL with
+    the importer. GET /_stub/stats returns the counters of a stub.
+"""
+import io
+import json
+import multiprocessing
+import random
+import socket
+import threading
+import time
+import zipfile
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+QUARTER_CODES = ['11013', '11012', '11014', '11011']
+STATEMENTS = [('BS', '재무상태표'), ('IS', '손익계산서'), ('CIS', '포괄손익계산서'), ('CF', '현금흐름표')]
+
+
+def synthesize_corp_code_zip(ncorps, listed_ratio=0.1, seed=0) -> bytes:
+    """CORPCODE.xml of ncorps corps in a zip, like corpCode.xml returns."""
+    rnd = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<result>']
+    for i in range(ncorps):
+        stock_code = f'{i:06d}' if rnd.random() < listed_ratio else ' '
+        lines.append(f'<list><corp_code>{i:08d}</corp_code><corp_name>{escape(f"회사{i}")}</corp_name>'
+                     f'<stock_code>{stock_code}</stock_code><modify_date>20220101</modify_date></list>')
+    lines.append('</result>')
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('CORPCODE.xml', '\n'.join(lines))
+    return buf.getvalue()
+
+
+def has_data(corp_code, data_ratio) -> bool:
+    # 대부분의 corp 는 재무제표가 없다(013)
+    return zlib.crc32(corp_code.encode()) % 1000 < data_ratio * 1000
+
+
+def synthesize_quarter(corp_code, bsns_year, reprt_code, rows=150) -> dict:
+    """A deterministic fnlttSinglAcntAll response with rows accounts."""
+    rnd = random.Random(f'{corp_code}-{bsns_year}-{reprt_code}')
+    q = QUARTER_CODES.index(reprt_code) + 1
+    data = []
+    for i in range(rows):
+        sj_div, sj_nm = STATEMENTS[i % len(STATEMENTS)]
+        amount = rnd.randint(-10 ** 11, 10 ** 13)
+        row = {
+            'rcept_no': f'{bsns_year}0515{int(corp_code) % 1000000:06d}', 'reprt_code': reprt_code,
+            'bsns_year': str(bsns_year), 'corp_code': corp_code, 'sj_div': sj_div, 'sj_nm': sj_nm,
+            'account_id': f'ifrs-full_Account{i // len(STATEMENTS)}', 'account_nm': f'계정{i // len(STATEMENTS)}',
+            'account_detail': '-', 'thstrm_nm': f'제 {bsns_year} 기 {q}분기', 'thstrm_amount': f'{amount:,}',
+            'frmtrm_nm': f'제 {int(bsns_year) - 1} 기', 'frmtrm_amount': str(rnd.randint(0, 10 ** 12)),
+            'ord': str(i), 'currency': 'KRW',
+        }
+        if sj_div in ('IS', 'CIS'):
+            row['thstrm_add_amount'] = str(amount * q)
+            row['frmtrm_q_amount'] = str(rnd.randint(0, 10 ** 12))
+            row['frmtrm_add_amount'] = str(rnd.randint(0, 10 ** 12))
+        data.append(row)
+    return {'status': '000', 'message': '정상', 'list': data}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # header 와 body 를 따로 쓰므로 Nagle 때문에 응답마다 40ms 씩 늦어지지 않도록
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body: bytes, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status, data, headers=None):
+        self.send_body(status, json.dumps(data, ensure_ascii=False).encode(), headers=headers)
+
+    def read_body(self) -> bytes:
+        n = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(n) if n else b''
+
+    def count(self, name, n=1):
+        with self.server.lock:
+            self.server.stats[name] += n
+
+
+class DartStubHandler(StubHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == '/_stub/stats':
+            return self.send_json(200, dict(self.server.stats))
+
+        self.count('requests')
+        options = self.server.options
+        if options['latency'] > 0:
+            time.sleep(options['latency'])
+        if options['error_rate'] > 0 and self.server.random.random() < options['error_rate']:
+            self.count('injected_errors')
+            return self.send_body(503, b'Service Unavailable', content_type='text/plain')
+
+        endpoint = url.path.rsplit('/', 1)[-1]
+        self.count(endpoint)
+        if endpoint == 'corpCode.xml':
+            return self.send_body(200, self.server.corp_code_zip, content_type='application/x-msdownload')
+        if endpoint == 'fnlttSinglAcntAll.json':
+            return self.send_json(200, self.quarter(params))
+        if endpoint == 'list.json':
+            return self.send_json(200, {'status': '013', 'message': '조회된 데이타가 없습니다.'})
+        return self.send_json(200, {'status': '100', 'message': f'unknown endpoint {endpoint}'})
+
+    def quarter(self, params) -> dict:
+        corp_code, year, reprt_code = params.get('corp_code'), params.get('bsns_year'), params.get('reprt_code')
+        name = quarter_fixture_name(corp_code, year, reprt_code)
+        recorded = self.server.fixtures.joinpath('fnlttSinglAcntAll', name)
+        if recorded.exists():
+            return json.loads(recorded.read_text())
+        if not has_data(corp_code, self.server.options['data_ratio']):
+            return {'status': '013', 'message': '조회된 데이타가 없습니다.'}
+        return synthesize_quarter(corp_code, year, reprt_code, rows=self.server.options['rows'])
+
+
+class EsStubHandler(StubHandler):
+    ES_HEADERS = {'X-Elastic-Product': 'Elasticsearch'}
+
+    def reply(self, data, status=200):
+        self.send_json(status, data, headers=self.ES_HEADERS)
+
+    def resolve(self, name):
+        """Physical indices of an index, alias or comma separated list."""
+        out = []
+        for n in name.split(','):
+            if n in self.server.indices:
+                out.append(n)
+            else:
+                out += [i for i, a in self.server.indices.items() if n in a]
+        return out
+
+    def do_HEAD(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        if len(parts) == 2 and parts[0] == '_alias':
+            found = any(parts[1] in a for a in self.server.indices.values())
+        elif len(parts) == 1:
+            found = bool(self.resolve(parts[0]))
+        else:
+            found = False
+        self.send_body(200 if found else 404, b'', headers=self.ES_HEADERS)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        if url.path == '/_stub/stats':
+            return self.send_json(200, dict(self.server.stats) | {'indices': sorted(self.server.indices)})
+        if not parts:
+            return self.reply({'name': 'es-stub', 'cluster_name': 'stub', 'version': {
+                'number': '8.6.2', 'build_flavor': 'default', 'lucene_version': '9.4.2'},
+                'tagline': 'You Know, for Search'})
+        if parts[0] == '_alias' and len(parts) == 2:
+            return self.reply({i: {'aliases': {parts[1]: {}}} for i, a in self.server.indices.items()
+                               if parts[1] in a})
+        if len(parts) == 2 and parts[1] == '_alias':
+            return self.reply({i: {'aliases': {a: {} for a in self.server.indices.get(i, ())}}
+                               for i in self.resolve(parts[0])})
+        if len(parts) == 2 and parts[1] == '_settings':
+            return self.reply({i: {'settings': {}} for i in self.resolve(parts[0])})
+        self.read_body()
+        if parts[-1] in ('_search', '_count'):
+            return self.search(parts)
+        return self.reply({'error': 'not found', 'status': 404}, status=404)
+
+    def do_PUT(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        body = self.read_body()
+        if parts[-1] == '_bulk':
+            return self.bulk(parts, body)
+        if parts[0] == '_index_template':
+            return self.reply({'acknowledged': True})
+        if len(parts) == 1:
+            # index 생성
+            spec = json.loads(body) if body else {}
+            with self.server.lock:
+                if parts[0] in self.server.indices:
+                    return self.reply({'error': {'type': 'resource_already_exists_exception'}, 'status': 400},
+                                      status=400)
+                self.server.indices[parts[0]] = set(spec.get('aliases', {}))
+            return self.reply({'acknowledged': True, 'shards_acknowledged': True, 'index': parts[0]})
+        if parts[-1] == '_settings':
+            return self.reply({'acknowledged': True})
+        if len(parts) == 3 and parts[1] in ('_doc', '_create'):
+            self.count('documents')
+            return self.reply({'_index': parts[0], '_id': parts[2], '_version': 1, 'result': 'created',
+                               '_shards': {'total': 1, 'successful': 1, 'failed': 0}}, status=201)
+        return self.reply({'acknowledged': True})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        body = self.read_body()
+        if parts[-1] == '_bulk':
+            return self.bulk(parts, body)
+        if parts[-1] in ('_search', '_count'):
+            return self.search(parts)
+        if parts[-1] == '_pit':
+            return self.reply({'id': 'stub-pit'})
+        if parts[-1] == '_aliases':
+            return self.update_aliases(json.loads(body))
+        if parts[-1] in ('_refresh', '_forcemerge'):
+            return self.reply({'_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+        if parts[-1] == '_delete_by_query':
+            return self.reply({'deleted': 0, 'failures': []})
+        if len(parts) >= 2 and parts[1] == '_doc':
+            self.count('documents')
+            return self.reply({'_index': parts[0], '_id': parts[-1], 'result': 'created'}, status=201)
+        return self.reply({'acknowledged': True})
+
+    def do_DELETE(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        # keep-alive 연결이므로 body 를 모두 읽어야 한다
+        self.read_body()
+        if parts[:2] == ['_search', 'scroll'] or parts[-1] == '_pit':
+            return self.reply({'succeeded': True, 'num_freed': 1})
+        with self.server.lock:
+            for i in self.resolve(parts[0]):
+                self.server.indices.pop(i, None)
+        return self.reply({'acknowledged': True})
+
+    def search(self, parts):
+        self.count('searches')
+        index = parts[0] if len(parts) > 1 else ''
+        total = self.server.stats[f'docs:{index}']
+        resp = {'took': 0, 'timed_out': False, '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+                'hits': {'total': {'value': total, 'relation': 'eq'}, 'hits': []}}
+        if 'scroll' in self.path:
+            resp['_scroll_id'] = 'stub-scroll'
+        if parts[-1] == '_count':
+            resp = {'count': total}
+        return self.reply(resp)
+
+    def bulk(self, parts, body):
+        default_index = parts[0] if len(parts) > 1 else None
+        lines = body.splitlines()
+        items = []
+        i = 0
+        while i < len(lines):
+            if not lines[i].strip():
+                i += 1
+                continue
+            action = json.loads(lines[i])
+            op, meta = next(iter(action.items()))
+            index = meta.get('_index', default_index)
+            items.append({op: {'_index': index, '_id': meta.get('_id'), '_version': 1, 'result': 'created',
+                               'status': 201, '_shards': {'total': 1, 'successful': 1, 'failed': 0}}})
+            self.count(f'docs:{index.split("-", 1)[0] if index else index}')
+            # delete 말고는 다음 줄이 문서다
+            i += 1 if op == 'delete' else 2
+        self.count('bulk_requests')
+        self.count('documents', len(items))
+        self.count('bulk_bytes', len(body))
+        if self.server.options.get('bulk_latency', 0) > 0:
+            time.sleep(self.server.options['bulk_latency'])
+        return self.reply({'took': 1, 'errors': False, 'items': items})
+
+    def update_aliases(self, body):
+        with self.server.lock:
+            for action in body.get('actions', []):
+                op, spec = next(iter(action.items()))
+                if op == 'add':
+                    self.server.indices.setdefault(spec['index'], set()).add(spec['alias'])
+                elif op == 'remove':
+                    for a in spec.get('aliases', [spec.get('alias')]):
+                        self.server.indices.get(spec['index'], set()).discard(a)
+                elif op == 'remove_index':
+                    self.server.indices.pop(spec['index'], None)
+        return self.reply({'acknowledged': True})
+
+
+def _serve(kind, options, port_queue):
+    handler = DartStubHandler if kind == 'dart' else EsStubHandler
+    server = ThreadingHTTPServer(('127.0.0.1', options.get('port', 0)), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.stats = Counter()
+    server.options = options
+    server.random = random.Random(options.get('seed', 0))
+    server.indices = dict()
+    if kind == 'dart':
+        server.fixtures = Path(options.get('fixtures') or '.')
+        recorded = server.fixtures.joinpath('corp-code.zip')
+        server.corp_code_zip = recorded.read_bytes() if options.get('fixtures') and recorded.exists() \
+            else synthesize_corp_code_zip(options['corps'], options['listed_ratio'], options.get('seed', 0))
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class StubServer:
+    def __init__(self, kind, **options):
+        """Runs a stub in a child process.
+
+        Args:
+            kind: 'dart' or 'es'
+            **options:
+                corps : synthesized corps in corpCode.xml. 1000
+                listed_ratio : share of corps with a stock_code. 0.1
+                data_ratio : share of corps with financial statements. 0.2
+                rows : accounts per synthesized quarter. 150
+                latency : seconds added to every DART response. 0
+                error_rate : share of DART responses which are 503. 0
+                bulk_latency : seconds added to every ES bulk response. 0
+                fixtures : directory of recorded responses. None
+        """
+        self.kind = kind
+        self.options = {'corps': 1000, 'listed_ratio': 0.1, 'data_ratio': 0.2, 'rows': 150, 'latency': 0.0,
+                        'error_rate': 0.0, 'fixtures': None} | options
+        self.port = None
+        self._proc = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        ctx = multiprocessing.get_context('spawn')
+        port_queue = ctx.Queue()
+        self._proc = ctx.Process(target=_serve, args=(self.kind, self.options, port_queue), daemon=True,
+                                 name=f'{self.kind}-stub')
+        self._proc.start()
+        self.port = port_queue.get(timeout=30)
+        return self
+
+    def stats(self) -> dict:
+        import urllib.request
+        with urllib.request.urlopen(f'{self.url}/_stub/stats') as r:
+            return json.loads(r.read())
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.join()
+            self._proc = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def quarter_fixture_name(corp_code, bsns_year, reprt_code) -> str:
+    return f'{corp_code}-{bsns_year}-{reprt_code}.json'
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""Columnar (Parquet) copy of the financial statements for offline analytics.
+
+    Rows are partitioned by bsns_year and reprt_code (hive layout), amounts
+    are int64 and the repeated names are dictionary encoded, so a scan of one
+    account over every corp reads only the needed columns and row groups.
+
+    pyarrow is optional. It is only needed for this module.
+"""
+import ast
+import json
+import os
+import re
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+
+from corp_data_transform import AMOUNT_FIELDS, parse_amount_column
+
+DICTIONARY_FIELDS = ('sj_div', 'sj_nm', 'account_id', 'account_nm', 'currency')
+STRING_FIELDS = ('rcept_no', 'corp_code', 'account_detail', 'thstrm_nm', 'frmtrm_nm', 'frmtrm_q_nm', 'bfefrmtrm_nm')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        return pyarrow
+    except ImportError:
+        raise ImportError('pyarrow is required for the columnar store. pip install pyarrow')
+
+
+def corp_data_schema():
+    pa = _pyarrow()
+    return pa.schema(
+        [(f, pa.string()) for f in STRING_FIELDS]
+        + [(f, pa.dictionary(pa.int32(), pa.string())) for f in DICTIONARY_FIELDS]
+        + [(f, pa.int64()) for f in AMOUNT_FIELDS]
+        + [('ord', pa.int32()), ('bsns_year', pa.int32()), ('reprt_code', pa.string())]
+    )
+
+
+def rows_to_table(rows):
+    pa = _pyarrow()
+    schema = corp_data_schema()
+    columns = dict()
+    for f in STRING_FIELDS + DICTIONARY_FIELDS + ('reprt_code',):
+        columns[f] = [r.get(f) for r in rows]
+    for f in AMOUNT_FIELDS:
+        columns[f] = parse_amount_column([r.get(f) for r in rows])
+    columns['ord'] = [int(r['ord']) if r.get('ord') else None for r in rows]
+    columns['bsns_year'] = [int(r['bsns_year']) for r in rows]
+    return pa.Table.from_pydict(
+        {f.name: pa.array(columns[f.name], type=f.type.value_type if pa.types.is_dictionary(f.type) else f.type)
+         for f in schema}
+    ).cast(schema)
+
+
+def decode_quarter(qdata):
+    """Quarter data of DartFileManager.load(). Old caches stored Python repr instead of json."""
+    if type(qdata) != str:
+        return qdata
+    try:
+        return json.loads(qdata)
+    except ValueError:
+        return ast.literal_eval(qdata)
+
+
+class ColumnarStore:
+    def __init__(self, path, rows_per_file=500000):
+        """Partitioned parquet dataset with incremental append.
+
+            Exported (corp_code, bsns_year, reprt_code) are listed in
+            _exported.jsonl so appending the same quarter twice is a no-op.
+
+        Args:
+            path: dataset directory
+            rows_per_file: rows buffered before a parquet file is written
+        """
+        self.path = Path(path)
+        self.rows_per_file = rows_per_file
+        self._rows = []
+        self._lock = threading.Lock()
+        self._manifest_path = self.path.joinpath('_exported.jsonl')
+        self._exported = set()
+        if self._manifest_path.exists():
+            with open(self._manifest_path) as fd:
+                self._exported = {tuple(json.loads(line)) for line in fd if line.strip()}
+        self._pending_keys = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def has_quarter(self, corp_code, year, reprt_code) -> bool:
+        return (corp_code, str(year), reprt_code) in self._exported
+
+    def append(self, qdata) -> int:
+        """Buffers the rows of one fnlttSinglAcntAll response.
+
+        Returns:
+            int: number of rows appended. 0 for no data or an exported quarter
+        """
+        qdata = decode_quarter(qdata)
+        if type(qdata) != dict or qdata.get('status') != '000' or not qdata.get('list'):
+            return 0
+        rows = qdata['list']
+        key = (rows[0]['corp_code'], rows[0]['bsns_year'], rows[0]['reprt_code'])
+        with self._lock:
+            if key in self._exported:
+                return 0
+            self._exported.add(key)
+            self._pending_keys.append(key)
+            self._rows.extend(rows)
+            if len(self._rows) >= self.rows_per_file:
+                self._flush()
+        return len(rows)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        pa = _pyarrow()
+        table = rows_to_table(self._rows)
+        pa.dataset.write_dataset(
+            table, self.path, format='parquet',
+            partitioning=pa.dataset.partitioning(
+                pa.schema([('bsns_year', pa.int32()), ('reprt_code', pa.string())]), flavor='hive'),
+            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore',
+        )
+        # parquet 을 쓴 다음에 manifest 에 기록한다
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._manifest_path, 'a') as fd:
+            for key in self._pending_keys:
+                fd.write(json.dumps(key) + '\n')
+        self._rows = []
+        self._pending_keys = []
+
+    def dataset(self):
+        pa = _pyarrow()
+        return pa.dataset.dataset(self.path, format='parquet', partitioning='hive', schema=corp_data_schema(),
+                                  exclude_invalid_files=True)
+
+    def read_account(self, account_id=None, account_nm=None, columns=None, years=None):
+        """Reads one account of every corp. Only the requested columns are decoded.
+
+        Returns:
+            pyarrow.Table
+        """
+        pc = _pyarrow().compute
+        expr = None
+        if account_id is not None:
+            expr = pc.field('account_id') == account_id
+        if account_nm is not None:
+            e = pc.field('account_nm') == account_nm
+            expr = e if expr is None else expr & e
+        if years is not None:
+            e = pc.field('bsns_year').isin([int(y) for y in years])
+            expr = e if expr is None else expr & e
+        columns = columns or ['corp_code', 'bsns_year', 'reprt_code', 'sj_div', 'account_id', 'account_nm',
+                              'thstrm_amount']
+        return self.dataset().to_table(columns=columns, filter=expr)
+
+
+def iter_cached_quarters(data_dir, data_file_prefix='financial-statements'):
+    """Yields every quarter stored by DartFileManager under data_dir/corp_data."""
+    for zf_name in sorted(Path(data_dir).joinpath('corp_data').glob(f'*/{data_file_prefix}-*.zip')):
+        with zipfile.ZipFile(zf_name) as zf:
+            for name in sorted(zf.namelist()):
+                if re.match(data_file_prefix + r'-([0-9]{4})-([1-4])Q.json', name):
+                    with zf.open(name) as fd:
+                        yield fd.read().decode()
+
+
+def export_cache(data_dir, path, logger=None) -> int:
+    """Appends every cached quarter which is not exported yet. Returns the number of rows."""
+    n = 0
+    with ColumnarStore(path) as store:
+        for qdata in iter_cached_quarters(data_dir):
+            n += store.append(qdata)
+    if logger:
+        logger.info(f'Exported {n} rows to {path}')
+    return n
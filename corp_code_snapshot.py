@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import json
+import os
+from pathlib import Path
+
+
+class CorpCodeSnapshot:
+    def __init__(self, path):
+        """Compact copy of the indexed corp_code records. corp_code -> modify_date
+
+            Comparing a fresh CORPCODE.xml with it tells which corps are new or
+            modified without reading the corp_code index document by document.
+
+        Args:
+            path: json file, usually DART_RESULT_DIR/corp-code-snapshot.json
+        """
+        self.path = Path(path)
+        self._modify_dates = dict()
+        if self.path.exists():
+            with open(self.path) as fd:
+                self._modify_dates = json.load(fd)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def __len__(self):
+        return len(self._modify_dates)
+
+    def __contains__(self, corp_code):
+        return corp_code in self._modify_dates
+
+    def update(self, records):
+        """records: iterable of dict with corp_code and modify_date"""
+        for r in records:
+            self._modify_dates[r['corp_code']] = r['modify_date']
+
+    def diff(self, records, changes: dict):
+        """Filters the new or modified records.
+
+        Args:
+            records: iterable of dict from parse_corp_code()
+            changes: counters updated in place. new, modified, unchanged, missing
+
+        Yields:
+            dict: records which are not in the snapshot or have another modify_date
+        """
+        seen = set()
+        for r in records:
+            corp_code = r['corp_code']
+            seen.add(corp_code)
+            modify_date = self._modify_dates.get(corp_code)
+            if modify_date is None:
+                changes['new'] = changes.get('new', 0) + 1
+            elif modify_date != r['modify_date']:
+                changes['modified'] = changes.get('modified', 0) + 1
+            else:
+                changes['unchanged'] = changes.get('unchanged', 0) + 1
+                continue
+            yield r
+        # DART 목록에서 사라진 corp 는 색인에서 지우지 않고 개수만 알린다
+        changes['missing'] = len(self._modify_dates.keys() - seen)
+
+    def save(self):
+        if not self.path.parent.exists():
+            os.makedirs(self.path.parent)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as fd:
+            json.dump(self._modify_dates, fd, separators=(',', ':'))
+        os.replace(tmp, self.path)
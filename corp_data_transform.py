@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import functools
+
+QUARTER_CODES = ['11013', '11012', '11014', '11011']
+
+# 금액 필드. DART 는 "56,799,776,000,000", "-", "" 같은 문자열로 준다
+AMOUNT_FIELDS = ('thstrm_amount', 'thstrm_add_amount', 'frmtrm_amount', 'frmtrm_q_amount', 'frmtrm_add_amount',
+                 'bfefrmtrm_amount')
+
+_AMOUNT_STRIP = str.maketrans('', '', ', ')
+_NULL_AMOUNTS = frozenset(['', '-'])
+
+
+def parse_amount_column(values) -> list:
+    """Parses one amount column in a single pass.
+
+    Args:
+        values: list of DART amount strings (or None)
+
+    Returns:
+        list: int or None for '-', '' and unparsable values
+    """
+    out = []
+    append = out.append
+    for v in values:
+        if v is None or v in _NULL_AMOUNTS:
+            append(None)
+            continue
+        if type(v) == int:
+            append(v)
+            continue
+        v = v.translate(_AMOUNT_STRIP)
+        if v.startswith('(') and v.endswith(')'):
+            v = '-' + v[1:-1]
+        try:
+            append(int(v))
+        except ValueError:
+            append(None)
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def _time_frame_bounds(bsns_year, reprt_code) -> tuple:
+    """(gte, lte) of the quarter. Computed once per key, only the first call pays for pendulum."""
+    import pendulum
+
+    y = int(bsns_year)
+    month = QUARTER_CODES.index(reprt_code) * 3 + 1
+    return (
+        pendulum.datetime(y, month, 1).start_of('month').start_of('day').in_tz('Asia/Seoul').to_iso8601_string(),
+        pendulum.datetime(y, month + 2, 1).end_of('month').end_of('day').in_tz('Asia/Seoul').to_iso8601_string()
+    )
+
+
+def time_frame(bsns_year, reprt_code) -> dict:
+    """Quarter period of (bsns_year, reprt_code) for the time_frame date_range.
+
+        The bounds are cached, the dict is new on every call so that rows do
+        not share it.
+    """
+    gte, lte = _time_frame_bounds(bsns_year, reprt_code)
+    return {'gte': gte, 'lte': lte}
+
+
+def transform_quarter(rows) -> list:
+    """Normalizes the rows of one fnlttSinglAcntAll response in place.
+
+        - every *_amount field present in a row becomes int64 or None
+        - ord becomes int
+        - time_frame is attached from the precomputed table, one dict per row
+
+    Args:
+        rows: qdata['list']
+
+    Returns:
+        list: rows
+    """
+    for f in AMOUNT_FIELDS:
+        idx = [i for i, r in enumerate(rows) if f in r]
+        if not idx:
+            continue
+        parsed = parse_amount_column([rows[i][f] for i in idx])
+        for i, v in zip(idx, parsed):
+            rows[i][f] = v
+
+    for r in rows:
+        if r.get('ord'):
+            r['ord'] = int(r['ord'])
+        r['time_frame'] = time_frame(r['bsns_year'], r['reprt_code'])
+    return rows
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import hashlib
+
+from corp_data_transform import QUARTER_CODES, time_frame
+
+# 손익계산서, 포괄손익계산서만 기간(3개월) 금액이 있다
+FLOW_STATEMENTS = ('IS', 'CIS')
+
+NON_STANDARD_ACCOUNT_ID = '-표준계정코드 미사용-'
+
+CORP_METRICS_MAPPINGS = {
+    "properties": {
+        "corp_code": {"type": "keyword"},
+        "bsns_year": {"type": "date", "format": "yyyy"},
+        "reprt_code": {"type": "keyword"},
+        # 1 ~ 4
+        "quarter": {"type": "integer"},
+        "sj_div": {"type": "keyword"},
+        "account_id": {"type": "keyword"},
+        "account_nm": {"type": "keyword"},
+        # 3개월 금액. 4Q = 사업보고서 - 3분기 누적
+        "quarter_amount": {"type": "long"},
+        # 전년 동기 3개월 금액
+        "prior_quarter_amount": {"type": "long"},
+        # 최근 4개 분기 합
+        "ttm_amount": {"type": "long"},
+        "yoy_delta": {"type": "long"},
+        "yoy_rate": {"type": "double"},
+        "currency": {"type": "keyword"},
+        "time_frame": {"type": "date_range", "format": "strict_date_optional_time_nanos"},
+    }
+}
+
+
+def _account_key(row):
+    account_id = row.get('account_id')
+    if not account_id or account_id == NON_STANDARD_ACCOUNT_ID:
+        return row['sj_div'], 'nm:' + row.get('account_nm', '')
+    return row['sj_div'], account_id
+
+
+def _sub(a, b):
+    return None if a is None or b is None else a - b
+
+
+def _sum(values):
+    return None if any(v is None for v in values) else sum(values)
+
+
+def derive_year_metrics(corp_code, year_rows: dict) -> list:
+    """Standalone quarter, TTM and YoY values of one corp year.
+
+        Needs all four reports of the year:
+
+        quarter   : 1Q~3Q thstrm_amount, 4Q = 11011 thstrm_amount - 11014 thstrm_add_amount
+        prior     : same from frmtrm_q_amount / frmtrm_amount / frmtrm_add_amount
+        ttm at kQ : this year 1Q..kQ + prior year (k+1)Q..4Q
+
+    Args:
+        corp_code:
+        year_rows: reprt_code -> qdata['list'] for the four QUARTER_CODES, already transformed by
+                   transform_quarter()
+
+    Returns:
+        list: corp_metrics documents (one per account per quarter)
+    """
+    if any(not year_rows.get(rt) for rt in QUARTER_CODES):
+        return []
+
+    by_report = dict()
+    for rt in QUARTER_CODES:
+        by_report[rt] = {_account_key(r): r for r in year_rows[rt] if r.get('sj_div') in FLOW_STATEMENTS}
+
+    q1, q2, q3, annual = (by_report[rt] for rt in QUARTER_CODES)
+    docs = []
+    for key in q1.keys() & q2.keys() & q3.keys() & annual.keys():
+        r1, r2, r3, r4 = q1[key], q2[key], q3[key], annual[key]
+        current = [r1.get('thstrm_amount'), r2.get('thstrm_amount'), r3.get('thstrm_amount'),
+                   _sub(r4.get('thstrm_amount'), r3.get('thstrm_add_amount'))]
+        prior = [r1.get('frmtrm_q_amount', r1.get('frmtrm_amount')), r2.get('frmtrm_q_amount'),
+                 r3.get('frmtrm_q_amount'), _sub(r4.get('frmtrm_amount'), r3.get('frmtrm_add_amount'))]
+
+        for k, rt in enumerate(QUARTER_CODES):
+            row = by_report[rt][key]
+            yoy_delta = _sub(current[k], prior[k])
+            doc = {
+                'corp_code': corp_code,
+                'bsns_year': row['bsns_year'],
+                'reprt_code': rt,
+                'quarter': k + 1,
+                'sj_div': key[0],
+                'account_id': row.get('account_id'),
+                'account_nm': row.get('account_nm'),
+                'quarter_amount': current[k],
+                'prior_quarter_amount': prior[k],
+                'ttm_amount': _sum(current[:k + 1] + prior[k + 1:]),
+                'yoy_delta': yoy_delta,
+                'yoy_rate': yoy_delta / abs(prior[k]) if yoy_delta is not None and prior[k] else None,
+                'currency': row.get('currency'),
+                'time_frame': time_frame(row['bsns_year'], rt),
+            }
+            docs.append(doc)
+    return docs
+
+
+def corp_metrics_doc_id(doc) -> str:
+    key = '|'.join(str(doc[f]) for f in ('corp_code', 'bsns_year', 'reprt_code', 'sj_div', 'account_id',
+                                         'account_nm'))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def generate_corp_metrics_actions(corp_code, year_rows: dict, index='corp_metrics'):
+    for doc in derive_year_metrics(corp_code, year_rows):
+        yield {'_index': index, '_id': corp_metrics_doc_id(doc), '_source': doc}
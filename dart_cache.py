@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from dart_quota import KST
+
+DART_STATUS_OK = '000'
+DART_STATUS_NO_DATA = '013'
+
+# 요청마다 바뀌거나 결과와 무관한 parameter
+IGNORED_PARAMS = frozenset(['crtfc_key'])
+
+
+def cache_key(url, params) -> str:
+    """endpoint and the sorted params without crtfc_key. Values are compared as strings."""
+    path = urlsplit(url).path
+    items = sorted((k, str(v)) for k, v in params.items() if k not in IGNORED_PARAMS and v is not None)
+    return path + '?' + json.dumps(items, ensure_ascii=False, separators=(',', ':'))
+
+
+def is_closed_year(year, now=None) -> bool:
+    """Every report of the fiscal year is due (사업보고서 is due 90 days after the year end).
+
+        Amendments of a closed year are picked up by the filing list sync, not by expiry.
+    """
+    now = now or datetime.now(tz=KST)
+    return (now.year, now.month) > (int(year) + 1, 6)
+
+
+class DartResponseCache:
+    def __init__(self, path, ttl=86400, no_data_ttl=30 * 86400):
+        """Local cache of DART JSON responses.
+
+            status 000 : ttl, or forever when bsns_year is a closed year
+            status 013 : no_data_ttl (negative caching)
+            others     : not cached (quota, key and server errors)
+
+        Args:
+            path: sqlite file, usually DART_RESULT_DIR/dart-response-cache.sqlite
+            ttl: seconds a response of an open year is fresh
+            no_data_ttl: seconds a "no data" response is fresh
+        """
+        self.path = Path(path)
+        if not self.path.parent.exists():
+            os.makedirs(self.path.parent)
+        self.ttl = ttl
+        self.no_data_ttl = no_data_ttl
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, status TEXT, body BLOB, stored REAL, expires REAL)')
+        self._db.commit()
+
+    def ttl_for(self, params, data) -> float:
+        """Seconds data stays fresh. None is forever and 0 is not cached."""
+        status = data.get('status')
+        if status == DART_STATUS_NO_DATA:
+            return self.no_data_ttl
+        if status != DART_STATUS_OK:
+            return 0
+        if params.get('bsns_year') and is_closed_year(params['bsns_year']):
+            return None
+        return self.ttl
+
+    def get(self, url, params):
+        """Returns: the cached dict or None"""
+        key = cache_key(url, params)
+        with self._lock:
+            row = self._db.execute('SELECT body, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            if row[1] is not None and row[1] < time.time():
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, url, params, data):
+        ttl = self.ttl_for(params, data)
+        if ttl == 0:
+            return
+        now = time.time()
+        body = zlib.compress(json.dumps(data, ensure_ascii=False).encode())
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                             (cache_key(url, params), data.get('status'), body, now,
+                              None if ttl is None else now + ttl))
+            self._db.commit()
+            self.stats['stores'] += 1
+
+    def hit_ratio(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats, hit_ratio=round(self.hit_ratio(), 3))
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            n = self._db.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?',
+                                 (time.time(),)).rowcount
+            self._db.commit()
+        return n
+
+    def close(self):
+        with self._lock:
+            self._db.close()
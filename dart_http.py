@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import collections
+import re
+import threading
+import time
+
+# requests, urllib3 의 오류 메시지에는 crtfc_key 가 든 url 이 그대로 있다
+QUERY_STRING_PATTERN = re.compile(r'\?[^\s\'")]*')
+
+
+class DartResponseError(Exception):
+    """DART answered something which is not the expected payload."""
+
+
+def strip_query_string(text) -> str:
+    return QUERY_STRING_PATTERN.sub('', text)
+
+
+class LatencyStats:
+    def __init__(self, window=1000):
+        """Per-request latency in seconds. Percentiles use the last window requests."""
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._recent = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.min = seconds if self.min is None else min(self.min, seconds)
+            self.max = seconds if self.max is None else max(self.max, seconds)
+            self._recent.append(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent)
+            if not recent:
+                return {'count': 0}
+            return {
+                'count': self.count,
+                'mean': self.total / self.count,
+                'min': self.min,
+                'max': self.max,
+                'p50': recent[len(recent) // 2],
+                'p95': recent[min(int(len(recent) * 0.95), len(recent) - 1)],
+            }
+
+
+class DartHttpClient:
+    def __init__(self, pool_size=16, timeout=(5, 60), retries=5, backoff_factor=0.5):
+        """Shared keep-alive HTTP client for OpenDART.
+
+        Args:
+            pool_size: connections kept open per host. Should be >= fetch concurrency
+            timeout: (connect, read) timeout in seconds
+            retries: retries on connection errors and 5xx responses
+            backoff_factor: exponential backoff base (0.5, 1, 2, 4, ... seconds)
+        """
+        # requests 는 첫 client 를 만들 때 import 한다. import_dart_data 를 빨리 띄우기 위해
+        import requests
+        from urllib3.util.retry import Retry
+
+        self.timeout = timeout
+        self.retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        self.latency = LatencyStats()
+        self.session = requests.Session()
+        self.pool_size = 0
+        self.set_pool_size(pool_size)
+
+    def set_pool_size(self, pool_size):
+        from requests.adapters import HTTPAdapter
+
+        if pool_size == self.pool_size:
+            return
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=self.retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, params=None):
+        """Returns: requests.Response
+
+        Raises:
+            DartResponseError: HTTP error status, or a connection error without the query string in its message
+        """
+        import requests
+
+        t = time.perf_counter()
+        try:
+            r = self.session.get(url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            # 원래 예외는 traceback 에도 crtfc_key 를 남기므로 잇지 않는다
+            raise DartResponseError(f'{url} : {type(e).__name__} {strip_query_string(str(e))}') from None
+        self.latency.add(time.perf_counter() - t)
+        if r.status_code >= 400:
+            raise DartResponseError(f'{url} : HTTP {r.status_code}')
+        return r
+
+    @staticmethod
+    def is_json(r) -> bool:
+        return 'json' in r.headers.get('Content-Type', '')
+
+    @staticmethod
+    def decode_json(r) -> dict:
+        # query string 에는 crtfc_key 가 있으므로 남기지 않는다
+        url = r.url.split('?')[0]
+        try:
+            data = r.json()
+        except ValueError:
+            raise DartResponseError(f'{url} : not a json response ({r.headers.get("Content-Type")}) '
+                                    f'{r.content[:200]!r}')
+        if type(data) != dict:
+            raise DartResponseError(f'{url} : unexpected json {str(data)[:200]}')
+        return data
+
+    def close(self):
+        self.session.close()
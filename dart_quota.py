@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# OpenDART 사용한도는 한국시간 자정에 초기화된다
+KST = timezone(timedelta(hours=9))
+
+# 개인 인증키 하루 요청 한도
+DART_DAILY_LIMIT = 20000
+
+# 사용한도를 초과하였습니다.
+DART_STATUS_QUOTA_EXCEEDED = '020'
+
+
+class QuotaExhausted(Exception):
+    """All configured DART API keys reached their daily limit."""
+
+    def __init__(self, reset_at):
+        super().__init__(f'DART API quota exhausted until {reset_at.isoformat()}')
+        self.reset_at = reset_at
+
+
+def today_kst(now=None):
+    now = now or datetime.now(tz=KST)
+    return now.astimezone(KST).strftime('%Y%m%d')
+
+
+def next_reset_kst(now=None):
+    now = (now or datetime.now(tz=KST)).astimezone(KST)
+    return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def key_id(key):
+    """Ledger name of an API key. Raw keys are never written to disk."""
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """
+
+        Args:
+            rate: tokens added per second
+            capacity: bucket size. Default is rate (one second of burst)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Blocks until tokens are available."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class QuotaLedger:
+    def __init__(self, path, keep_days=7, flush_interval=1.0):
+        """Requests used per key per day, persisted as json.
+
+            {"20230417": {"<key_id>": {"used": 1234, "exhausted": false}}}
+
+            Used counts are written at most every flush_interval seconds, an
+            exhausted key at once. Call flush() at the end of a run.
+
+            Several processes may share the file, e.g. import workers. A flush
+            adds the requests of this process to the file under a lock and
+            reads the requests of the others.
+
+        Args:
+            path: ledger file. None keeps the ledger in memory only
+            keep_days: number of days kept in the file
+            flush_interval: seconds between writes of the used counts
+        """
+        self.path = Path(path) if path else None
+        self.keep_days = keep_days
+        self.flush_interval = flush_interval
+        self._days = dict()
+        # 아직 파일에 더하지 않은 이 process 의 요청
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flushed_at = None
+        if self.path and self.path.exists():
+            self._days = json.loads(self.path.read_text())
+
+    @staticmethod
+    def _day_entry(days, day, kid):
+        return days.setdefault(day, dict()).setdefault(kid, {'used': 0, 'exhausted': False})
+
+    def _entry(self, day, key):
+        return self._day_entry(self._days, day, key_id(key))
+
+    def used(self, key, day):
+        with self._lock:
+            return self._entry(day, key)['used']
+
+    def is_exhausted(self, key, day):
+        with self._lock:
+            return self._entry(day, key)['exhausted']
+
+    def add(self, key, day, n=1):
+        with self._lock:
+            self._entry(day, key)['used'] += n
+            self._day_entry(self._pending, day, key_id(key))['used'] += n
+            self._dirty = True
+            # 요청마다 파일을 쓰면 fetch thread 가 모두 이 lock 에서 기다린다
+            if self._flushed_at is None or time.monotonic() - self._flushed_at >= self.flush_interval:
+                self._flush()
+
+    def mark_exhausted(self, key, day):
+        with self._lock:
+            self._entry(day, key)['exhausted'] = True
+            self._day_entry(self._pending, day, key_id(key))['exhausted'] = True
+            self._flush()
+
+    def flush(self):
+        """Writes the used counts which are not written yet."""
+        with self._lock:
+            if self._dirty:
+                self._flush()
+
+    def _flush(self):
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+        if self.path is None:
+            self._pending = dict()
+            return
+        if not self.path.parent.exists():
+            os.makedirs(self.path.parent)
+        with open(self.path.with_suffix('.lock'), 'w') as lock:
+            # 다른 process 가 그 사이에 쓴 요청을 덮어쓰지 않도록 파일의 값에 더한다
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            days = json.loads(self.path.read_text()) if self.path.exists() else dict()
+            for day, keys in self._pending.items():
+                for kid, p in keys.items():
+                    e = self._day_entry(days, day, kid)
+                    e['used'] += p['used']
+                    e['exhausted'] = e['exhausted'] or p['exhausted']
+            for day in sorted(days)[:-self.keep_days]:
+                del days[day]
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(days, indent=1))
+            os.replace(tmp, self.path)
+        self._days = days
+        self._pending = dict()
+
+
+class DartKeyScheduler:
+    def __init__(self, keys, daily_limit=DART_DAILY_LIMIT, requests_per_second=10.0, ledger=None,
+                 wait_for_reset=True, logger=None):
+        """Paces DART requests and spreads them across API keys.
+
+        Args:
+            keys: list of crtfc_key
+            daily_limit: requests per key per day
+            requests_per_second: token bucket rate shared by all keys
+            ledger: QuotaLedger. Default is an in-memory ledger
+            wait_for_reset: sleep until the quota resets instead of raising QuotaExhausted
+            logger: None
+        """
+        if not keys:
+            raise ValueError('At least one DART API key is required')
+        self.keys = list(keys)
+        self.daily_limit = daily_limit
+        self.bucket = TokenBucket(requests_per_second)
+        self.ledger = ledger or QuotaLedger(None)
+        self.wait_for_reset = wait_for_reset
+        self.logger = logger or logging.getLogger()
+        self._lock = threading.Lock()
+
+    def _pick_key(self, day):
+        available = [k for k in self.keys
+                     if not self.ledger.is_exhausted(k, day) and self.ledger.used(k, day) < self.daily_limit]
+        if not available:
+            return None
+        # 가장 적게 쓴 key 부터 사용
+        return min(available, key=lambda k: self.ledger.used(k, day))
+
+    def remaining(self, day=None):
+        day = day or today_kst()
+        return sum(0 if self.ledger.is_exhausted(k, day) else max(self.daily_limit - self.ledger.used(k, day), 0)
+                   for k in self.keys)
+
+    def acquire(self):
+        """Waits for a rate limit token and returns the key to use for one request.
+
+        Raises:
+            QuotaExhausted: every key is used up and wait_for_reset is False
+        """
+        while True:
+            with self._lock:
+                day = today_kst()
+                key = self._pick_key(day)
+                if key is not None:
+                    self.ledger.add(key, day)
+            if key is not None:
+                self.bucket.acquire()
+                return key
+
+            reset_at = next_reset_kst()
+            if not self.wait_for_reset:
+                raise QuotaExhausted(reset_at)
+            self.logger.warning(f'DART API quota exhausted. Waiting until {reset_at.isoformat()}')
+            while datetime.now(tz=KST) < reset_at:
+                time.sleep(min(60.0, (reset_at - datetime.now(tz=KST)).total_seconds() + 1))
+
+    def exhaust(self, key):
+        """Marks key as used up for today (DART answered status 020)."""
+        self.ledger.mark_exhausted(key, today_kst())
+        self.logger.warning(f'DART API key {key_id(key)} reached its daily limit')
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+"""Index mappings, bulk-load settings and alias based migration.
+
+    Every index is reached through an alias of its name (corp_data, ...).
+    The physical index carries a timestamp (corp_data-20230101120000), so a
+    new mapping is rolled out by reindexing into a new physical index and
+    swapping the alias in one update_aliases call.
+"""
+import contextlib
+import threading
+import time
+from datetime import datetime, timezone
+
+from corp_metrics import CORP_METRICS_MAPPINGS
+from importer_metrics import IMPORTER_METRICS_MAPPINGS
+
+# filter, aggregation 하는 필드는 keyword 로 두고
+# 자동완성이 필요한 이름에만 search_as_you_type subfield 를 둔다
+SEARCH_AS_YOU_TYPE = {"search": {"type": "search_as_you_type"}}
+
+CORP_CODE_MAPPINGS = {
+    "properties": {
+        "corp_code": {"type": "keyword"},
+        "corp_name": {"type": "keyword", "fields": SEARCH_AS_YOU_TYPE},
+        # 비상장사는 " "
+        "stock_code": {"type": "keyword"},
+        "modify_date": {
+            "type": "date",
+            "format": "yyyyMMdd"}
+    }
+}
+
+# https://opendart.fss.or.kr/guide/detail.do?apiGrpCd=DS003&apiId=2019020
+# "rcept_no": "20220516001751",1
+# "reprt_code": "11013",
+# "bsns_year": "2022",
+# "corp_code": "00126380",
+# "sj_div": "BS",
+# "sj_nm": "재무상태표",
+# "account_id": "ifrs-full_CurrentLiabilities",
+# "account_nm": "유동부채",
+# "account_detail": "-",
+# "thstrm_nm": "제 54 기 1분기말",
+# "thstrm_amount": "56799776000000",
+# "frmtrm_nm": "제 53 기말",
+# "frmtrm_amount": "53067303000000",
+# "ord": "20",
+# "currency": "KRW"
+CORP_DATA_MAPPINGS = {
+    "properties": {
+        # 접수번호
+        "rcept_no": {"type": "keyword"},
+        # 보고서 코드
+        "reprt_code": {"type": "keyword"},
+        # 사업 연도
+        "bsns_year": {"type": "date", "format": "yyyy"},
+        # 고유번호
+        "corp_code": {"type": "keyword"},
+        # 재무제표구분
+        # BS : 재무상태표 IS : 손익계산서 CIS : 포괄손익계산서 CF : 현금흐름표 SCE : 자본변동표
+        "sj_div": {"type": "keyword"},
+        # 재무제표명
+        "sj_nm": {"type": "keyword"},
+        # 계정ID
+        # XBRL 표준계정ID ※ 표준계정ID가 아닐경우 ""-표준계정코드 미사용-"" 표시
+        "account_id": {"type": "keyword"},
+        # 계정명
+        "account_nm": {"type": "keyword", "fields": SEARCH_AS_YOU_TYPE},
+        # 계정상세
+        # ※ 자본변동표에만 출력 ex) 계정 상세명칭 예시 - 자본 [member]|지배기업 소유주지분 - 자본 [member]|지배기업 소유주지분|기타포괄손익누계액 [member]
+        "account_detail": {"type": "keyword"},
+        # 당기명
+        "thstrm_nm": {"type": "keyword"},
+        # 당기금액
+        # 9,999,999,999 ※ 분/반기 보고서이면서 (포괄)손익계산서 일 경우 [3개월] 금액
+        "thstrm_amount": {"type": "long"},
+        # 당기누적금액
+        "thstrm_add_amount": {"type": "long"},
+        # 전기명
+        "frmtrm_nm": {"type": "keyword"},
+        # 전기금액
+        "frmtrm_amount": {"type": "long"},
+        # 전기명(분/반기)
+        "frmtrm_q_nm": {"type": "keyword"},
+        # 전기금액(분/반기)
+        # ※ 분/반기 보고서이면서 (포괄)손익계산서 일 경우 [3개월] 금액
+        "frmtrm_q_amount": {"type": "long"},
+        # 전기누적금액
+        "frmtrm_add_amount": {"type": "long"},
+        # 전전기명
+        "bfefrmtrm_nm": {"type": "keyword"},
+        # 전전기금액
+        "bfefrmtrm_amount": {"type": "long"},
+        # 계정과목 정렬순서
+        "ord": {"type": "integer"},
+        # 통화 단위
+        "currency": {"type": "keyword"},
+        # 기간
+        "time_frame": {
+            "type": "date_range",
+            # https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-date-format.html
+            "format": "strict_date_optional_time_nanos"
+        },
+    }
+}
+
+CORP_IMPORT_HISTORY_MAPPINGS = {
+    "properties": {
+        "corp_code": {"type": "keyword"},
+        "year": {"type": "date", "format": "yyyy"},
+        "reprt_code": {"type": "keyword"},
+        "created_time": {
+            "type": "date",
+            # https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-date-format.html
+            "format": "strict_date_optional_time_nanos"
+        },
+        "number_of_imported_documents": {
+            "type": "integer"
+        }
+    }
+}
+
+INDEX_MAPPINGS = {
+    'corp_code': CORP_CODE_MAPPINGS,
+    'corp_data': CORP_DATA_MAPPINGS,
+    'corp_metrics': CORP_METRICS_MAPPINGS,
+    'corp_import_history': CORP_IMPORT_HISTORY_MAPPINGS,
+    'importer_metrics': IMPORTER_METRICS_MAPPINGS,
+}
+
+INDEX_SETTINGS = {"number_of_shards": 1}
+
+# 대량 색인 중에는 refresh 와 replica 를 끈다
+BULK_LOAD_SETTINGS = {"index.refresh_interval": "-1", "index.number_of_replicas": 0}
+
+
+def versioned_index_name(alias, now=None) -> str:
+    now = now or datetime.now(tz=timezone.utc)
+    return f'{alias}-{now.strftime("%Y%m%d%H%M%S")}'
+
+
+def alias_targets(client, alias) -> list:
+    """Physical indices behind alias. [alias] if alias is still a plain index, [] if neither exists."""
+    if client.indices.exists_alias(name=alias):
+        return sorted(client.indices.get_alias(name=alias))
+    if client.indices.exists(index=alias):
+        return [alias]
+    return []
+
+
+def create_aliased_index(client, alias, logger=None) -> str:
+    """Creates a versioned index with INDEX_MAPPINGS[alias] behind alias, unless alias already exists.
+
+    Returns:
+        str: the new physical index, or None
+    """
+    if client.indices.exists(index=alias):
+        return None
+    index = versioned_index_name(alias)
+    client.indices.create(index=index, settings=INDEX_SETTINGS, mappings=INDEX_MAPPINGS[alias],
+                          aliases={alias: {"is_write_index": True}})
+    if logger:
+        logger.info(f'Created {index} behind {alias}')
+    return index
+
+
+@contextlib.contextmanager
+def bulk_load(client, aliases, logger=None):
+    """Turns refresh and replicas off for the indices behind aliases and restores them on exit.
+
+        The original values are read per physical index. Values which were
+        not set explicitly are reset to the cluster default. Indices which
+        appear behind aliases during the load (e.g. year indices created by
+        YearIndexRouter with BULK_LOAD_SETTINGS) are reset to the defaults too.
+    """
+    indices = [index for alias in aliases for index in alias_targets(client, alias)]
+    saved = dict()
+    if indices:
+        resp = client.indices.get_settings(index=','.join(indices), flat_settings=True)
+        for index, body in resp.items():
+            saved[index] = {k: body['settings'].get(k) for k in BULK_LOAD_SETTINGS}
+        client.indices.put_settings(index=','.join(indices), settings=BULK_LOAD_SETTINGS)
+        if logger:
+            logger.info(f'Bulk load settings on {", ".join(indices)}')
+    try:
+        yield
+    finally:
+        # swap_year_index() 로 지워진 index 는 건너뛴다
+        for index, settings in saved.items():
+            client.options(ignore_status=404).indices.put_settings(index=index, settings=settings)
+        created = [index for alias in aliases for index in alias_targets(client, alias) if index not in saved]
+        if created:
+            client.indices.put_settings(index=','.join(created), settings={k: None for k in BULK_LOAD_SETTINGS})
+        if indices or created:
+            client.indices.refresh(index=','.join(indices + created), ignore_unavailable=True)
+            if logger:
+                logger.info(f'Restored settings of {", ".join(indices + created)}')
+
+
+def wait_for_task(client, task_id, poll_interval=5, logger=None) -> dict:
+    while True:
+        resp = client.tasks.get(task_id=task_id)
+        if resp.get('completed'):
+            return resp
+        if logger:
+            status = resp['task']['status']
+            logger.info(f'{task_id} : {status.get("created", 0) + status.get("updated", 0)}/{status.get("total")}')
+        time.sleep(poll_interval)
+
+
+def reindex(client, source, index, query=None, logger=None):
+    """Copies source (alias or index) into index and waits. index is deleted if the copy fails."""
+    if logger:
+        logger.info(f'Reindexing {source} into {index}')
+    task = client.reindex(source={"index": source} | ({"query": query} if query else {}), dest={"index": index},
+                          conflicts='proceed', slices='auto', wait_for_completion=False)
+    result = wait_for_task(client, task['task'], logger=logger)
+    failures = result.get('response', {}).get('failures') or result.get('error')
+    if failures:
+        client.indices.delete(index=index)
+        raise RuntimeError(f'Reindexing {source} failed : {failures}')
+    client.indices.put_settings(index=index, settings={k: None for k in BULK_LOAD_SETTINGS})
+    client.indices.refresh(index=index)
+
+
+def swap_aliases(client, old, aliases: dict, new_indices: dict, delete_old=False, logger=None):
+    """Moves aliases from the old indices to the new ones in one update_aliases call.
+
+    Args:
+        old: physical indices to detach. A plain index named like an alias is removed
+        aliases: aliases taken away from the old indices
+        new_indices: new index -> {alias: alias options}
+        delete_old: remove the old indices in the same call
+    """
+    actions = []
+    for o in old:
+        if o in aliases or delete_old:
+            actions.append({"remove_index": {"index": o}})
+        else:
+            actions.append({"remove": {"index": o, "aliases": sorted(aliases)}})
+    for index, index_aliases in new_indices.items():
+        for alias, options in index_aliases.items():
+            actions.append({"add": {"index": index, "alias": alias} | options})
+    client.indices.update_aliases(actions=actions)
+    if logger:
+        for index, index_aliases in new_indices.items():
+            logger.info(f'{", ".join(index_aliases)} now point to {index}')
+
+
+def migrate_index(client, alias, mappings=None, delete_old=False, logger=None) -> str:
+    """Reindexes alias into a new physical index and swaps the alias atomically.
+
+        Reads keep working on the old index until the swap. If alias is still
+        a plain index (created before aliases were used) it is removed in the
+        same update_aliases call. Documents written during the reindex are
+        not copied, so run a --since sync afterwards.
+
+        corp_data is split into one index per bsns_year by migrate_corp_data().
+
+    Args:
+        client: Elasticsearch
+        alias: corp_code, corp_data, corp_metrics or corp_import_history
+        mappings: default INDEX_MAPPINGS[alias]
+        delete_old: delete the old physical indices after the swap
+
+    Returns:
+        str: the new physical index
+    """
+    if alias == CORP_DATA_ALIAS:
+        return ','.join(migrate_corp_data(client, delete_old=delete_old, logger=logger).values())
+
+    old = alias_targets(client, alias)
+    index = versioned_index_name(alias)
+    client.indices.create(index=index, settings=INDEX_SETTINGS | BULK_LOAD_SETTINGS,
+                          mappings=mappings or INDEX_MAPPINGS[alias])
+    if old:
+        reindex(client, alias, index, logger=logger)
+    else:
+        client.indices.put_settings(index=index, settings={k: None for k in BULK_LOAD_SETTINGS})
+    swap_aliases(client, old, {alias: {}}, {index: {alias: {"is_write_index": True}}}, delete_old=delete_old,
+                 logger=logger)
+    return index
+
+
+# corp_data 는 사업연도별 index 로 나눈다
+#   corp_data                 : 모든 연도를 읽는 alias
+#   corp_data-2022            : 2022 년에 쓰는 alias
+#   corp_data-2022-<시각>      : 실제 index
+CORP_DATA_ALIAS = 'corp_data'
+
+
+def year_alias(year) -> str:
+    return f'{CORP_DATA_ALIAS}-{year}'
+
+
+def put_corp_data_template(client):
+    """Mappings and settings shared by every corp_data-* index.
+
+        The template has no aliases. A rebuilt index must not be read
+        through corp_data before its swap.
+    """
+    client.indices.put_index_template(
+        name=CORP_DATA_ALIAS,
+        index_patterns=[f'{CORP_DATA_ALIAS}-*'],
+        template={"settings": INDEX_SETTINGS, "mappings": CORP_DATA_MAPPINGS},
+        priority=100,
+    )
+
+
+def create_year_index(client, year) -> str:
+    """Creates a physical corp_data index of year to rebuild it. It gets its aliases from swap_year_index()."""
+    put_corp_data_template(client)
+    index = versioned_index_name(year_alias(year))
+    client.indices.create(index=index, settings=BULK_LOAD_SETTINGS)
+    return index
+
+
+def ensure_year_index(client, year, settings=None, logger=None) -> str:
+    """Creates the write index of year behind corp_data and corp_data-<year> if it does not exist.
+
+    Args:
+        settings: index settings on top of the template, e.g. BULK_LOAD_SETTINGS
+
+    Returns:
+        str: the write alias of year
+    """
+    alias = year_alias(year)
+    if client.indices.exists_alias(name=alias):
+        return alias
+    if client.indices.exists(index=CORP_DATA_ALIAS) and not client.indices.exists_alias(name=CORP_DATA_ALIAS):
+        raise RuntimeError(f'{CORP_DATA_ALIAS} is a plain index. Run --migrate-index {CORP_DATA_ALIAS} first')
+    # 다른 worker 가 먼저 만든 경우 alias 충돌로 실패한다
+    client.options(ignore_status=400).indices.create(
+        index=versioned_index_name(alias), settings=settings,
+        aliases={alias: {"is_write_index": True}, CORP_DATA_ALIAS: {}})
+    if not client.indices.exists_alias(name=alias):
+        raise RuntimeError(f'Creating the index of {alias} failed')
+    if logger:
+        logger.info(f'Created the index of {alias}')
+    return alias
+
+
+class YearIndexRouter:
+    def __init__(self, client, indices=None, settings=None, logger=None):
+        """Write target of corp_data rows by bsns_year.
+
+            Year indices are created on first use. The template is put once.
+
+        Args:
+            client: Elasticsearch
+            indices: year -> physical index written instead of the year alias (rebuild)
+            settings: settings of the created year indices. BULK_LOAD_SETTINGS inside bulk_load()
+            logger:
+        """
+        self.client = client
+        self.indices = {int(y): i for y, i in (indices or {}).items()}
+        self.settings = settings
+        self.logger = logger
+        self._aliases = dict()
+        self._lock = threading.Lock()
+        self._template = False
+
+    def __call__(self, year) -> str:
+        year = int(year)
+        if year in self.indices:
+            return self.indices[year]
+        alias = self._aliases.get(year)
+        if alias is None:
+            with self._lock:
+                if not self._template:
+                    put_corp_data_template(self.client)
+                    self._template = True
+                alias = self._aliases[year] = ensure_year_index(self.client, year, settings=self.settings,
+                                                                logger=self.logger)
+        return alias
+
+
+def swap_year_index(client, year, index, delete_old=False, logger=None):
+    """Puts a rebuilt index of year behind corp_data and corp_data-<year> in place of the current one."""
+    alias = year_alias(year)
+    old = alias_targets(client, alias)
+    client.indices.put_settings(index=index, settings={k: None for k in BULK_LOAD_SETTINGS})
+    client.indices.refresh(index=index)
+    swap_aliases(client, old, {CORP_DATA_ALIAS: {}, alias: {}},
+                 {index: {alias: {"is_write_index": True}, CORP_DATA_ALIAS: {}}},
+                 delete_old=delete_old, logger=logger)
+
+
+def seal_year_index(client, year, logger=None):
+    """Force merges a year which no longer changes into one segment and blocks writes.
+
+        Amendments of a sealed year need a rebuild (or removing index.blocks.write).
+    """
+    alias = year_alias(year)
+    client.indices.forcemerge(index=alias, max_num_segments=1)
+    client.indices.put_settings(index=alias, settings={"index.blocks.write": True})
+    if logger:
+        logger.info(f'Sealed {", ".join(alias_targets(client, alias))}')
+
+
+def corp_data_years(client) -> list:
+    resp = client.search(index=CORP_DATA_ALIAS, size=0, aggs={
+        "years": {"terms": {"field": "bsns_year", "format": "yyyy", "size": 1000}}})
+    return sorted(int(b['key_as_string']) for b in resp['aggregations']['years']['buckets'])
+
+
+def migrate_corp_data(client, delete_old=False, logger=None) -> dict:
+    """Splits corp_data (plain index, single aliased index or year indices) into new year indices.
+
+        Every year is reindexed before the aliases of all years are swapped
+        in one update_aliases call.
+
+    Returns:
+        dict: year -> new physical index
+    """
+    put_corp_data_template(client)
+    old = alias_targets(client, CORP_DATA_ALIAS)
+    if not old:
+        return dict()
+    indices = dict()
+    for year in corp_data_years(client):
+        index = versioned_index_name(year_alias(year))
+        client.indices.create(index=index, settings=BULK_LOAD_SETTINGS)
+        reindex(client, CORP_DATA_ALIAS, index, query={"term": {"bsns_year": str(year)}}, logger=logger)
+        indices[year] = index
+
+    aliases = {CORP_DATA_ALIAS: {}} | {year_alias(year): {} for year in indices}
+    old_aliases = set()
+    for o in old:
+        if o != CORP_DATA_ALIAS:
+            old_aliases |= set(client.indices.get_alias(index=o)[o]['aliases'])
+    swap_aliases(client, old, {a: {} for a in old_aliases} | aliases,
+                 {index: {year_alias(year): {"is_write_index": True}, CORP_DATA_ALIAS: {}}
+                  for year, index in indices.items()},
+                 delete_old=delete_old, logger=logger)
+    return indices
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def ordered_fetch(fetch, units, concurrency=1, max_pending=None, on_pending=None):
+    """Runs fetch(unit) for every unit with bounded parallelism.
+
+        Results are yielded in the same order as units, so the caller can keep
+        its sequential upload path. At most max_pending units are in flight,
+        which keeps memory bounded for millions of units.
+
+    Args:
+        fetch: callable taking one unit
+        units: iterable of units (consumed lazily)
+        concurrency (int): number of worker threads
+        max_pending (int): in-flight limit. Default is concurrency * 4
+        on_pending: callback(n) with the number of units in flight, e.g. a queue depth gauge
+
+    Yields:
+        tuple: (unit, result)
+    """
+    if concurrency <= 1:
+        for unit in units:
+            yield unit, fetch(unit)
+        return
+
+    max_pending = max_pending or concurrency * 4
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='dart-fetch')
+    try:
+        for unit in units:
+            pending.append((unit, executor.submit(fetch, unit)))
+            if on_pending:
+                on_pending(len(pending))
+            if len(pending) >= max_pending:
+                unit, future = pending.popleft()
+                yield unit, future.result()
+        while pending:
+            unit, future = pending.popleft()
+            if on_pending:
+                on_pending(len(pending))
+            yield unit, future.result()
+    finally:
+        # consumer 가 중간에 멈추면 아직 시작 안 된 fetch 는 취소
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _put(q, item, stopped, on_blocked=None) -> bool:
+    """Puts item into the bounded q, waiting while it is full. False if stopped was set meanwhile."""
+    try:
+        q.put_nowait(item)
+        return True
+    except queue.Full:
+        pass
+    t = time.perf_counter()
+    try:
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    finally:
+        if on_blocked:
+            on_blocked(time.perf_counter() - t)
+
+
+def buffered(iterable, maxsize, name='stage', on_depth=None, on_blocked=None):
+    """Iterates iterable on its own thread, at most maxsize items ahead of the consumer.
+
+        Chained buffered() calls make a pipeline whose stages overlap, each
+        one runs while the next is busy. A full queue blocks the producing
+        stage (backpressure), so memory is bounded by the queue sizes however
+        long iterable is. Exceptions of iterable are raised in the consumer.
+
+    Args:
+        iterable: generator of the stage, e.g. a transform over the previous stage
+        maxsize (int): queue size between the stage and its consumer
+        name: thread name
+        on_depth: callback(n) with the number of queued items, e.g. a queue depth gauge
+        on_blocked: callback(seconds) the stage waited because the queue was full
+
+    Yields:
+        items of iterable in order
+    """
+    q = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(q, (True, item), stopped, on_blocked):
+                    return
+            _put(q, (False, None), stopped)
+        except BaseException as e:
+            _put(q, (False, e), stopped)
+        finally:
+            # consumer 가 중간에 멈추면 앞 stage 도 멈춘다
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = q.get()
+            if on_depth:
+                on_depth(q.qsize())
+            if ok:
+                yield item
+            elif item is None:
+                return
+            else:
+                raise item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class BufferedSink:
+    def __init__(self, handle, maxsize, name='sink', on_depth=None, on_blocked=None):
+        """Calls handle(item) for every put() item on its own thread, in order.
+
+            The last stage of a pipeline. put() blocks while maxsize items are
+            waiting. When handle raises, the rest is dropped and the error is
+            raised by the next put() or by close().
+
+        Args:
+            handle: callable taking one item
+            maxsize (int): queue size
+            name: thread name
+            on_depth: callback(n) with the number of queued items
+            on_blocked: callback(seconds) put() waited because the queue was full
+        """
+        self.handle = handle
+        self.on_depth = on_depth
+        self.on_blocked = on_blocked
+        self.error = None
+        self._queue = queue.Queue(maxsize)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            ok, item = self._queue.get()
+            if self.on_depth:
+                self.on_depth(self._queue.qsize())
+            if not ok:
+                return
+            if self.error is None:
+                try:
+                    self.handle(item)
+                except BaseException as e:
+                    self.error = e
+                    self._stopped.set()
+
+    def put(self, item):
+        if self.error is not None or not _put(self._queue, (True, item), self._stopped, self.on_blocked):
+            raise self.error
+
+    def close(self):
+        """Waits until every put() item is handled."""
+        if self._thread.is_alive():
+            self._queue.put((False, None))
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except BaseException:
+            # with 블록의 예외를 가리지 않는다
+            if exc is None:
+                raise
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+class ImportCheckpoint:
+    def __init__(self, path):
+        """Durable record of processed (corp_code, year, reprt_code) units.
+
+            completed   : units which need no more work (imported or no data)
+            retry_queue : units which failed and are retried by the next pass
+
+        Args:
+            path: sqlite file, usually next to DART_RESULT_DIR
+        """
+        self.path = Path(path)
+        if not self.path.parent.exists():
+            os.makedirs(self.path.parent)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS completed ('
+                         'corp_code TEXT, year INTEGER, reprt_code TEXT, documents INTEGER, completed_time TEXT, '
+                         'PRIMARY KEY (corp_code, year, reprt_code))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS retry_queue ('
+                         'corp_code TEXT, corp_name TEXT, year INTEGER, reprt_code TEXT, error TEXT, '
+                         'attempts INTEGER, updated_time TEXT, '
+                         'PRIMARY KEY (corp_code, year, reprt_code))')
+        self._db.commit()
+
+    @staticmethod
+    def _now():
+        return datetime.now(tz=timezone.utc).isoformat()
+
+    def reset(self):
+        with self._lock:
+            self._db.execute('DELETE FROM completed')
+            self._db.execute('DELETE FROM retry_queue')
+            self._db.commit()
+
+    def completed_units(self) -> set:
+        """Returns: set of (corp_code, year, reprt_code)"""
+        with self._lock:
+            return set(self._db.execute('SELECT corp_code, year, reprt_code FROM completed'))
+
+    def retry_units(self, max_attempts=3) -> list:
+        """Returns: list of (corp_code, corp_name, year, reprt_code) in corp/year/quarter order"""
+        with self._lock:
+            return list(self._db.execute(
+                'SELECT corp_code, corp_name, year, reprt_code FROM retry_queue WHERE attempts < ? '
+                'ORDER BY corp_code, year, reprt_code', (max_attempts,)))
+
+    def retry_count(self) -> int:
+        """Number of units in the retry queue, including those which ran out of attempts."""
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM retry_queue').fetchone()[0]
+
+    def mark_completed(self, unit, documents):
+        corp_code, corp_name, year, reprt_code = unit
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO completed VALUES (?, ?, ?, ?, ?)',
+                             (corp_code, year, reprt_code, documents, self._now()))
+            self._db.execute('DELETE FROM retry_queue WHERE corp_code = ? AND year = ? AND reprt_code = ?',
+                             (corp_code, year, reprt_code))
+            self._db.commit()
+
+    def mark_failed(self, unit, error):
+        corp_code, corp_name, year, reprt_code = unit
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO retry_queue VALUES (?, ?, ?, ?, ?, 1, ?) '
+                'ON CONFLICT (corp_code, year, reprt_code) '
+                'DO UPDATE SET error = excluded.error, attempts = attempts + 1, updated_time = excluded.updated_time',
+                (corp_code, corp_name, year, reprt_code, str(error), self._now()))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -2,56 +2,70 @@
 
 import argparse
 import collections
+import contextlib
+import functools
+import hashlib
+import itertools
 import json
+import multiprocessing
+import queue
+import re
+from datetime import datetime, timedelta
 from pathlib import Path
 from pprint import pprint
 import sys
-import pendulum
-import requests
-from requests import get  # to make GET request
-from bs4 import BeautifulSoup
-from dotenv import dotenv_values
 import os
+import threading
 import time
 import logging
-import coloredlogs
-import subprocess
-from tqdm import tqdm
-from elasticsearch import Elasticsearch, NotFoundError
-from elasticsearch.helpers import streaming_bulk, scan
-
-from manage_dart_file import DartFileManager
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+# elasticsearch, requests, bs4, pendulum, tqdm 는 쓰는 곳에서 import 한다.
+# --help, test, worker process 가 빨리 뜨도록
+from corp_code_snapshot import CorpCodeSnapshot
+from corp_data_transform import QUARTER_CODES, transform_quarter
+from dart_cache import DartResponseCache
+from corp_metrics import generate_corp_metrics_actions
+from columnar_store import ColumnarStore, decode_quarter, export_cache
+from dart_http import DartHttpClient, DartResponseError
+from dart_quota import DartKeyScheduler, QuotaLedger, QuotaExhausted, DART_STATUS_QUOTA_EXCEEDED, KST
+from es_index import BULK_LOAD_SETTINGS, INDEX_MAPPINGS, YearIndexRouter, bulk_load, create_aliased_index, \
+    create_year_index, migrate_index, put_corp_data_template, seal_year_index, swap_year_index
+from fetch_engine import BufferedSink, buffered, ordered_fetch
+from import_checkpoint import ImportCheckpoint
+from import_profiler import ImportProfiler
+from importer_config import ConfigError, ImporterConfig, lazy
+from importer_metrics import MetricsRegistry, MetricsReporter, MetricsServer
+from manage_dart_file import DartFileManager, DartCacheIndex
 
 logfmt = "%(asctime)s %(levelname)s %(message)s"
-coloredlogs.install(fmt=logfmt)
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format=logfmt,
-    datefmt="%Y-%m-%dT%H:%M:%S%z",
-)
-logging.Formatter.converter = time.gmtime
 logger = logging.getLogger()
 
-# load_dotenv()
 
-config = {
-    # **dotenv_values("../docker-elk/.env"),  # load shared development variables
-    **dotenv_values(".env"),  # load sensitive variables
-    **os.environ,  # override loaded values with environment variables
-}
+def configure_logging(level=logging.DEBUG):
+    """Installs the colored DEBUG logging of the command line. Importing this module does not."""
+    import coloredlogs
 
-DART_API_KEY = config['DART_API_KEY']
-DART_RESULT_DIR = config['DART_RESULT_DIR']
-ELASTIC_USER = config['ELASTIC_USER']
-ELASTIC_PASSWORD = config['ELASTIC_PASSWORD']
-ELASTIC_CERTFILE = config['ELASTIC_CERTFILE']
-ELASTIC_CERTFILE_FINGERPRINT = config['ELASTIC_CERTFILE_FINGERPRINT']
-ELASTICSEARCH_URL = config['ELASTICSEARCH_URL']
+    coloredlogs.install(fmt=logfmt)
+    logging.basicConfig(
+        level=level,
+        format=logfmt,
+        datefmt="%Y-%m-%dT%H:%M:%S%z",
+    )
+    logging.Formatter.converter = time.gmtime
+    # bulk 요청마다 남는 DEBUG log 대신 importer_metrics 를 본다
+    logging.getLogger('elastic_transport').setLevel(logging.WARNING)
 
-dart_base_params = {
-    "crtfc_key": DART_API_KEY,
-}
+
+# load_dotenv()
+
+# .env 와 환경 변수. 처음 읽을 때 불러온다
+config = ImporterConfig()
+
+# crtfc_key 는 download() 에서 dart_key_scheduler 가 정한다
+dart_base_params = {}
 
 dart_params = {
     # 보고서 리스트
@@ -67,7 +81,8 @@ dart_params = {
         # 회사명: crp
         # 보고서명: rpt
         # ※ 기본값: date
-        "sort": "crp",
+        # 페이지를 넘기는 중에 새 공시가 들어와도 순서가 유지되도록 접수일자로 정렬한다
+        "sort": "date",
         # 오름차순(asc), 내림차순(desc)
         "sort_mth": "asc",
         # 페이지 번호(1~n) 기본값 : 1
@@ -89,26 +104,150 @@ dart_params = {
     }
 }
 
-elastic_session = requests.Session()
-elastic_session.auth = (ELASTIC_USER, ELASTIC_PASSWORD)
-# elastic_session.verify = ELASTIC_CERTFILE
-elastic_session.verify = False
 
-esclient = Elasticsearch(
-    ELASTICSEARCH_URL,
-    # ca_certs=ELASTIC_CERTFILE,
-    ssl_assert_fingerprint=ELASTIC_CERTFILE_FINGERPRINT,
-    basic_auth=(ELASTIC_USER, ELASTIC_PASSWORD)
-)
+@lazy
+def get_elastic_session():
+    import requests
 
-QUARTER_CODES = ['11013', '11012', '11014', '11011']
+    elastic_session = requests.Session()
+    elastic_session.auth = (config.ELASTIC_USER, config.ELASTIC_PASSWORD)
+    # elastic_session.verify = ELASTIC_CERTFILE
+    elastic_session.verify = False
+    return elastic_session
+
+
+@lazy
+def get_esclient():
+    from elasticsearch import Elasticsearch
+
+    return Elasticsearch(
+        config.ELASTICSEARCH_URL,
+        # ca_certs=ELASTIC_CERTFILE,
+        ssl_assert_fingerprint=config.ELASTIC_CERTFILE_FINGERPRINT,
+        basic_auth=(config.ELASTIC_USER, config.ELASTIC_PASSWORD)
+    )
+
+
+# 모든 DART 요청이 connection pool 을 공유한다
+get_dart_http = lazy(DartHttpClient)
+
+# configure_worker_quota() 가 worker 마다 바꾼다
+dart_key_scheduler = None
+_dart_lock = threading.Lock()
+
+
+def get_dart_key_scheduler() -> DartKeyScheduler:
+    global dart_key_scheduler
+    with _dart_lock:
+        if dart_key_scheduler is None:
+            dart_key_scheduler = DartKeyScheduler(
+                config.DART_API_KEYS,
+                daily_limit=config.DART_DAILY_LIMIT,
+                requests_per_second=config.DART_REQUESTS_PER_SECOND,
+                ledger=QuotaLedger(f'{config.DART_RESULT_DIR}/dart-quota.json'),
+                logger=logger
+            )
+        return dart_key_scheduler
+
+
+# DartFileManager 에 저장된 corp_data 목록
+get_dart_cache_index = lazy(lambda: DartCacheIndex(config.DART_RESULT_DIR, logger=logger))
+
+# JSON 응답 cache. DART_RESPONSE_CACHE=off 이면 None
+dart_response_cache = None
+
+
+def get_dart_response_cache():
+    global dart_response_cache
+    with _dart_lock:
+        if dart_response_cache is None and config.DART_RESPONSE_CACHE != 'off':
+            dart_response_cache = DartResponseCache(
+                f'{config.DART_RESULT_DIR}/dart-response-cache.sqlite',
+                ttl=config.DART_RESPONSE_CACHE_TTL,
+                no_data_ttl=config.DART_RESPONSE_CACHE_NO_DATA_TTL
+            )
+        return dart_response_cache
+
+
+# 단계별 처리량과 지연 시간. --metrics-port, --metrics-interval 로 내보낸다
+metrics = MetricsRegistry()
+dart_request_seconds = metrics.histogram(
+    'importer_dart_request_seconds', 'DART request latency including retries', ['endpoint'])
+dart_quota_wait_seconds = metrics.histogram(
+    'importer_dart_quota_wait_seconds', 'Time spent waiting for a DART key (rate limit and daily quota)',
+    buckets=(0.001, 0.01, 0.1, 1, 10, 60, 600, 3600, 86400))
+dart_decode_seconds = metrics.histogram(
+    'importer_dart_decode_seconds', 'JSON decode time of DART responses', ['endpoint'])
+dart_responses = metrics.counter(
+    'importer_dart_responses_total', 'DART responses by status, http_error for failed requests',
+    ['endpoint', 'status'])
+dart_cache_lookups = metrics.counter(
+    'importer_dart_cache_lookups_total', 'DART response cache lookups', ['result'])
+transform_seconds = metrics.histogram(
+    'importer_transform_seconds', 'Transform time of one quarter')
+bulk_batch_seconds = metrics.histogram(
+    'importer_bulk_batch_seconds', 'Time per bulk batch of chunk_size results, including action generation')
+bulk_documents = metrics.counter(
+    'importer_bulk_documents_total', 'Bulk indexed documents', ['kind', 'result'])
+quarters_done = metrics.counter(
+    'importer_quarters_total', 'Processed quarters by outcome', ['outcome'])
+fetch_pending = metrics.gauge(
+    'importer_fetch_pending', 'DART fetches in flight')
+bulk_pending_quarters = metrics.gauge(
+    'importer_bulk_pending_quarters', 'Quarters waiting for their bulk results')
+pipeline_queue_depth = metrics.gauge(
+    'importer_pipeline_queue_depth', 'Items queued after a stage of the corp_data pipeline', ['stage'])
+pipeline_blocked_seconds = metrics.counter(
+    'importer_pipeline_blocked_seconds_total', 'Time a stage waited on its full output queue (backpressure)',
+    ['stage'])
+
+# --profile 로 켠다. 꺼져 있으면 아무것도 기록하지 않는다
+profiler = ImportProfiler()
+
+
+Corp = collections.namedtuple('Corp', ['corp_code', 'corp_name', 'stock_code'])
+
+# 조회된 데이타가 없습니다.
+DART_STATUS_NO_DATA = '013'
+
+# corp_data 문서 _id 를 만드는 필드
+CORP_DATA_ID_FIELDS = ('rcept_no', 'sj_div', 'account_id', 'ord', 'account_detail')
+
+
+CORP_CODE_FIELDS = ('corp_code', 'corp_name', 'stock_code', 'modify_date')
 
 
 def parse_corp_code(filename):
-    with open(filename) as fd:
-        logger.info(f'Parsing {filename}')
-        soup = BeautifulSoup(fd.read(), features="xml")
-    return soup.result.find_all('list')
+    """Streams the <list> records of CORPCODE.xml.
+
+        filename can be the downloaded corp-code.zip, which is read directly
+        without extracting it, or a plain CORPCODE.xml.
+
+    Args:
+        filename: corp-code.zip or CORPCODE.xml
+
+    Yields:
+        dict: corp_code, corp_name, stock_code, modify_date
+    """
+    logger.info(f'Parsing {filename}')
+    if zipfile.is_zipfile(filename):
+        with zipfile.ZipFile(filename) as zf:
+            name = next(n for n in zf.namelist() if n.upper().endswith('.XML'))
+            with zf.open(name) as fd:
+                yield from _iterparse_corp_code(fd)
+    else:
+        with open(filename, 'rb') as fd:
+            yield from _iterparse_corp_code(fd)
+
+
+def _iterparse_corp_code(fd):
+    context = ElementTree.iterparse(fd, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == 'list':
+            yield {f: elem.findtext(f) or '' for f in CORP_CODE_FIELDS}
+            # 처리한 element 를 버려야 메모리가 일정하게 유지된다
+            root.clear()
 
 
 def generate_corp_code_doc(code_info_list):
@@ -117,25 +256,25 @@ def generate_corp_code_doc(code_info_list):
         refer to fetch_corp_code()
 
     Args:
-        code_info_list (BeautifulSoup tag): _description_
+        code_info_list (iterable of dict): records from parse_corp_code()
 
     Yields:
         dict: _description_
     """
     for ci in code_info_list:
-        # code_info[ci.corp_name.text]
         doc = {
-            '_id': ci.corp_code.text,
-            'corp_code': ci.corp_code.text,
-            'corp_name': ci.corp_name.text,
-            'stock_code': ci.stock_code.text,
-            'modify_date': ci.modify_date.text
+            '_id': ci['corp_code'],
+            **ci
         }
 
         yield doc
 
 
 def parse_corp_code_OLD(filename, do_post):
+    import requests
+    from bs4 import BeautifulSoup
+    from tqdm import tqdm
+
     with open(filename) as fd:
         logger.info(f'Parsing {filename}')
         soup = BeautifulSoup(fd.read(), features="xml")
@@ -159,9 +298,9 @@ def parse_corp_code_OLD(filename, do_post):
             pbar.update(1)
 
     if do_post:
-        r = elastic_session.post(ELASTICSEARCH_URL + '/corp_code/_bulk?pretty',
-                                 data=post_body_data,
-                                 headers={'Content-Type': 'application/json'})
+        r = get_elastic_session().post(config.ELASTICSEARCH_URL + '/corp_code/_bulk?pretty',
+                                       data=post_body_data,
+                                       headers={'Content-Type': 'application/json'})
         if r.status_code == requests.codes.ok:
             logger.info('Posting OK')
             nimported = check_corp_code_imported()
@@ -171,10 +310,40 @@ def parse_corp_code_OLD(filename, do_post):
             r.raise_for_status()
 
 
-def download(url, params, output_filename):
-    with requests.Session() as s:
-        r = s.get(url, params=params)
-        if output_filename:
+def download(url, params, output_filename, refresh=False):
+    """GET a DART endpoint.
+
+        JSON responses are served from dart_response_cache when they are
+        fresh, so a cache hit costs no quota.
+
+    Args:
+        url:
+        params: query params. crtfc_key is set by dart_key_scheduler
+        output_filename: write a file response (e.g. corpCode.xml) here
+        refresh: skip the cache lookup but still store the response
+
+    Returns:
+        dict: decoded JSON, None for a file response
+    """
+    endpoint = url.rsplit('/', 1)[-1]
+    response_cache = get_dart_response_cache() if output_filename is None else None
+    if response_cache and not refresh:
+        data = response_cache.get(url, params)
+        dart_cache_lookups.inc(result='miss' if data is None else 'hit')
+        if data is not None:
+            return data
+
+    while True:
+        # crtfc_key 는 scheduler 가 정한다
+        with dart_quota_wait_seconds.time():
+            key = get_dart_key_scheduler().acquire()
+        try:
+            with dart_request_seconds.time(endpoint=endpoint):
+                r = get_dart_http().get(url, params=params | {'crtfc_key': key})
+        except Exception:
+            dart_responses.inc(endpoint=endpoint, status='http_error')
+            raise
+        if output_filename and not get_dart_http().is_json(r):
             p = Path(output_filename)
             if not p.parent.exists():
                 p.parent.mkdir()
@@ -185,35 +354,42 @@ def download(url, params, output_filename):
             # if p.suffix == '.json':
             #     p2=
             #     subprocess.run(['jq', '.', '<', ])
+            return None
 
         # actually dict
-        return r.json()
+        with dart_decode_seconds.time(endpoint=endpoint):
+            data = get_dart_http().decode_json(r)
+        dart_responses.inc(endpoint=endpoint, status=data.get('status'))
+        if data.get('status') == DART_STATUS_QUOTA_EXCEEDED:
+            get_dart_key_scheduler().exhaust(key)
+            continue
+        if output_filename:
+            # 파일 대신 오류 응답이 온 경우
+            raise DartResponseError(f'Status code is {data.get("status")}({data.get("message")})')
+        if response_cache:
+            response_cache.put(url, params, data)
+        return data
 
 
 # 고유번호
-def fetch_corp_code_from_dart(output_filename):
+def fetch_corp_code_from_dart(output_filename, force=False):
     """고유번호
     
         https://opendart.fss.or.kr/guide/detail.do?apiGrpCd=DS001&apiId=2019018
 
     Args:
         output_filename (_type_): _description_
+        force: download again even if output_filename exists
     """
-    url = "https://opendart.fss.or.kr/api/corpCode.xml"
-    if os.path.exists(output_filename):
+    url = f"{config.DART_API_URL}/corpCode.xml"
+    if os.path.exists(output_filename) and not force:
         logger.info(f'We have {output_filename}. Fetching corp_code is skipped.')
     else:
         logger.info('Querying corp_code ... ')
         params = dart_base_params | {}
-        download(url, params, output_filename)
-
-    p = Path(output_filename)
-    px = p.with_name('CORPCODE.xml')
-    if not px.exists():
-        subprocess.run(f'unzip {p.absolute()} -d {p.parent}', shell=True)
-
-    if not px.exists():
-        logger.error(f'Cannot generate file : {p.absolute()}')
+        # 받는 중에 실패해도 이전 파일은 남겨둔다
+        download(url, params, f'{output_filename}.tmp')
+        os.replace(f'{output_filename}.tmp', output_filename)
 
 
 def get_corp_data_doc(corp_code):
@@ -226,12 +402,13 @@ def get_corp_data_doc(corp_code):
     #                                 }
     #                              },
     #                          headers={'Content-Type': 'application/json'})
-    resp = esclient.get(index="corp_code", id=corp_code)
+    resp = get_esclient().get(index="corp_code", id=corp_code)
     return resp['_source']
 
 
-def get_year_corp_data_from_dart(corp_code, year: int):
-    url = 'https://opendart.fss.or.kr/api/fnlttSinglAcntAll.json'
+def quarter_corp_data_request(corp_code, year: int, reprt_code) -> tuple:
+    """Returns: (url, params) of the fnlttSinglAcntAll request of one quarter"""
+    url = f'{config.DART_API_URL}/fnlttSinglAcntAll.json'
     # output_filename = f'{DART_RESULT_DIR}/corp_data/{corp_code}-{corp_name}/financial-statement-{year}-<quarter>.json'
     # p = Path(output_filename)
     # if p.exists():
@@ -246,16 +423,173 @@ def get_year_corp_data_from_dart(corp_code, year: int):
     # 반기보고서 : 11012
     # 3분기보고서 : 11014
     # 사업보고서 : 11011
-    ydata = []
+    dart_query_params['reprt_code'] = reprt_code
+    return url, dart_query_params
+
+
+def get_quarter_corp_data_from_dart(corp_code, year: int, reprt_code, refresh=False) -> dict:
+    url, params = quarter_corp_data_request(corp_code, year, reprt_code)
+    return download(url, params, None, refresh=refresh)
+
+
+def load_cached_quarter_corp_data(corp_code, corp_name, year: int, reprt_code):
+    """A quarter from the response cache or the DartFileManager zip, without asking DART.
+
+    Returns:
+        dict: qdata, None if neither has the quarter
+    """
+    response_cache = get_dart_response_cache()
+    if response_cache:
+        qdata = response_cache.get(*quarter_corp_data_request(corp_code, year, reprt_code))
+        if qdata is not None:
+            return qdata
+    dfm = corp_file_manager(corp_code, corp_name)
+    if not dfm.has_year_data(year):
+        return None
+    qdata = dfm.load_quarter(year, QUARTER_CODES.index(reprt_code) + 1)
+    # 예전 zip 은 json 이 아닌 dict 의 repr 을 저장했다
+    return decode_quarter(qdata) if qdata else None
+
+
+def get_year_corp_data_from_dart(corp_code, year: int):
     # rt_dict = dict(zip(QUARTER_CODES, [f'{i}Q' for i in range(1, 5)]))
-    for rt in QUARTER_CODES:
-        dart_query_params['reprt_code'] = rt
-        # of = output_filename.replace('<quarter>', rt_dict[rt])
-        of = None
-        d = download(url, dart_query_params, of)
-        ydata.append(d)
+    return [get_quarter_corp_data_from_dart(corp_code, year, rt) for rt in QUARTER_CODES]
+
+
+class FetchError(str):
+    """Placeholder of a quarter whose fetch failed. The text is the error."""
+
+
+def fetch_quarter_corp_data(unit, refresh=False):
+    """Fetches one unit. Errors are returned as FetchError so one bad unit does not abort the run."""
+    try:
+        with profiler.profile('fetch', unit[0]):
+            return get_quarter_corp_data_from_dart(unit[0], unit[2], unit[3], refresh=refresh)
+    except QuotaExhausted:
+        raise
+    except Exception as e:
+        logger.error(f'Fetching {unit} failed : {e!r}')
+        return FetchError(repr(e))
+
+
+def fetch_year_corp_data(units, fetch_concurrency=1, refresh=False):
+    """Fetches (corp_code, corp_name, year, reprt_code) units concurrently.
+
+        Quarter results are regrouped per (corp_code, corp_name, year) in the
+        order the units were generated.
+
+    Args:
+        units: iterable of (corp_code, corp_name, year, reprt_code)
+        fetch_concurrency (int): number of concurrent DART requests
+        refresh: bypass the response cache (e.g. for amended reports)
+
+    Yields:
+        tuple: (corp_code, corp_name, year, [(unit, qdata), ...])
+    """
+    fetch = functools.partial(fetch_quarter_corp_data, refresh=refresh)
+    results = ordered_fetch(fetch, units, concurrency=fetch_concurrency, on_pending=fetch_pending.set)
+    for (corp_code, corp_name, year), group in itertools.groupby(results, key=lambda r: r[0][:3]):
+        yield corp_code, corp_name, year, list(group)
+
+
+# corp_code 없이 공시 목록을 검색하면 기간은 3개월까지다
+DART_LIST_MAX_DAYS = 90
+
+# "[기재정정]분기보고서 (2022.03)" 의 보고서 종류와 보고 기간 말
+REPORT_NAME_PATTERN = re.compile(r'(사업|반기|분기)보고서\s*\((\d{4})\.(\d{2})\)')
+
+
+def parse_report_name(report_nm) -> list:
+    """(year, reprt_code) of a periodic report name of the filing list.
+
+        "[기재정정]분기보고서 (2022.03)" -> [(2022, '11013')]
+
+        The month is the end of the reported period. For a corp whose fiscal
+        year ends in December 03 is 1Q and 09 is 3Q. Other fiscal year ends
+        can not be told from the name, so both quarterly codes are returned.
+
+    Returns:
+        list: empty for other reports and years before fnlttSinglAcntAll data
+    """
+    m = REPORT_NAME_PATTERN.search(report_nm)
+    if not m:
+        return []
+    kind, year, month = m.group(1), int(m.group(2)), m.group(3)
+    # fnlttSinglAcntAll 은 2015년 이후 부터 정보제공
+    if year < 2015:
+        return []
+    if kind == '사업':
+        return [(year, '11011')]
+    if kind == '반기':
+        return [(year, '11012')]
+    if month == '03':
+        return [(year, '11013')]
+    if month == '09':
+        return [(year, '11014')]
+    return [(year, '11013'), (year, '11014')]
+
+
+def iter_date_windows(since, until, days=DART_LIST_MAX_DAYS):
+    """Splits [since, until] into windows the filing list accepts.
+
+    Yields:
+        tuple: (bgn_de, end_de) as YYYYMMDD
+    """
+    start = datetime.strptime(since, '%Y%m%d')
+    until = datetime.strptime(until, '%Y%m%d')
+    while start <= until:
+        end = min(start + timedelta(days=days - 1), until)
+        yield start.strftime('%Y%m%d'), end.strftime('%Y%m%d')
+        start = end + timedelta(days=1)
+
+
+def iter_filings(since, until):
+    """Pages through the periodic (pblntf_ty A) filings received between since and until.
+
+        https://opendart.fss.or.kr/guide/detail.do?apiGrpCd=DS001&apiId=2019001
+
+    Yields:
+        dict: corp_code, corp_name, stock_code, report_nm, rcept_no, rcept_dt, ...
+    """
+    url = f'{config.DART_API_URL}/list.json'
+    for bgn_de, end_de in iter_date_windows(since, until):
+        page_no = 1
+        while True:
+            params = dart_base_params | dart_params['list'] | {'bgn_de': bgn_de, 'end_de': end_de,
+                                                               'page_no': str(page_no)}
+            # 오늘 접수된 공시가 계속 추가되므로 cache 를 쓰지 않는다
+            data = download(url, params, None, refresh=True)
+            if data.get('status') == DART_STATUS_NO_DATA:
+                break
+            if data.get('status') != '000':
+                raise DartResponseError(f'Status code is {data.get("status")}({data.get("message")})')
+            yield from data['list']
+            if page_no >= int(data.get('total_page', 1)):
+                break
+            page_no += 1
+
+
+def generate_filing_units(filings):
+    """Changed (corp_code, corp_name, year, reprt_code) units of the filings.
+
+        An amended report maps to the same unit as the original one, so every
+        unit appears once. Units are in corp, year and QUARTER_CODES order.
+
+    Returns:
+        list: (corp_code, corp_name, year, reprt_code)
+    """
+    units = dict()
+    for f in filings:
+        for year, reprt_code in parse_report_name(f['report_nm']):
+            units.setdefault((f['corp_code'], year, reprt_code), f['corp_name'])
+    keys = sorted(units, key=lambda u: (u[0], u[1], QUARTER_CODES.index(u[2])))
+    return [(corp_code, units[(corp_code, year, rt)], year, rt) for corp_code, year, rt in keys]
+
 
-    return ydata
+def corp_file_manager(corp_code, corp_name) -> DartFileManager:
+    return DartFileManager(data_dir=config.DART_RESULT_DIR, corp_code=corp_code, corp_name=corp_name,
+                           data_file_prefix='financial-statements', logger=logger, cache_index=get_dart_cache_index(),
+                           compression=config.DART_CACHE_COMPRESSION, compresslevel=config.DART_CACHE_COMPRESSLEVEL)
 
 
 def get_corp_data_from_dart(corp_code, corp_name, years) -> dict:
@@ -278,8 +612,7 @@ def get_corp_data_from_dart(corp_code, corp_name, years) -> dict:
     """
 
     logger.info('Querying Financial Statement ... ')
-    dfm = DartFileManager(data_dir=DART_RESULT_DIR, corp_code=corp_code, corp_name=corp_name,
-                          data_file_prefix='financial-statements', logger=logger)
+    dfm = corp_file_manager(corp_code, corp_name)
     corp_data = dfm.load()
     if corp_data is None:
         corp_data = dict()
@@ -302,7 +635,7 @@ def analyze_corp_info(data):
                 pprint(d)
 
 
-def check_corp_code_imported():
+def check_corp_code_imported(client=None):
     #
     # low-level api client
     #
@@ -317,7 +650,7 @@ def check_corp_code_imported():
     # else:
     #     logger.error(f'{r.status_code}')
     #     r.raise_for_status()
-    resp = esclient.search(index="corp_code", query={"match_all": {}})
+    resp = (client or get_esclient()).search(index="corp_code", query={"match_all": {}})
     return resp['hits']['total']['value']
 
 
@@ -335,7 +668,13 @@ def check_corp_code_imported():
 
 # https://github.com/elastic/elasticsearch-py/blob/main/examples/bulk-ingest
 def create_index(client, indices):
-    """Creates an index in Elasticsearch if one isn't already there."""
+    """Creates an index in Elasticsearch if one isn't already there.
+
+        Each index is a versioned physical index behind an alias of its name.
+        corp_data is one index per bsns_year (corp_data-2022-<time>) behind
+        corp_data and corp_data-2022. Mappings are in es_index.py.
+        corp_metrics is created with corp_data, whose import always writes it.
+    """
 
     # field types
     # https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-types.html
@@ -344,161 +683,120 @@ def create_index(client, indices):
     # body deprecation
     # https://stackoverflow.com/questions/71577892/how-change-the-syntax-in-elasticsearch-8-where-body-parameter-is-deprecated
     if 'corp_code' in indices:
-        client.options(ignore_status=400).indices.create(
-            index="corp_code",
-            settings={"number_of_shards": 1},
-            mappings={
-                "properties": {
-                    "corp_code": {"type": "search_as_you_type"},
-                    "corp_name": {"type": "search_as_you_type"},
-                    "stock_code": {"type": "text"},
-                    "modify_date": {
-                        "type": "date",
-                        "format": "yyyyMMdd"}
-                }
-            },
-            # ignore
-            # >It’s good to know: Use an ignore parameter with the one or more status codes you want to overlook when you want to avoid raising an exception.
-            # Troubleshooting the “400 Resource-Already-Exists” error message
-            # If you try to create an index name(indices.create) that has already been created, the RequestError(400, 'resource_already_exists_exception)' will appear.
-        )
+        create_aliased_index(client, 'corp_code', logger=logger)
+
+    # corp_data 를 가져오면 corp_metrics 도 색인된다
+    if 'corp_metrics' in indices or 'corp_data' in indices:
+        create_aliased_index(client, 'corp_metrics', logger=logger)
 
     if 'corp_data' in indices:
-        # https://opendart.fss.or.kr/guide/detail.do?apiGrpCd=DS003&apiId=2019020
-        # "rcept_no": "20220516001751",1
-        # "reprt_code": "11013",
-        # "bsns_year": "2022",
-        # "corp_code": "00126380",
-        # "sj_div": "BS",
-        # "sj_nm": "재무상태표",
-        # "account_id": "ifrs-full_CurrentLiabilities",
-        # "account_nm": "유동부채",
-        # "account_detail": "-",
-        # "thstrm_nm": "제 54 기 1분기말",
-        # "thstrm_amount": "56799776000000",
-        # "frmtrm_nm": "제 53 기말",
-        # "frmtrm_amount": "53067303000000",
-        # "ord": "20",
-        # "currency": "KRW"
-        client.options(ignore_status=400).indices.create(
-            index="corp_data",
-            settings={"number_of_shards": 1},
-            mappings={
-                "properties": {
-                    # 접수번호
-                    "rcept_no": {"type": "text"},
-                    # 보고서 코드
-                    "reprt_code": {"type": "text"},
-                    # 사업 연도
-                    "bsns_year": {"type": "date", "format": "yyyy"},
-                    # 고유번호
-                    "corp_code": {"type": "search_as_you_type"},
-                    # 재무제표구분
-                    # BS : 재무상태표 IS : 손익계산서 CIS : 포괄손익계산서 CF : 현금흐름표 SCE : 자본변동표
-                    "sj_div": {"type": "search_as_you_type"},
-                    # 재무제표명
-                    "sj_nm": {"type": "search_as_you_type"},
-                    # 계정ID
-                    # XBRL 표준계정ID ※ 표준계정ID가 아닐경우 ""-표준계정코드 미사용-"" 표시
-                    "account_id": {"type": "text"},
-                    # 계정명
-                    "account_nm": {"type": "search_as_you_type"},
-                    # 계정상세
-                    # ※ 자본변동표에만 출력 ex) 계정 상세명칭 예시 - 자본 [member]|지배기업 소유주지분 - 자본 [member]|지배기업 소유주지분|기타포괄손익누계액 [member]
-                    "account_detail": {"type": "text"},
-                    # 당기명
-                    "thstrm_nm": {"type": "text"},
-                    # 당기금액
-                    # 9,999,999,999 ※ 분/반기 보고서이면서 (포괄)손익계산서 일 경우 [3개월] 금액
-                    "thstrm_amount": {"type": "long"},
-                    # 당기누적금액
-                    "thstrm_add_amount": {"type": "long"},
-                    # 전기명
-                    "frmtrm_nm": {"type": "text"},
-                    # 전기금액
-                    "frmtrm_amount": {"type": "long"},
-                    # 전기명(분/반기)
-                    "frmtrm_q_nm": {"type": "text"},
-                    # 전기금액(분/반기)
-                    # ※ 분/반기 보고서이면서 (포괄)손익계산서 일 경우 [3개월] 금액
-                    "frmtrm_q_amount": {"type": "long"},
-                    # 전기누적금액
-                    "frmtrm_add_amount": {"type": "long"},
-                    # 전전기명
-                    "bfefrmtrm_nm": {"type": "text"},
-                    # 전전기금액
-                    "bfefrmtrm_amount": {"type": "long"},
-                    # 계정과목 정렬순서
-                    "ord": {"type": "integer"},
-                    # 통화 단위
-                    "currency": {"type": "text"},
-                    # 기간
-                    "time_frame": {
-                        "type": "date_range",
-                        # https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-date-format.html
-                        "format": "strict_date_optional_time_nanos"
-                    },
-                }
-            },
-        )
-
-    client.options(ignore_status=400).indices.create(
-        index="corp_import_history",
-        settings={"number_of_shards": 1},
-        mappings={
-            "properties": {
-                "corp_code": {"type": "search_as_you_type"},
-                "year": {"type": "date", "format": "yyyy"},
-                "reprt_code": {"type": "text"},
-                "created_time": {
-                    "type": "date",
-                    # https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-date-format.html
-                    "format": "strict_date_optional_time_nanos"
-                },
-                "number_of_imported_documents": {
-                    "type": "integer"
-                }
-            }
-        },
-        # ignore
-        # >It’s good to know: Use an ignore parameter with the one or more status codes you want to overlook when you want to avoid raising an exception.
-        # Troubleshooting the “400 Resource-Already-Exists” error message
-        # If you try to create an index name(indices.create) that has already been created, the RequestError(400, 'resource_already_exists_exception)' will appear.
-    )
+        # 연도별 index 는 처음 색인할 때 만든다. es_index.YearIndexRouter 참고
+        put_corp_data_template(client)
+
+    create_aliased_index(client, 'corp_import_history', logger=logger)
 
 
 def delete_documents(client, indices):
+    from elasticsearch import NotFoundError
+
     try:
         if 'corp_code' in indices:
             client.delete_by_query(index='corp_code', query={"match_all": {}})
         if 'corp_data' in indices:
             client.delete_by_query(index='corp_data', query={"match_all": {}})
+        if 'corp_metrics' in indices:
+            client.delete_by_query(index='corp_metrics', query={"match_all": {}})
     except NotFoundError:
         pass
 
 
-def import_corp_code(client):
-    corp_code_filename = f'{DART_RESULT_DIR}/CORPCODE.xml'
-    corp_code_output_filename = f'{DART_RESULT_DIR}/corp-code.zip'
+def import_corp_code(client, refresh=False):
+    """Loads corp_code into an empty index, or refreshes the changed corps.
+
+    Args:
+        client: Elasticsearch
+        refresh: download CORPCODE.xml again and upsert the new or modified corps
+    """
+    corp_code_output_filename = f'{config.DART_RESULT_DIR}/corp-code.zip'
 
     logger.info('Fetching corp code from DART system')
-    fetch_corp_code_from_dart(corp_code_output_filename)
+    fetch_corp_code_from_dart(corp_code_output_filename, force=refresh)
 
     logger.info('Checking index status ... ')
-    if check_corp_code_imported() == 0:
+    snapshot = CorpCodeSnapshot(f'{config.DART_RESULT_DIR}/corp-code-snapshot.json')
+    if check_corp_code_imported(client) == 0:
         logger.info('Parsing corp code')
-        corp_code_list = parse_corp_code(corp_code_filename)
-        number_of_docs = len(corp_code_list)
-        progress = tqdm(unit="docs", total=number_of_docs)
-        successes = 0
-        logging.disable(sys.maxsize)
-        for ok, action in streaming_bulk(
-                client=client, index="corp_code", actions=generate_corp_code_doc(corp_code_list),
+        corp_code_list = parse_corp_code(corp_code_output_filename)
+        indexed = bulk_index_corp_code(client, corp_code_list)
+        snapshot.update(indexed)
+        snapshot.save()
+        logger.info(f'Indexed {len(indexed)} corps')
+    elif refresh:
+        refresh_corp_code(client, corp_code_output_filename, snapshot)
+
+
+def bulk_index_corp_code(client, records) -> list:
+    """Indexes corp_code records.
+
+    Returns:
+        list: corp_code and modify_date of the indexed records
+    """
+    from elasticsearch.helpers import streaming_bulk
+    from tqdm import tqdm
+
+    modify_dates = dict()
+
+    def remember(records):
+        for r in records:
+            modify_dates[r['corp_code']] = r['modify_date']
+            yield r
+
+    progress = tqdm(unit="docs")
+    indexed = []
+    try:
+        for ok, item in streaming_bulk(
+                client=client, index="corp_code", actions=generate_corp_code_doc(remember(records)),
+                raise_on_error=False, raise_on_exception=False,
         ):
             progress.update(1)
-            successes += ok
-        logging.disable(logging.NOTSET)
-        # print("Indexed %d/%d documents" % (successes, number_of_docs))
+            bulk_documents.inc(kind='corp_code', result='ok' if ok else 'failed')
+            if ok:
+                corp_code = item['index']['_id']
+                indexed.append({'corp_code': corp_code, 'modify_date': modify_dates[corp_code]})
+    finally:
+        progress.close()
+    return indexed
+
+
+def load_corp_code_snapshot(client, snapshot):
+    """Builds the snapshot from the corp_code index. Only corp_code and modify_date are read."""
+    from elasticsearch.helpers import scan
+
+    logger.info('Building corp code snapshot from the index')
+    snapshot.update(hit['_source'] for hit in scan(client, index="corp_code", size=5000,
+                                                   query={"_source": ["corp_code", "modify_date"]}))
+    snapshot.save()
+
+
+def refresh_corp_code(client, filename, snapshot) -> dict:
+    """Upserts the corps of filename which are new or have another modify_date than the snapshot.
+
+    Returns:
+        dict: new, modified, unchanged, missing, indexed, failures
+    """
+    if not snapshot.exists():
+        load_corp_code_snapshot(client, snapshot)
+
+    changes = {'new': 0, 'modified': 0, 'unchanged': 0, 'missing': 0}
+    indexed = bulk_index_corp_code(client, snapshot.diff(parse_corp_code(filename), changes))
+    snapshot.update(indexed)
+    snapshot.save()
+    changes['indexed'] = len(indexed)
+    changes['failures'] = changes['new'] + changes['modified'] - len(indexed)
+    logger.info(f'corp_code refreshed : {changes["new"]} new, {changes["modified"]} modified, '
+                f'{changes["unchanged"]} unchanged, {changes["missing"]} no longer listed, '
+                f'{changes["indexed"]} indexed, {changes["failures"]} failed')
+    return changes
 
 
 def get_fetched_docs():
@@ -510,208 +808,1178 @@ def get_fetched_docs():
     pass
 
 
-def has_corp_data(client, corp_code, year: int) -> list:
-    # 연단위로만 체크하자
-    # resp = es.search(index="test-index", query={"match_all": {}})
-    # print("Got %d Hits:" % resp['hits']['total']['value'])
-    # for hit in resp['hits']['hits']:
-    #     print("%(timestamp)s %(author)s: %(text)s" % hit["_source"])
-    hits = []
-    for qc in QUARTER_CODES:
-        resp = client.search(index="corp_code", query={
-            "bool": {
-                "must": [
-                    {"term": {"corp_code": corp_code}},
-                    {"term": {"bsns_year": str(year)}},
-                    {"term": {"reprt_code": qc}}
-                ]
-            }
-        })
+def load_import_manifest(client, corp_code=None) -> set:
+    """Loads corp_import_history once so that skip checks need no search.
 
-        hits.append(resp['hits']['total']['value'])
+    Args:
+        client: Elasticsearch
+        corp_code: load only one corp. Default is every corp
 
-    return hits
+    Returns:
+        set: (corp_code, year<int>, reprt_code) already imported
+    """
+    from elasticsearch import NotFoundError
+    from elasticsearch.helpers import scan
+
+    query = {"match_all": {}} if corp_code is None else {"term": {"corp_code": corp_code}}
+    manifest = set()
+    try:
+        for doc in scan(client, index="corp_import_history", size=5000,
+                        query={"query": query, "_source": ["corp_code", "year", "reprt_code"]}):
+            h = doc['_source']
+            manifest.add((h['corp_code'], int(h['year']), h['reprt_code']))
+    except NotFoundError:
+        pass
+    logger.info(f'{len(manifest)} quarters are already imported')
+    return manifest
+
+
+def has_corp_data(manifest, corp_code, year: int) -> list:
+    """Returns the QUARTER_CODES of year which are already imported."""
+    return [qc for qc in QUARTER_CODES if (corp_code, year, qc) in manifest]
+
+
+def is_year_corp_data_imported(manifest, dfm, corp_code, corp_name, year: int) -> bool:
+    if len(has_corp_data(manifest, corp_code, year)) == len(QUARTER_CODES):
+        logger.info(f'remote corp_data {corp_name}-{year} exists ')
+        return True
+    # check if corp is already imported
+    if dfm.has_year_data(year):
+        logger.info(f'local corp_data {corp_name}-{year} exists ')
+        return True
+    return False
 
 
 def import_one_corp_data(client, corp_code, corp_name, years) -> list:
     ns = []
 
-    dfm = DartFileManager(data_dir=DART_RESULT_DIR, corp_code=corp_code, corp_name=corp_name,
-                          data_file_prefix='financial-statements', logger=logger)
+    dfm = corp_file_manager(corp_code, corp_name)
+    manifest = load_import_manifest(client, corp_code)
     corp_data = dict()
     for year in years:
-        hits = has_corp_data(client, corp_code, year)
-        if len(hits) > 0:
-            logger.info(f'remote corp_data {corp_name}-{year} exists ')
+        if is_year_corp_data_imported(manifest, dfm, corp_code, corp_name, year):
             continue
-        # check if corp is already imported
-        if dfm.has_year_data(year):
-            logger.info(f'local corp_data {corp_name}-{year} exists ')
-        else:
-            year_corp_data = get_year_corp_data_from_dart(corp_code, year)
-            corp_data.update({year: year_corp_data})
-            n = upload_year_corp_data(client, corp_code, year_corp_data)
-            ns.append(n)
+        year_corp_data = get_year_corp_data_from_dart(corp_code, year)
+        corp_data.update({year: year_corp_data})
+        n = upload_year_corp_data(client, corp_code, year_corp_data)
+        ns.append(n)
     return ns
 
 
-def import_all_corp_data(client) -> dict:
-    nc = collections.defaultdict(list)
-    years = list(range(2017, 2023))
-    quarters = list(range(1, 5))
-    its = scan(client, query={"query": {"match_all": {}}}, index="corp_code")
-    for doc in its:
-        corp_code = doc['_source']['corp_code']
-        corp_name = get_corp_data_doc(corp_code)['corp_name']
-        # [
-        #   [
-        #     [-1, -1, -1, -1],
-        #     [-1, -1, -1, -1],
-        #     [-1, -1, -1, -1],
-        #     [-1, -1, -1, -1],
-        #     [-1, -1, -1, -1],
-        #     [-1, -1, -1, -1]
-        #   ]
-        # ]
-        num_data = import_one_corp_data(client, corp_code, corp_name, years)
-        nc['corp_code'] = num_data
-    return nc
-
-
-def upload_quarter_corp_data_bulk(client, data: dict) -> int:
-    if type(data) != dict:
-        logger.error(f'Data type is not dict : {str(type(data))}')
-        return -1
-
-    if data['status'] != '000':
-        logger.error(f'Status code is {data["status"]}({data["message"]})')
-        return -1
-
-    docs = data['list']
-    number_of_docs = len(docs)
-    progress = tqdm(unit="docs", total=number_of_docs)
-    successes = 0
-    logging.disable(sys.maxsize)
-    for ok, action in streaming_bulk(
-            client=client, index="corp_data", actions=(d for d in docs),
-    ):
-        progress.update(1)
-        successes += ok
-    logging.disable(logging.NOTSET)
-    # print("Indexed %d/%d documents" % (successes, number_of_docs))
-
-    return successes
-
-
-def upload_quarter_corp_data_history(client, corp_code, qdata: dict, successes):
-    docs = qdata['list']
-
-    '''
-                    "corp_code": {"type": "search_as_you_type"},
-                    "year": {"type": "date", "format": "yyyy"},
-                    "reprt_code": {"type": "text"},
-                    "created_time": {
-                        "type": "date",
-                        # https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-date-format.html
-                        "format": "strict_date_optional_time_nanos"
-                    },
-                    "number_of_imported_documents": {
-                        "type": "integer"
-                    }
-    '''
+def iter_corps(client, source='es', page_size=5000):
+    """Iterates the corp universe.
+
+    Args:
+        client: Elasticsearch
+        source: 'es' reads the corp_code index with a point in time,
+                'xml' reads corp-code.zip without touching ES
+        page_size: documents per search page
+
+    Yields:
+        Corp
+    """
+    if source == 'xml':
+        for ci in parse_corp_code(f'{config.DART_RESULT_DIR}/corp-code.zip'):
+            yield Corp(*(ci[f] for f in Corp._fields))
+        return
+
+    keep_alive = '5m'
+    pit_id = client.open_point_in_time(index="corp_code", keep_alive=keep_alive)['id']
+    search_after = None
+    try:
+        while True:
+            resp = client.search(
+                pit={"id": pit_id, "keep_alive": keep_alive},
+                query={"match_all": {}},
+                source=list(Corp._fields),
+                sort=["_shard_doc"],
+                search_after=search_after,
+                size=page_size,
+                track_total_hits=False,
+            )
+            hits = resp['hits']['hits']
+            if not hits:
+                break
+            pit_id = resp['pit_id']
+            for hit in hits:
+                yield Corp(*(hit['_source'].get(f, '') for f in Corp._fields))
+            search_after = hits[-1]['sort']
+    finally:
+        client.close_point_in_time(id=pit_id)
+
+
+def generate_corp_data_units(manifest, corps, years, skip_cached=True):
+    """Fans out corps x years x QUARTER_CODES into fetch units.
+
+        Quarters in manifest and, with skip_cached, years cached locally are skipped.
+
+    Yields:
+        tuple: (corp_code, corp_name, year, reprt_code)
+    """
+    for corp in corps:
+        corp_code, corp_name = corp.corp_code, corp.corp_name
+        dfm = corp_file_manager(corp_code, corp_name)
+        for year in years:
+            if skip_cached and is_year_corp_data_imported(manifest, dfm, corp_code, corp_name, year):
+                continue
+            imported = has_corp_data(manifest, corp_code, year)
+            for rt in QUARTER_CODES:
+                if rt not in imported:
+                    yield corp_code, corp_name, year, rt
+
+
+def is_listed_corp(corp) -> bool:
+    # 비상장사의 stock_code 는 " " 이다
+    return bool(corp.stock_code and corp.stock_code.strip())
+
+
+def load_watchlist(filename) -> list:
+    """Reads corp_code or stock_code, one per line. # starts a comment."""
+    codes = []
+    with open(filename) as fd:
+        for line in fd:
+            code = line.split('#', 1)[0].strip()
+            if code:
+                codes.append(code)
+    return codes
+
+
+def prioritize_corps(corps, watchlist=None, only_listed=False) -> list:
+    """Orders corps by priority tier.
+
+        0 : watchlist, in watchlist order
+        1 : listed corps
+        2 : unlisted corps (dropped with only_listed)
+
+    Args:
+        corps: iterable of Corp
+        watchlist: corp_code or stock_code list
+        only_listed: keep only listed or watchlist corps
+
+    Returns:
+        list: [tier 0 corps, tier 1 corps, tier 2 corps]
+    """
+    rank = {code: i for i, code in reversed(list(enumerate(watchlist or [])))}
+    tiers = [[], [], []]
+    for corp in corps:
+        if corp.corp_code in rank or corp.stock_code.strip() in rank:
+            tiers[0].append(corp)
+        elif is_listed_corp(corp):
+            tiers[1].append(corp)
+        elif not only_listed:
+            tiers[2].append(corp)
+    tiers[0].sort(key=lambda c: rank.get(c.corp_code, rank.get(c.stock_code.strip())))
+    return tiers
+
+
+def watchlist_corp_codes(watchlist, corps) -> set:
+    """corp_codes of the watchlist, whose entries are corp_code or stock_code.
+
+    Args:
+        watchlist: corp_code or stock_code list
+        corps: iterable of Corp which resolves the stock_codes
+    """
+    codes = set(watchlist or [])
+    # corp_code 는 8 자리, stock_code 는 6 자리다
+    if all(len(code) == 8 for code in codes):
+        return codes
+    return {code for code in codes if len(code) == 8} | \
+        {corp.corp_code for corp in corps if corp.stock_code.strip() in codes}
+
+
+def generate_prioritized_units(manifest, corps, years, watchlist=None, only_listed=False, skip_cached=True):
+    """generate_corp_data_units() in priority order.
+
+        Within a tier recent years come first, so every listed corp has its
+        latest year before any corp gets an old one.
+
+    Yields:
+        tuple: (corp_code, corp_name, year, reprt_code)
+    """
+    for tier in prioritize_corps(corps, watchlist, only_listed):
+        for year in sorted(years, reverse=True):
+            yield from generate_corp_data_units(manifest, tier, [year], skip_cached)
+
+
+def corp_partition(corp_code, num_workers) -> int:
+    """Stable worker index of a corp. Same on every host and every run."""
+    return zlib.crc32(corp_code.encode()) % num_workers
+
+
+def partition_corps(corps, worker_id, num_workers):
+    for corp in corps:
+        if corp_partition(corp.corp_code, num_workers) == worker_id:
+            yield corp
+
+
+def import_all_corp_data(client, fetch_concurrency=1, bulk_chunk_size=500, bulk_threads=1,
+                         corp_source='es', worker_id=0, num_workers=1, show_progress=True,
+                         on_progress=None, resume=False, columnar_dir=None, since=None, until=None,
+                         watchlist=None, only_listed=False, years=None, rebuild_indices=None,
+                         queue_size=32, bulk_load=False) -> dict:
+    """Imports corp_data of every corp (or of one worker's partition).
+
+        Fetch, transform, bulk index and record (checkpoint, history) are
+        stages on their own threads, connected by queues of at most
+        queue_size quarters. A slow stage blocks the ones before it, so
+        memory does not grow with the number of corps.
+
+        Every processed unit is recorded in an ImportCheckpoint. Failed units
+        go to its retry queue and are retried once at the end of the run and
+        again by the next run with resume=True.
+
+        With since, only the reports filed between since and until are
+        fetched, including the quarters already imported. Rows of a replaced
+        filing (e.g. before [기재정정]) are deleted.
+
+    Args:
+        worker_id: partition handled by this process
+        num_workers: number of partitions
+        on_progress: callback(successes) called for every indexed quarter
+        resume: continue from the checkpoint of the last run instead of starting over
+        columnar_dir: also append fetched quarters to this ColumnarStore
+        since: YYYYMMDD. Sync the filings received since then instead of importing every corp
+        until: YYYYMMDD. End of the sync. Default today
+        watchlist: corp_code or stock_code list imported before every other corp
+        only_listed: skip unlisted corps which are not in watchlist
+        years: bsns_years to import. Default 2017 ~ 2022
+        rebuild_indices: year -> new physical corp_data index. Every quarter of those years is
+                         fetched again (mostly from the response cache) into it
+        queue_size: quarters queued between two stages. 0 runs the stages one after another
+        bulk_load: create new year indices with BULK_LOAD_SETTINGS. They are restored by es_index.bulk_load()
+
+    Returns:
+        dict: corps, quarters, documents, derived, failures, retry_queue, elapsed.
+              retry_queue is the number of quarters still failed at the end of the run
+    """
+    from tqdm import tqdm
+
+    t = time.monotonic()
+    stats = {'corps': 0, 'quarters': 0, 'documents': 0, 'derived': 0, 'failures': 0, 'retry_queue': 0}
+    years = years or list(range(2017, 2023))
+    columnar_store = ColumnarStore(columnar_dir) if columnar_dir else None
+    index_for_year = YearIndexRouter(client, rebuild_indices, settings=BULK_LOAD_SETTINGS if bulk_load else None,
+                                     logger=logger)
+    checkpoint_name = 'sync-checkpoint' if since else 'rebuild-checkpoint' if rebuild_indices else 'import-checkpoint'
+    if num_workers > 1:
+        checkpoint_name += f'-{worker_id}-of-{num_workers}'
+    checkpoint = ImportCheckpoint(f'{config.DART_RESULT_DIR}/{checkpoint_name}.sqlite')
+    if not resume:
+        checkpoint.reset()
+
+    retry_units = checkpoint.retry_units()
+    retry_keys = {(u[0], u[2], u[3]) for u in retry_units}
+    if retry_units:
+        logger.info(f'Retrying {len(retry_units)} failed quarters first')
+    if since:
+        until = until or datetime.now(tz=KST).strftime('%Y%m%d')
+        # 이미 가져온 분기도 정정되었을 수 있으므로 manifest 로 건너뛰지 않는다
+        manifest = set()
+        skip = checkpoint.completed_units() | retry_keys
+        filings = iter_filings(since, until)
+        if only_listed:
+            # stock_code 로 적은 watchlist 도 공시의 corp_code 로 찾는다
+            watched = watchlist_corp_codes(watchlist, iter_corps(client, source=corp_source))
+            filings = (f for f in filings if f.get('stock_code', '').strip() or f['corp_code'] in watched)
+        filing_units = generate_filing_units(filings)
+        logger.info(f'{len(filing_units)} quarters filed between {since} and {until}')
+        units = itertools.chain(
+            retry_units,
+            (u for u in filing_units
+             if (u[0], u[2], u[3]) not in skip and corp_partition(u[0], num_workers) == worker_id))
+    else:
+        if rebuild_indices:
+            # 새 index 는 비어 있으므로 이미 가져온 분기도 다시 넣는다
+            years = sorted(rebuild_indices)
+            manifest = checkpoint.completed_units()
+        else:
+            manifest = load_import_manifest(client)
+            manifest |= checkpoint.completed_units()
+        corps = iter_corps(client, source=corp_source)
+        if num_workers > 1:
+            corps = partition_corps(corps, worker_id, num_workers)
+        units = itertools.chain(
+            retry_units,
+            (u for u in generate_prioritized_units(manifest, corps, years, watchlist, only_listed,
+                                                   skip_cached=not rebuild_indices)
+             if (u[0], u[2], u[3]) not in retry_keys))
+
+    # 우선순위 순서에서는 한 corp 의 연도들이 떨어져 있으므로 corp_code 를 모두 기억한다
+    corp_codes = set()
+
+    def on_quarter_done(unit, qdata, successes):
+        corp_code = unit[0]
+        corp_codes.add(corp_code)
+        stats['corps'] = len(corp_codes)
+        stats['quarters'] += 1
+        if isinstance(qdata, FetchError):
+            quarters_done.inc(outcome='fetch_failed')
+            checkpoint.mark_failed(unit, qdata)
+        elif successes < 0:
+            # 조회된 데이터가 없는 경우는 다시 받을 필요가 없다
+            if type(qdata) == dict and qdata.get('status') == DART_STATUS_NO_DATA:
+                quarters_done.inc(outcome='no_data')
+                checkpoint.mark_completed(unit, 0)
+            else:
+                quarters_done.inc(outcome='invalid')
+                checkpoint.mark_failed(unit, f'status {qdata.get("status")}' if type(qdata) == dict else qdata)
+        elif successes < len(qdata['list']):
+            quarters_done.inc(outcome='index_failed')
+            checkpoint.mark_failed(unit, f'{len(qdata["list"]) - successes} documents failed')
+        else:
+            try:
+                with profiler.profile('record', corp_code):
+                    if columnar_store:
+                        columnar_store.append(qdata)
+                    if since:
+                        delete_superseded_corp_data(client, qdata)
+                    manifest.add(upload_quarter_corp_data_history(client, corp_code, qdata, successes))
+                    checkpoint.mark_completed(unit, successes)
+                quarters_done.inc(outcome='indexed')
+            except Exception as e:
+                logger.error(f'Recording {unit} failed : {e!r}')
+                quarters_done.inc(outcome='record_failed')
+                checkpoint.mark_failed(unit, repr(e))
+        if successes >= 0 and on_progress:
+            on_progress(successes)
+
+    def index_units(units):
+        # 정정된 보고서는 cache 에 남은 이전 응답을 쓰면 안 된다
+        fetched = fetch_year_corp_data(units, fetch_concurrency, refresh=bool(since))
+        if queue_size:
+            # fetch 결과는 corp 의 1년(최대 4 분기) 단위다
+            fetched = buffered(fetched, max(1, queue_size // len(QUARTER_CODES)), **pipeline_stage_options('fetch'))
+        # 일부 분기만 가져온 연도는 나머지 분기를 cache 에서 읽어 지표를 만든다
+        quarters = (q for corp_code, corp_name, year, results in fetched
+                    for q in with_year_metrics(corp_code, results, load_quarter=functools.partial(
+                        load_cached_quarter_corp_data, corp_code, corp_name)))
+        recorder = BufferedSink(lambda done: on_quarter_done(*done), queue_size, **pipeline_stage_options('bulk')) \
+            if queue_size else None
+        with recorder or contextlib.nullcontext():
+            total = bulk_index_corp_data(
+                client, quarters, chunk_size=bulk_chunk_size, thread_count=bulk_threads,
+                on_quarter_done=(lambda *done: recorder.put(done)) if recorder else on_quarter_done,
+                progress=progress, index_for_year=index_for_year, queue_size=queue_size)
+        stats['documents'] += total['successes']
+        stats['derived'] += total['derived']
+        stats['failures'] += total['failures']
+
+    progress = tqdm(unit="docs") if show_progress else None
+    try:
+        index_units(units)
+        retry_units = checkpoint.retry_units()
+        if retry_units:
+            logger.info(f'Retrying {len(retry_units)} failed quarters')
+            index_units(retry_units)
+        stats['retry_queue'] = checkpoint.retry_count()
+    finally:
+        if progress is not None:
+            progress.close()
+        if columnar_store:
+            columnar_store.flush()
+        checkpoint.close()
+    stats['elapsed'] = time.monotonic() - t
+    logger.info(f'Worker {worker_id}/{num_workers} : {format_import_stats(stats)}')
+    return stats
+
+
+def format_import_stats(stats) -> str:
+    rate = stats['documents'] / stats['elapsed'] if stats['elapsed'] > 0 else 0
+    return (f'{stats["corps"]} corps, {stats["quarters"]} quarters, {stats["documents"]} documents '
+            f'and {stats["derived"]} metrics indexed, {stats["failures"]} failed, {stats["retry_queue"]} quarters '
+            f'to retry in {stats["elapsed"]:.0f}s ({rate:.1f} docs/s)')
+
+
+def configure_worker_quota(num_workers, wait_for_reset=True):
+    """Gives each local worker process 1/num_workers of the DART request rate.
+
+        Every worker debits the shared dart-quota.json, so the daily limit
+        counts the requests of the other workers and of earlier runs today.
+
+    Args:
+        wait_for_reset: wait for the daily reset when every key is exhausted, otherwise raise QuotaExhausted
+    """
+    global dart_key_scheduler
+    dart_key_scheduler = DartKeyScheduler(
+        config.DART_API_KEYS,
+        daily_limit=config.DART_DAILY_LIMIT,
+        requests_per_second=config.DART_REQUESTS_PER_SECOND / num_workers,
+        ledger=QuotaLedger(f'{config.DART_RESULT_DIR}/dart-quota.json'),
+        wait_for_reset=wait_for_reset,
+        logger=logger
+    )
+
+
+def flush_dart_quota():
+    """Writes the DART requests of this process which are not in the quota ledger yet."""
+    if dart_key_scheduler is not None:
+        dart_key_scheduler.ledger.flush()
+
+
+def rebuild_indices_path() -> Path:
+    return Path(config.DART_RESULT_DIR, 'rebuild-indices.json')
+
+
+def load_rebuild_indices() -> dict:
+    """year -> rebuild index which is not swapped in yet."""
+    path = rebuild_indices_path()
+    return {int(y): i for y, i in json.loads(path.read_text()).items()} if path.exists() else {}
+
+
+def save_rebuild_indices(indices: dict):
+    path = rebuild_indices_path()
+    if indices:
+        path.write_text(json.dumps({str(y): i for y, i in indices.items()}))
+    elif path.exists():
+        path.unlink()
+
+
+def prepare_rebuild_indices(client, years, resume=False) -> dict:
+    """Physical indices the rebuild of years writes into.
+
+        They are kept in rebuild-indices.json until they are swapped in. With
+        resume the unfinished indices of the last run are reused, because the
+        checkpoint skips the quarters already written into them. Otherwise
+        those indices are deleted and new ones are created.
+
+    Returns:
+        dict: year -> index. None if resume finds no unfinished index of some year
+    """
+    unfinished = load_rebuild_indices()
+    if resume:
+        indices = {y: unfinished.get(y) for y in years}
+        if all(i and client.indices.exists(index=i) for i in indices.values()):
+            logger.info(f'Resuming the rebuild into {", ".join(indices.values())}')
+            return indices
+        return None
+    for year in years:
+        # swap 되지 않은 index 는 alias 가 없으므로 읽는 곳이 없다
+        if year in unfinished:
+            client.options(ignore_status=404).indices.delete(index=unfinished.pop(year))
+    indices = {y: create_year_index(client, y) for y in years}
+    save_rebuild_indices(unfinished | indices)
+    return indices
+
+
+def swap_rebuild_indices(client, indices: dict, stats: dict, delete_old=False):
+    """Swaps the rebuilt indices in if every quarter was imported. Otherwise they are kept for --resume."""
+    unfinished = []
+    if stats['failures']:
+        unfinished.append(f'{stats["failures"]} documents failed')
+    if stats['retry_queue']:
+        unfinished.append(f'{stats["retry_queue"]} quarters are in the retry queue')
+    if stats.get('failed_workers'):
+        unfinished.append(f'{stats["failed_workers"]} workers did not finish')
+    if unfinished:
+        logger.error(f'{", ".join(indices.values())} are not swapped in because {", ".join(unfinished)}. '
+                     f'Run again with --resume')
+        return
+    remaining = load_rebuild_indices()
+    for year, index in indices.items():
+        swap_year_index(client, year, index, delete_old=delete_old, logger=logger)
+        remaining.pop(year, None)
+        save_rebuild_indices(remaining)
+
+
+def start_metrics_exporters(client, port=None, interval=None) -> list:
+    """Exports the metrics of this process.
+
+    Args:
+        port: serve Prometheus text on GET :port/metrics
+        interval: index a snapshot into importer_metrics every interval seconds
+
+    Returns:
+        list: started exporters. Call stop() of each at the end of the run
+    """
+    exporters = []
+    if port is not None:
+        server = MetricsServer(metrics, port).start()
+        logger.info(f'Serving metrics on :{server.port}/metrics')
+        exporters.append(server)
+    if interval:
+        create_aliased_index(client, 'importer_metrics', logger=logger)
+        exporters.append(MetricsReporter(metrics, client, interval=interval, logger=logger).start())
+    return exporters
+
+
+def stage_seconds() -> dict:
+    """Total seconds spent in each instrumented stage, summed over every label."""
+    stages = {'quota_wait': dart_quota_wait_seconds, 'dart_request': dart_request_seconds,
+              'decode': dart_decode_seconds, 'transform': transform_seconds, 'bulk_batch': bulk_batch_seconds}
+    seconds = {name: round(sum(value['sum'] for _, value in h.samples()), 1) for name, h in stages.items()}
+    for labels, value in pipeline_blocked_seconds.samples():
+        seconds[f'{labels["stage"]}_blocked'] = round(value, 1)
+    return seconds
+
+
+def pipeline_stage_options(stage) -> dict:
+    """Thread name and queue metrics of a buffered() stage or a BufferedSink."""
+    return dict(name=f'corp-data-{stage}', on_depth=functools.partial(pipeline_queue_depth.set, stage=stage),
+                on_blocked=functools.partial(pipeline_blocked_seconds.inc, stage=stage))
+
+
+def configure_profiler(output_dir, sample_rate=1.0, memory=False):
+    """Turns profiling on for this process. The profiles are written by profiler.save()."""
+    global profiler
+    profiler = ImportProfiler(output_dir, sample_rate=sample_rate, memory=memory)
+
+
+def save_profile():
+    output_dir = profiler.save()
+    if output_dir:
+        logger.info(f'Profiles are written to {output_dir}')
+
+
+def run_import_worker(worker_id, num_workers, import_options: dict, progress_queue, metrics_options=None,
+                      profile_options=None, host_id=0, num_hosts=1, wait_for_reset=True):
+    """Entry point of a worker process spawned by launch_import_workers().
+
+        The worker imports partition host_id + num_hosts * worker_id of
+        num_hosts * num_workers, i.e. its share of the host_id partition.
+    """
+    configure_logging()
+    configure_worker_quota(num_workers, wait_for_reset)
+    get_dart_http().set_pool_size(max(get_dart_http().pool_size, import_options.get('fetch_concurrency', 1)))
+    if profile_options:
+        configure_profiler(**profile_options)
+    exporters = start_metrics_exporters(get_esclient(), **(metrics_options or {}))
+    try:
+        with profiler.stage('corp_data'):
+            stats = import_all_corp_data(get_esclient(), worker_id=host_id + num_hosts * worker_id,
+                                         num_workers=num_hosts * num_workers, show_progress=False,
+                                         on_progress=lambda n: progress_queue.put(('progress', worker_id, n)),
+                                         **import_options)
+        progress_queue.put(('done', worker_id, stats))
+    except Exception as e:
+        progress_queue.put(('failed', worker_id, repr(e)))
+        raise
+    finally:
+        flush_dart_quota()
+        for exporter in exporters:
+            exporter.stop()
+        save_profile()
+
+
+def launch_import_workers(num_workers, import_options: dict, metrics_options=None, profile_options=None,
+                          host_id=0, num_hosts=1, wait_for_reset=True) -> dict:
+    """Spawns num_workers local processes which split the corp partition of this host between them.
+
+        corp_partition(c, num_hosts * num_workers) == host_id + num_hosts * k
+        holds exactly when corp_partition(c, num_hosts) == host_id, so hosts
+        may run different numbers of local workers.
+
+    Args:
+        host_id: partition of this host (--worker-id)
+        num_hosts: number of host partitions (--num-workers)
+        wait_for_reset: False stops a worker with QuotaExhausted instead of waiting (--on-quota-exhausted stop)
+        metrics_options: port and interval of start_metrics_exporters(). Worker k serves port + 1 + k
+        profile_options: arguments of configure_profiler(). Worker k writes to output_dir/worker-k
+
+    Returns:
+        dict: aggregated stats of all workers. failed_workers counts the workers which did not report done
+    """
+    from tqdm import tqdm
+
+    ctx = multiprocessing.get_context('spawn')
+    progress_queue = ctx.Queue()
+    metrics_options = metrics_options or {}
+
+    def worker_metrics_options(k):
+        if metrics_options.get('port'):
+            return metrics_options | {'port': metrics_options['port'] + 1 + k}
+        return metrics_options
+
+    def worker_profile_options(k):
+        if profile_options:
+            return profile_options | {'output_dir': Path(profile_options['output_dir'], f'worker-{k}')}
+        return None
+
+    procs = [ctx.Process(target=run_import_worker, name=f'import-worker-{k}',
+                         args=(k, num_workers, import_options, progress_queue, worker_metrics_options(k),
+                               worker_profile_options(k), host_id, num_hosts, wait_for_reset))
+             for k in range(num_workers)]
+    t = time.monotonic()
+    for p in procs:
+        p.start()
+
+    progress = tqdm(unit="docs")
+    reports = dict()
+    while len(reports) < num_workers:
+        try:
+            kind, worker_id, value = progress_queue.get(timeout=5)
+        except queue.Empty:
+            if not any(p.is_alive() for p in procs):
+                break
+            continue
+        if kind == 'progress':
+            progress.update(value)
+        else:
+            reports[worker_id] = value
+            if kind == 'failed':
+                logger.error(f'Worker {worker_id} failed : {value}')
+    progress.close()
+    for p in procs:
+        p.join()
+
+    summary = {'corps': 0, 'quarters': 0, 'documents': 0, 'derived': 0, 'failures': 0, 'retry_queue': 0}
+    for stats in reports.values():
+        if type(stats) == dict:
+            summary = {k: summary[k] + stats[k] for k in summary}
+    summary['failed_workers'] = num_workers - sum(type(stats) == dict for stats in reports.values())
+    summary['elapsed'] = time.monotonic() - t
+    logger.info(f'{num_workers} workers : {format_import_stats(summary)}')
+    if summary['failed_workers']:
+        logger.error(f'{summary["failed_workers"]} of {num_workers} workers did not finish')
+    return summary
+
+
+def upload_quarter_corp_data_history(client, corp_code, qdata: dict, successes) -> tuple:
+    """Records an imported quarter in corp_import_history.
+
+    Returns:
+        tuple: (corp_code, year<int>, reprt_code) manifest key
+    """
+    import pendulum
+
+    doc = qdata['list'][0]
+    year = int(doc['bsns_year'])
+    reprt_code = doc['reprt_code']
     history = {
         'corp_code': corp_code,
-        'year': qdata['list'][0]['bsns_year']
+        'year': str(year),
+        'reprt_code': reprt_code,
+        'created_time': pendulum.now('UTC').to_iso8601_string(),
+        'number_of_imported_documents': successes
     }
+    client.index(index="corp_import_history", id=f'{corp_code}-{year}-{reprt_code}', document=history)
+    return corp_code, year, reprt_code
 
 
-def _get_time_frame(doc) -> dict:
-    # doc["time_frame"]: {
-    #   "gte": "2015-10-31 12:00:00",
-    #   "lte": "2015-11-01"
-    # pass
-    qc = doc['reprt_code']
-    y = int(doc['bsns_year'])
-    month = QUARTER_CODES.index(qc) * 3 + 1
-    tf = {
-        'gte': pendulum.datetime(y, month, 1).start_of('month').start_of('day').in_tz('Asia/Seoul').to_iso8601_string(),
-        'lte': pendulum.datetime(y, month + 2, 1).end_of('month').end_of('day').in_tz('Asia/Seoul').to_iso8601_string()
-    }
-    doc.update({'time_frame': tf})
-    return doc
+def delete_superseded_corp_data(client, qdata: dict) -> int:
+    """Deletes corp_data rows of the quarter which came from another filing.
 
+        fnlttSinglAcntAll returns the latest filing of a quarter. When a
+        report is amended the new rows have a new rcept_no, so rows of the
+        replaced filing would otherwise stay next to them.
+
+    Returns:
+        int: number of deleted documents
+    """
+    doc = qdata['list'][0]
+    resp = client.delete_by_query(
+        index="corp_data",
+        query={
+            "bool": {
+                "filter": [
+                    {"term": {"corp_code": doc['corp_code']}},
+                    {"term": {"reprt_code": doc['reprt_code']}},
+                    {"term": {"bsns_year": doc['bsns_year']}},
+                ],
+                "must_not": [{"term": {"rcept_no": doc['rcept_no']}}]
+            }
+        },
+        conflicts='proceed',
+    )
+    if resp['deleted'] > 0:
+        logger.info(f'Deleted {resp["deleted"]} superseded documents of {doc["corp_code"]} '
+                    f'{doc["bsns_year"]} {doc["reprt_code"]}')
+    return resp['deleted']
+
+
+def is_valid_quarter_corp_data(qdata) -> bool:
+    if isinstance(qdata, FetchError):
+        return False
 
-def upload_quarter_corp_data(client, corp_code, qdata: dict) -> int:
     if type(qdata) != dict:
         logger.error(f'Data type is not dict : {str(type(qdata))}')
-        return -1
+        return False
 
     if qdata['status'] != '000':
         logger.error(f'Status code is {qdata["status"]}({qdata["message"]})')
-        return -1
-
-    docs = qdata['list']
-    number_of_docs = len(docs)
-    progress = tqdm(unit="docs", total=number_of_docs)
-    successes = 0
-    logging.disable(sys.maxsize)
-    for doc in docs:
-        # create 는 id 필요. index 는 불필요
-        doc = _get_time_frame(doc)
-        resp = client.index(index="corp_data", document=doc)
-        # http status 200 or 201
-        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/201
-        if resp['result'] == 'created':
-            successes += 1
-        progress.update(1)
-    logging.disable(logging.NOTSET)
-
-    # logger.info("Indexed %d/%d documents" % (successes, number_of_docs))
-    upload_quarter_corp_data_history(client, corp_code, qdata, successes)
-
-    return successes
+        return False
+
+    return True
+
+
+def corp_data_doc_id(doc) -> str:
+    """Deterministic _id of a corp_data row so that re-imports are upserts."""
+    key = '|'.join(str(doc.get(f, '')) for f in CORP_DATA_ID_FIELDS)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def prepare_quarter_actions(quarters, index_for_year):
+    """Bulk actions of quarters.
+
+    Args:
+        quarters: iterable of (key, qdata) or (key, qdata, extra actions). Rows are transformed by with_year_metrics()
+        index_for_year: callable(bsns_year) -> write index
+
+    Yields:
+        tuple: (key, qdata, actions, valid). Invalid quarters only have their extra actions
+    """
+    for key, qdata, *extra in quarters:
+        extra_actions = extra[0] if extra else []
+        if not is_valid_quarter_corp_data(qdata):
+            yield key, qdata, extra_actions, False
+            continue
+        docs = qdata['list']
+        index = index_for_year(docs[0]['bsns_year']) if docs else None
+        actions = [{'_index': index, '_id': corp_data_doc_id(doc), '_source': doc} for doc in docs]
+        yield key, qdata, actions + extra_actions, True
+
+
+def bulk_index_corp_data(client, quarters, chunk_size=500, thread_count=1, on_quarter_done=None,
+                         progress=None, index_for_year=None, queue_size=0) -> dict:
+    """Indexes corp_data rows of many quarters through one bulk stream.
+
+        Rows of every quarter (across corps) are batched together. Each
+        result is credited to its quarter by _id, because streaming_bulk
+        yields the documents retried after a 429 at the end of the chunk.
+        Quarters are reported in order once all of their results are in.
+
+        With queue_size, quarters are transformed (by pulling quarters) on
+        their own thread while the bulk requests are in flight.
+
+    Args:
+        client: Elasticsearch
+        quarters: iterable of (key, qdata) from with_year_metrics(). key is passed back to on_quarter_done
+        chunk_size: documents per bulk request
+        thread_count: > 1 uses parallel_bulk
+        on_quarter_done: callback(key, qdata, successes). successes is -1 for invalid data
+        progress: tqdm
+        index_for_year: callable(bsns_year) -> write index. Default YearIndexRouter(client)
+        queue_size: transformed quarters waiting for the bulk stream. 0 transforms in the bulk stream
+
+    Returns:
+        dict: successes, failures
+    """
+    from elasticsearch.helpers import parallel_bulk, streaming_bulk
+
+    # 아직 결과를 받지 못한 quarter : [key, qdata, remaining, successes]
+    pending = collections.deque()
+    # 결과를 기다리는 _id -> quarter. 한 quarter 에 같은 _id 의 행이 여러 개 있을 수 있다
+    owners = dict()
+    # parallel_bulk 는 다른 thread 에서 actions 를 읽는다
+    owners_lock = threading.Lock()
+    index_for_year = index_for_year or YearIndexRouter(client, logger=logger)
+    prepared = prepare_quarter_actions(quarters, index_for_year)
+    if queue_size:
+        prepared = buffered(prepared, queue_size, **pipeline_stage_options('transform'))
+
+    def generate_actions():
+        for key, qdata, actions, valid in prepared:
+            quarter = [key, qdata, len(actions), 0 if valid else -1]
+            with owners_lock:
+                for action in actions:
+                    owners.setdefault(action['_id'], collections.deque()).append(quarter)
+            pending.append(quarter)
+            bulk_pending_quarters.set(len(pending))
+            yield from actions
+
+    def pop_owner(doc_id):
+        with owners_lock:
+            quarters = owners[doc_id]
+            quarter = quarters.popleft()
+            if not quarters:
+                del owners[doc_id]
+        return quarter
+
+    def pop_done_quarters():
+        while pending and pending[0][2] == 0:
+            key, qdata, _, n = pending.popleft()
+            bulk_pending_quarters.set(len(pending))
+            if on_quarter_done:
+                on_quarter_done(key, qdata, n)
+
+    if thread_count > 1:
+        results = parallel_bulk(client, generate_actions(), thread_count=thread_count, chunk_size=chunk_size,
+                                raise_on_error=False, raise_on_exception=False)
+    else:
+        results = streaming_bulk(client, generate_actions(), chunk_size=chunk_size, max_retries=3,
+                                 raise_on_error=False, raise_on_exception=False)
+
+    total = {'successes': 0, 'failures': 0, 'derived': 0}
+    batch = {'successes': 0, 'failures': 0}
+    batch_started = time.perf_counter()
+    # queue_size 가 0 이면 표본이 아닌 corp 의 transform 은 bulk 에 포함된다
+    for ok, item in profiler.iterate('bulk', results, chunk_size):
+        info = next(iter(item.values()))
+        quarter = pop_owner(info['_id'])
+        quarter[2] -= 1
+        derived = info.get('_index', '').startswith('corp_metrics')
+        bulk_documents.inc(kind='corp_metrics' if derived else 'corp_data', result='ok' if ok else 'failed')
+        if ok:
+            batch['successes'] += 1
+            if derived:
+                total['derived'] += 1
+            else:
+                quarter[3] += 1
+                total['successes'] += 1
+        else:
+            batch['failures'] += 1
+            total['failures'] += 1
+            if batch['failures'] == 1:
+                logger.error(f'Bulk index failed : {item}')
+        if progress is not None:
+            progress.update(1)
+        pop_done_quarters()
+        if batch['successes'] + batch['failures'] == chunk_size:
+            logger.debug(f'Bulk batch indexed {batch["successes"]}, failed {batch["failures"]}')
+            batch = {'successes': 0, 'failures': 0}
+            bulk_batch_seconds.observe(time.perf_counter() - batch_started)
+            batch_started = time.perf_counter()
+    pop_done_quarters()
+    if batch['successes'] + batch['failures'] > 0:
+        logger.debug(f'Bulk batch indexed {batch["successes"]}, failed {batch["failures"]}')
+
+    return total
+
+
+def has_quarter_rows(qdata) -> bool:
+    return type(qdata) == dict and qdata.get('status') == '000' and bool(qdata.get('list'))
+
+
+def with_year_metrics(corp_code, keyed_quarters: list, load_quarter=None):
+    """Transforms the quarters of a corp year and attaches the corp_metrics actions to its last quarter.
+
+        Rows are transformed once here, both for the metrics and for
+        bulk_index_corp_data(). Metrics need all four reports of the year.
+        Reports which are not in keyed_quarters (skipped as already imported,
+        retried, or not filed since the last sync) are read with load_quarter.
+
+    Args:
+        corp_code:
+        keyed_quarters: [(key, qdata), ...] of one corp year in QUARTER_CODES order
+        load_quarter: callable(year, reprt_code) -> qdata or None, e.g. load_cached_quarter_corp_data
+
+    Yields:
+        tuple: (key, qdata) or (key, qdata, metric actions) for the last quarter
+    """
+    year_rows = dict()
+    for _, qdata in keyed_quarters:
+        if has_quarter_rows(qdata):
+            with transform_seconds.time(), profiler.profile('transform', corp_code):
+                year_rows[qdata['list'][0]['reprt_code']] = transform_quarter(qdata['list'])
+    if year_rows and load_quarter and len(year_rows) < len(QUARTER_CODES):
+        year = int(next(iter(year_rows.values()))[0]['bsns_year'])
+        for rt in QUARTER_CODES:
+            if rt not in year_rows:
+                try:
+                    qdata = load_quarter(year, rt)
+                except Exception as e:
+                    # 분기가 빠지면 지표는 만들어지지 않는다
+                    logger.warning(f'Loading {corp_code} {year} {rt} failed, skipping its metrics : {e!r}')
+                    break
+                if has_quarter_rows(qdata):
+                    year_rows[rt] = transform_quarter(qdata['list'])
+    with profiler.profile('metrics', corp_code):
+        metrics = list(generate_corp_metrics_actions(corp_code, year_rows))
+    for i, (key, qdata) in enumerate(keyed_quarters):
+        if metrics and i == len(keyed_quarters) - 1:
+            yield key, qdata, metrics
+        else:
+            yield key, qdata
+
+
+def upload_quarter_corp_data(client, corp_code, qdata: dict) -> int:
+    ns = upload_year_corp_data(client, corp_code, [qdata])
+    return ns[0]
 
 
 def upload_year_corp_data(client, corp_code, ydata: list):
     ns = []
-    for qdata in ydata:
-        ns.append(upload_quarter_corp_data(client, corp_code, qdata))
+
+    def on_quarter_done(corp_code, qdata, successes):
+        ns.append(successes)
+        if successes >= 0:
+            upload_quarter_corp_data_history(client, corp_code, qdata, successes)
+
+    bulk_index_corp_data(client, with_year_metrics(corp_code, [(corp_code, qdata) for qdata in ydata]),
+                         on_quarter_done=on_quarter_done)
     return ns
 
 
-def main():
-    indices = ['corp_code', 'corp_data']
+INDICES = ['corp_code', 'corp_data']
+
+
+def add_import_arguments(parser):
+    """Options of the corp_code and corp_data imports, shared by the import and rebuild-years commands."""
+    parser.add_argument(
+        '--bulk-load', help='Turn refresh and replicas off while importing and restore them afterwards',
+        action='store_true')
+    parser.add_argument(
+        '--refresh-corp-code', help='Download CORPCODE.xml again and upsert only the new or modified corps',
+        action='store_true')
+    parser.add_argument(
+        '--fetch-concurrency', help='Number of concurrent DART requests while importing corp_data',
+        type=int, default=1, metavar='N')
+    parser.add_argument(
+        '--bulk-chunk-size', help='Documents per bulk request while importing corp_data',
+        type=int, default=500, metavar='N')
+    parser.add_argument(
+        '--bulk-threads', help='Number of parallel bulk requests while importing corp_data',
+        type=int, default=1, metavar='N')
+    parser.add_argument(
+        '--queue-size', help='Quarters queued between the fetch, transform, bulk and record stages. '
+                             '0 runs them one after another',
+        type=int, default=32, metavar='N')
+    parser.add_argument(
+        '--corp-source', help='Where corp_data import reads the corp list from. '
+                              'xml reads corp-code.zip without ES reads',
+        choices=['es', 'xml'], default='es')
+    parser.add_argument(
+        '--workers', help='Spawn N local worker processes for the corp_data import. '
+                          'With --worker-id they split the partition of this host',
+        type=int, default=1, metavar='N')
+    parser.add_argument(
+        '--worker-id', help='Partition handled by this process (0 <= K < --num-workers). '
+                            'Use to split the corp_data import across hosts',
+        type=int, default=0, metavar='K')
+    parser.add_argument(
+        '--num-workers', help='Total number of partitions when --worker-id is used',
+        type=int, default=1, metavar='N')
+    parser.add_argument(
+        '--resume', help='Continue the corp_data import from the checkpoint of the last run',
+        action='store_true')
+    parser.add_argument(
+        '--export-columnar', help='Append the local corp_data cache to a parquet dataset in DIR. '
+                                  'When corp_data is imported, fetched quarters are appended too',
+        metavar='DIR')
+    parser.add_argument(
+        '--watchlist', help='File of corp_code or stock_code (one per line) imported before every other corp',
+        metavar='FILE')
+    parser.add_argument(
+        '--only-listed', help='Import corp_data of listed corps (and the watchlist) only',
+        action='store_true')
+    parser.add_argument(
+        '--since', help='Only import the quarters of periodic reports filed since YYYYMMDD (incremental sync)',
+        metavar='YYYYMMDD')
+    parser.add_argument(
+        '--until', help='End of the --since sync. Default today',
+        metavar='YYYYMMDD')
+    parser.add_argument(
+        '--no-response-cache', help='Always ask DART instead of using the local response cache',
+        action='store_true')
+    parser.add_argument(
+        '--metrics-port', help='Serve Prometheus metrics on PORT/metrics. With --workers, worker K uses PORT+1+K',
+        type=int, metavar='PORT')
+    parser.add_argument(
+        '--metrics-interval', help='Index a snapshot of the metrics into importer_metrics every SECONDS',
+        type=float, metavar='SECONDS')
+    parser.add_argument(
+        '--profile', help='Write CPU profiles of the import to DART_RESULT_DIR/profiles/<time>',
+        action='store_true')
+    parser.add_argument(
+        '--profile-sample', help='Fraction of corps (and bulk batches) profiled with --profile',
+        type=float, default=1.0, metavar='RATE')
+    parser.add_argument(
+        '--profile-memory', help='Also take tracemalloc snapshots around each stage with --profile. Slow',
+        action='store_true')
+    parser.add_argument(
+        '--on-quota-exhausted', help='Wait until the DART quota resets or stop the import',
+        choices=['wait', 'stop'], default='wait')
+    return parser
+
+
+def build_legacy_parser():
+    """The flag style command line, e.g. ./import_dart_data.py --import-data corp_code. Still accepted."""
     parser = argparse.ArgumentParser(description='dart importer')
     parser.add_argument(
         '--create-index',
         help='Create ElasticSearch Index. Example: ./import_dart_data.py --create-index corp_code corp_data',
-        choices=indices, nargs="+", default=[])
+        choices=INDICES + ['corp_metrics'], nargs="+", default=[])
     parser.add_argument(
         '--delete-documents', help='Delete all documents',
-        choices=indices, nargs="+", default=[])
+        choices=INDICES + ['corp_metrics'], nargs="+", default=[])
+    parser.add_argument(
+        '--migrate-index', help='Reindex into a new index with the current mappings and swap the alias',
+        choices=list(INDEX_MAPPINGS), nargs="+", default=[])
+    parser.add_argument(
+        '--delete-old-index', help='Delete the old indices after --migrate-index or --rebuild-years',
+        action='store_true')
+    parser.add_argument(
+        '--rebuild-years', help='Import corp_data of YEARs into fresh indices and swap them behind the aliases',
+        type=int, nargs="+", default=[], metavar='YEAR')
+    parser.add_argument(
+        '--seal-years', help='Force merge the corp_data indices of YEARs and make them read-only',
+        type=int, nargs="+", default=[], metavar='YEAR')
     parser.add_argument(
         '--import-data', help='Import data',
-        choices=indices, nargs="+", default=[])
+        choices=INDICES, nargs="+", default=[])
+    parser.add_argument(
+        '--rebuild-cache-index', help='Rebuild the manifest of locally cached corp_data from the zip files',
+        action='store_true')
     # parser.add_argument(
     #     '--import-corp-data', help='Import corp data(filings, ...)', action='store_true')
+    return add_import_arguments(parser)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='dart importer',
+        epilog='The flag style of older versions (--import-data corp_data, ...) is still accepted')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND', required=True)
+
+    p = commands.add_parser('create-index', help='Create the indices, their aliases and the corp_data template')
+    p.add_argument('create_index', choices=INDICES + ['corp_metrics'], nargs='+', metavar='INDEX')
+
+    p = commands.add_parser('delete-documents', help='Delete all documents of the indices')
+    p.add_argument('delete_documents', choices=INDICES + ['corp_metrics'], nargs='+', metavar='INDEX')
+
+    p = commands.add_parser('migrate-index', help='Reindex into a new index with the current mappings '
+                                                  'and swap the alias')
+    p.add_argument('migrate_index', choices=list(INDEX_MAPPINGS), nargs='+', metavar='ALIAS')
+    p.add_argument('--delete-old-index', help='Delete the old indices afterwards', action='store_true')
+
+    p = commands.add_parser('import', help='Import corp_code and/or corp_data')
+    p.add_argument('import_data', choices=INDICES, nargs='+', metavar='INDEX')
+    add_import_arguments(p)
+
+    p = commands.add_parser('rebuild-years', help='Import corp_data of YEARs into fresh indices and swap them '
+                                                  'behind the aliases')
+    p.add_argument('rebuild_years', type=int, nargs='+', metavar='YEAR')
+    p.add_argument('--delete-old-index', help='Delete the replaced indices after the swap', action='store_true')
+    add_import_arguments(p)
+
+    p = commands.add_parser('seal-years', help='Force merge the corp_data indices of YEARs and make them read-only')
+    p.add_argument('seal_years', type=int, nargs='+', metavar='YEAR')
 
-    args = parser.parse_args()
+    p = commands.add_parser('rebuild-cache-index', help='Rebuild the manifest of locally cached corp_data '
+                                                        'from the zip files')
+    p.set_defaults(rebuild_cache_index=True)
+
+    p = commands.add_parser('export-columnar', help='Append the local corp_data cache to a parquet dataset in DIR')
+    p.add_argument('export_columnar', metavar='DIR')
+    return parser
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parses a subcommand or the legacy flags. Every option missing from a subcommand has its legacy default."""
+    argv = sys.argv[1:] if argv is None else argv
+    legacy_parser = build_legacy_parser()
+    if argv and argv[0].startswith('--') and argv[0] != '--help':
+        parser = legacy_parser
+        args = parser.parse_args(argv)
+        args.command = None
+    else:
+        parser = build_parser()
+        args = argparse.Namespace(**(vars(legacy_parser.parse_args([])) | vars(parser.parse_args(argv))))
+
+    if not 0 <= args.worker_id < args.num_workers:
+        parser.error('--worker-id must be between 0 and --num-workers - 1')
+    for name in ('since', 'until'):
+        value = getattr(args, name)
+        if value is not None and not re.fullmatch(r'[0-9]{8}', value):
+            parser.error(f'--{name} must be YYYYMMDD')
+    if args.until and not args.since:
+        parser.error('--until needs --since')
+    if args.rebuild_years and args.since:
+        parser.error('--rebuild-years can not be used with --since')
+    if not 0 < args.profile_sample <= 1:
+        parser.error('--profile-sample must be in (0, 1]')
+    if args.queue_size < 0:
+        parser.error('--queue-size must be >= 0')
+    return args
+
+
+def run(args):
+    """Runs what args asks for, in the order of the legacy flags."""
+    importing = 'corp_code' in args.import_data or 'corp_data' in args.import_data or args.refresh_corp_code \
+        or bool(args.rebuild_years)
+    if importing:
+        get_dart_key_scheduler().wait_for_reset = args.on_quota_exhausted == 'wait'
+        get_dart_http().set_pool_size(max(get_dart_http().pool_size, args.fetch_concurrency))
+    if args.no_response_cache:
+        config.DART_RESPONSE_CACHE = 'off'
+        # spawn 된 worker 도 cache 를 쓰지 않도록
+        os.environ['DART_RESPONSE_CACHE'] = 'off'
+
+    if args.rebuild_cache_index:
+        n = get_dart_cache_index().rebuild(logger=logger)
+        logger.info(f'Cache index has {n} corps')
+
+    if args.export_columnar:
+        export_cache(config.DART_RESULT_DIR, args.export_columnar, logger=logger)
 
     if len(args.create_index) > 0:
-        create_index(esclient, args.create_index)
+        create_index(get_esclient(), args.create_index)
+
+    for alias in args.migrate_index:
+        migrate_index(get_esclient(), alias, delete_old=args.delete_old_index, logger=logger)
 
     if len(args.delete_documents):
         ans = input("WARNING: Delete all data? Type 'delete' to proceed.\nYour choice: ")
         if ans.strip().lower() == 'delete':
-            delete_documents(esclient, args.delete_documents)
+            delete_documents(get_esclient(), args.delete_documents)
         else:
             print('Cancelled.')
 
-    if 'corp_code' in args.import_data:
-        import_corp_code(esclient)
-
-    if 'corp_data' in args.import_data:
-        import_all_corp_data(esclient)
+    if not importing and not args.seal_years:
+        return
+
+    bulk_load_aliases = []
+    if args.bulk_load:
+        if 'corp_code' in args.import_data or args.refresh_corp_code:
+            bulk_load_aliases.append('corp_code')
+        if 'corp_data' in args.import_data or args.rebuild_years:
+            bulk_load_aliases += ['corp_data', 'corp_metrics']
+
+    metrics_options = dict(port=args.metrics_port, interval=args.metrics_interval)
+    profile_options = None
+    if args.profile:
+        profile_dir = f'{config.DART_RESULT_DIR}/profiles/{datetime.now().strftime("%Y%m%dT%H%M%S")}'
+        profile_options = dict(output_dir=profile_dir, sample_rate=args.profile_sample, memory=args.profile_memory)
+        configure_profiler(**profile_options)
+    esclient = get_esclient()
+    exporters = start_metrics_exporters(esclient, **metrics_options)
+    try:
+        with bulk_load(esclient, bulk_load_aliases, logger=logger):
+            if 'corp_code' in args.import_data or args.refresh_corp_code:
+                with profiler.stage('corp_code', cpu=True):
+                    import_corp_code(esclient, refresh=args.refresh_corp_code)
+
+            if 'corp_data' in args.import_data or args.rebuild_years:
+                import_options = dict(fetch_concurrency=args.fetch_concurrency, bulk_chunk_size=args.bulk_chunk_size,
+                                      bulk_threads=args.bulk_threads, queue_size=args.queue_size,
+                                      corp_source=args.corp_source, bulk_load=args.bulk_load,
+                                      resume=args.resume, columnar_dir=args.export_columnar,
+                                      since=args.since, until=args.until, only_listed=args.only_listed,
+                                      watchlist=load_watchlist(args.watchlist) if args.watchlist else None)
+                if args.rebuild_years:
+                    import_options['rebuild_indices'] = prepare_rebuild_indices(esclient, args.rebuild_years,
+                                                                                args.resume)
+                    if args.resume and import_options['rebuild_indices'] is None:
+                        logger.warning('The unfinished rebuild indices are gone. Rebuilding from the start')
+                        import_options['resume'] = False
+                        import_options['rebuild_indices'] = prepare_rebuild_indices(esclient, args.rebuild_years)
+                if args.workers > 1:
+                    stats = launch_import_workers(args.workers, import_options, metrics_options, profile_options,
+                                                  host_id=args.worker_id, num_hosts=args.num_workers,
+                                                  wait_for_reset=args.on_quota_exhausted == 'wait')
+                else:
+                    with profiler.stage('corp_data'):
+                        stats = import_all_corp_data(esclient, worker_id=args.worker_id,
+                                                     num_workers=args.num_workers, **import_options)
+                if import_options.get('rebuild_indices'):
+                    swap_rebuild_indices(esclient, import_options['rebuild_indices'], stats,
+                                         delete_old=args.delete_old_index)
+
+        for year in args.seal_years:
+            seal_year_index(esclient, year, logger=logger)
+    except QuotaExhausted as e:
+        logger.warning(f'{e}. Run again after the reset.')
+    finally:
+        if importing:
+            latency = get_dart_http().latency.summary()
+            if latency['count'] > 0:
+                logger.info(f'DART request latency : {latency}')
+            if dart_response_cache is not None:
+                logger.info(f'DART response cache : {dart_response_cache.summary()}')
+            logger.info(f'Seconds per stage : {stage_seconds()}')
+            flush_dart_quota()
+        for exporter in exporters:
+            exporter.stop()
+        save_profile()
 
     # # 삼성전자
     # data = get_corp_info_from_dart('00126380', list(range(2021, 2023)))
@@ -719,5 +1987,17 @@ def main():
     # elastic_session.close()
 
 
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging()
+    if args.command is None:
+        logger.warning('The flag style command line is deprecated. See ./import_dart_data.py --help')
+    try:
+        run(args)
+    except ConfigError as e:
+        logger.error(e)
+        sys.exit(2)
+
+
 if __name__ == '__main__':
     main()
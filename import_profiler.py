@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""CPU and allocation profiles of an import run.
+
+    CPU profiles are taken per unit of work (a fetched quarter, a
+    transformed quarter, a bulk batch, ...) for a stable sample of keys,
+    so every quarter of a sampled corp is profiled in every stage and the
+    other corps run at full speed. Each thread has its own cProfile.Profile
+    per stage, a nested stage pauses the outer one.
+
+    Allocation profiles (tracemalloc) are taken around the top level
+    stages (corp_code, corp_data). tracemalloc slows down every
+    allocation, so it is opt-in.
+
+    Files written to output_dir:
+
+        <stage>.pstats   : python -m pstats <stage>.pstats
+        summary.txt      : wall time, sampled units and the top functions
+                           and allocations of every stage
+"""
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+from pathlib import Path
+
+
+class ImportProfiler:
+    def __init__(self, output_dir=None, sample_rate=1.0, memory=False, top=30, nframes=1):
+        """Profiles of one process. Disabled by default, so the hooks cost one attribute check.
+
+        Args:
+            output_dir: directory of the profiles. None disables profiling
+            sample_rate: fraction of keys (corps, bulk batches) which are profiled. 0 ~ 1
+            memory: take tracemalloc snapshots around the top level stages
+            top: functions and allocations listed per stage in summary.txt
+            nframes: frames kept per traced allocation
+        """
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.enabled = self.output_dir is not None and sample_rate > 0
+        self.sample_rate = sample_rate
+        self.memory = memory and self.enabled
+        self.top = top
+        self.nframes = nframes
+        self.units = Counter()
+        self.wall_times = dict()
+        self.allocations = dict()
+        # (thread id, stage) -> Profile
+        self._profiles = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+
+    def sampled(self, key) -> bool:
+        """Same answer for a key in every thread, process and run."""
+        if not self.enabled:
+            return False
+        if key is None or self.sample_rate >= 1:
+            return True
+        return zlib.crc32(str(key).encode()) % 10000 < self.sample_rate * 10000
+
+    def _profile_of(self, stage) -> cProfile.Profile:
+        with self._lock:
+            return self._profiles.setdefault((threading.get_ident(), stage), cProfile.Profile())
+
+    @contextlib.contextmanager
+    def profile(self, stage, key=None, count=True):
+        """Profiles the block in the calling thread when key is sampled. None is always sampled.
+
+        Args:
+            stage:
+            key: corp_code, batch number, ...
+            count: count the block as a profiled unit of stage
+        """
+        if not self.sampled(key):
+            yield
+            return
+        stack = self._local.__dict__.setdefault('stack', [])
+        if stack:
+            stack[-1].disable()
+        p = self._profile_of(stage)
+        stack.append(p)
+        if count:
+            with self._lock:
+                self.units[stage] += 1
+        p.enable()
+        try:
+            yield
+        finally:
+            p.disable()
+            stack.pop()
+            if stack:
+                stack[-1].enable()
+
+    def iterate(self, stage, iterable, batch_size):
+        """Profiles the next() calls of sampled batches of iterable, e.g. the results of a bulk helper."""
+        if not self.enabled:
+            yield from iterable
+            return
+        it = iter(iterable)
+        n = 0
+        while True:
+            with self.profile(stage, n // batch_size, count=n % batch_size == 0):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            n += 1
+            yield item
+
+    @contextlib.contextmanager
+    def stage(self, name, cpu=False):
+        """A top level stage: wall time and, with memory, the allocations made during it.
+
+        Args:
+            name:
+            cpu: also profile the calling thread for the whole stage. Only for short stages,
+                 long ones are covered by the sampled units profiled inside them
+        """
+        if not self.enabled:
+            yield
+            return
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+            self._started_tracemalloc = True
+        before = None
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        t = time.monotonic()
+        try:
+            with self.profile(name) if cpu else contextlib.nullcontext():
+                yield
+        finally:
+            self.wall_times[name] = self.wall_times.get(name, 0) + time.monotonic() - t
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                self.allocations[name] = {
+                    'peak': tracemalloc.get_traced_memory()[1],
+                    'diff': after.compare_to(before, 'lineno')[:self.top],
+                }
+
+    def stats(self, stage) -> pstats.Stats:
+        """Merged profile of every thread. None if the stage was not profiled."""
+        with self._lock:
+            profiles = [p for (_, s), p in self._profiles.items() if s == stage]
+        if not profiles:
+            return None
+        merged = pstats.Stats(profiles[0])
+        for p in profiles[1:]:
+            merged.add(p)
+        return merged
+
+    def stages(self) -> list:
+        with self._lock:
+            return sorted({s for _, s in self._profiles} | set(self.allocations))
+
+    def summary(self) -> str:
+        out = io.StringIO()
+        out.write(f'pid {os.getpid()}, sample rate {self.sample_rate}\n')
+        for name, seconds in self.wall_times.items():
+            out.write(f'{name} : {seconds:.1f}s wall\n')
+        for stage in self.stages():
+            out.write(f'\n==== {stage} : {self.units[stage]} profiled units\n')
+            stats = self.stats(stage)
+            if stats:
+                stats.stream = out
+                for sort in ('cumulative', 'tottime'):
+                    out.write(f'\n---- top {self.top} by {sort}\n')
+                    stats.sort_stats(sort).print_stats(self.top)
+            if stage in self.allocations:
+                allocations = self.allocations[stage]
+                out.write(f'\n---- top {self.top} allocations, peak {allocations["peak"] / 2 ** 20:.1f} MB\n')
+                for diff in allocations['diff']:
+                    out.write(f'{diff}\n')
+        return out.getvalue()
+
+    def save(self) -> Path:
+        """Writes <stage>.pstats and summary.txt.
+
+        Returns:
+            Path: output_dir, None when profiling is disabled
+        """
+        if not self.enabled:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        for stage in self.stages():
+            stats = self.stats(stage)
+            if stats:
+                stats.dump_stats(self.output_dir / f'{stage}.pstats')
+        (self.output_dir / 'summary.txt').write_text(self.summary())
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return self.output_dir
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Importer settings, read from .env and the environment on first use.
+
+    Importing the importer must not need credentials: --help, the tests and
+    spawned workers only read the settings they use.
+"""
+import functools
+import os
+import threading
+
+from dart_quota import DART_DAILY_LIMIT
+from manage_dart_file import DEFAULT_COMPRESSION
+
+
+class ConfigError(Exception):
+    """A required setting is missing."""
+
+
+class ImporterConfig:
+    def __init__(self, env_file='.env', environ=None):
+        """Settings are read on first access and cached. Assigning one overrides it.
+
+        Args:
+            env_file: dotenv file with the sensitive variables. Environment variables override it
+            environ: default os.environ
+        """
+        self.env_file = env_file
+        self.environ = os.environ if environ is None else environ
+
+    @functools.cached_property
+    def values(self) -> dict:
+        from dotenv import dotenv_values
+        return {
+            # **dotenv_values("../docker-elk/.env"),  # load shared development variables
+            **dotenv_values(self.env_file),  # load sensitive variables
+            **self.environ,  # override loaded values with environment variables
+        }
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    def require(self, name):
+        value = self.values.get(name)
+        if value is None:
+            raise ConfigError(f'{name} is not set. Add it to {self.env_file} or the environment, see env.example')
+        return value
+
+    @functools.cached_property
+    def DART_API_KEY(self):
+        return self.require('DART_API_KEY')
+
+    @functools.cached_property
+    def DART_API_KEYS(self) -> list:
+        # 여러 key 를 쓰려면 DART_API_KEYS=key1,key2
+        keys = self.get('DART_API_KEYS') or self.DART_API_KEY
+        return [k.strip() for k in keys.split(',') if k.strip()]
+
+    @functools.cached_property
+    def DART_RESULT_DIR(self):
+        return self.require('DART_RESULT_DIR')
+
+    @functools.cached_property
+    def DART_DAILY_LIMIT(self) -> int:
+        return int(self.get('DART_DAILY_LIMIT', DART_DAILY_LIMIT))
+
+    @functools.cached_property
+    def DART_REQUESTS_PER_SECOND(self) -> float:
+        return float(self.get('DART_REQUESTS_PER_SECOND', 10))
+
+    @functools.cached_property
+    def DART_CACHE_COMPRESSION(self):
+        # DartFileManager zip 압축: stored, deflate, bzip2, lzma
+        return self.get('DART_CACHE_COMPRESSION', DEFAULT_COMPRESSION)
+
+    @functools.cached_property
+    def DART_CACHE_COMPRESSLEVEL(self):
+        return int(self.get('DART_CACHE_COMPRESSLEVEL')) if self.get('DART_CACHE_COMPRESSLEVEL') else None
+
+    @functools.cached_property
+    def DART_API_URL(self):
+        # OpenDART API 주소. benchmark 는 local stub 을 쓴다
+        return self.get('DART_API_URL', 'https://opendart.fss.or.kr/api').rstrip('/')
+
+    @functools.cached_property
+    def DART_RESPONSE_CACHE(self):
+        # DART 응답 cache. off 이면 사용하지 않는다
+        return self.get('DART_RESPONSE_CACHE', 'on')
+
+    @functools.cached_property
+    def DART_RESPONSE_CACHE_TTL(self) -> int:
+        # DART 응답 cache 유효 시간(초). 마감된 사업연도의 응답은 만료되지 않는다
+        return int(self.get('DART_RESPONSE_CACHE_TTL', 86400))
+
+    @functools.cached_property
+    def DART_RESPONSE_CACHE_NO_DATA_TTL(self) -> int:
+        return int(self.get('DART_RESPONSE_CACHE_NO_DATA_TTL', 30 * 86400))
+
+    @functools.cached_property
+    def ELASTICSEARCH_URL(self):
+        return self.require('ELASTICSEARCH_URL')
+
+    @functools.cached_property
+    def ELASTIC_USER(self):
+        return self.require('ELASTIC_USER')
+
+    @functools.cached_property
+    def ELASTIC_PASSWORD(self):
+        return self.require('ELASTIC_PASSWORD')
+
+    @functools.cached_property
+    def ELASTIC_CERTFILE(self):
+        return self.get('ELASTIC_CERTFILE')
+
+    @functools.cached_property
+    def ELASTIC_CERTFILE_FINGERPRINT(self):
+        return self.require('ELASTIC_CERTFILE_FINGERPRINT')
+
+
+def lazy(factory):
+    """Calls factory once, on the first call, and returns its result afterwards.
+
+        Unlike functools.cache it is safe when the first calls come from
+        several fetch threads at once. get.reset() drops the value.
+    """
+    lock = threading.Lock()
+    value = []
+
+    @functools.wraps(factory)
+    def get():
+        if not value:
+            with lock:
+                if not value:
+                    value.append(factory())
+        return value[0]
+
+    get.reset = value.clear
+    return get
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""Counters, gauges and latency histograms of the import pipeline.
+
+    Metrics live in a MetricsRegistry and are exported either as Prometheus
+    text (MetricsServer, GET /metrics) or as periodic snapshots indexed into
+    importer_metrics (MetricsReporter), one document per sample.
+"""
+import bisect
+import contextlib
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+# seconds. DART 응답은 수십 ms ~ 수 초, bulk 요청은 수백 ms ~ 수십 초
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+IMPORTER_METRICS_MAPPINGS = {
+    "dynamic_templates": [
+        {"labels": {"path_match": "labels.*", "mapping": {"type": "keyword"}}}
+    ],
+    "properties": {
+        "@timestamp": {"type": "date"},
+        "host": {"type": "keyword"},
+        "pid": {"type": "integer"},
+        "name": {"type": "keyword"},
+        "type": {"type": "keyword"},
+        "labels": {"type": "object"},
+        # counter, gauge
+        "value": {"type": "double"},
+        # histogram
+        "count": {"type": "long"},
+        "sum": {"type": "double"},
+        "p50": {"type": "double"},
+        "p95": {"type": "double"},
+    }
+}
+
+
+def _label_key(labelnames, labels) -> tuple:
+    if set(labels) != set(labelnames):
+        raise ValueError(f'labels {sorted(labels)} do not match {list(labelnames)}')
+    return tuple(str(labels[k]) for k in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None) -> str:
+    pairs = list(zip(labelnames, key)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _finite(value):
+    # json 에는 inf 가 없다
+    return None if value == float('inf') else value
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def samples(self) -> list:
+        """Returns: [(labels dict, value)]"""
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value:g}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, n=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, n=1, **labels):
+        self.inc(-n, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # bucket 별 개수(마지막은 +Inf), sum
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def quantile(self, q, **labels) -> float:
+        """Upper bound of the bucket holding the q quantile. inf when it is past the last bucket."""
+        with self._lock:
+            counts = self._values.get(_label_key(self.labelnames, labels))
+            return self._quantile(counts[0], q) if counts else 0.0
+
+    def _quantile(self, counts, q) -> float:
+        rank = q * sum(counts)
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self) -> list:
+        """Returns: [(labels dict, {count, sum, p50, p95})]"""
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)),
+                     {'count': sum(counts), 'sum': total,
+                      'p50': _finite(self._quantile(counts, 0.5)), 'p95': _finite(self._quantile(counts, 0.95))})
+                    for key, (counts, total) in self._values.items()]
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, {"le": le})} '
+                                 f'{cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total:g}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Named metrics of one process. Asking twice for a name returns the same metric."""
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif type(metric) != cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f'{name} is already registered as another metric')
+            return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def metrics(self) -> list:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        return '\n'.join(line for metric in self.metrics() for line in metric.render()) + '\n'
+
+    def snapshot(self, now=None) -> list:
+        """One document per sample for the importer_metrics index."""
+        base = {
+            '@timestamp': (now or datetime.now(tz=timezone.utc)).isoformat(),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+        }
+        docs = []
+        for metric in self.metrics():
+            for labels, value in metric.samples():
+                doc = base | {'name': metric.name, 'type': metric.type, 'labels': labels}
+                docs.append(doc | value if type(value) == dict else doc | {'value': value})
+        return docs
+
+
+class MetricsServer:
+    def __init__(self, registry, port, host=''):
+        """Serves GET /metrics on a daemon thread.
+
+        Args:
+            registry: MetricsRegistry
+            port: 0 picks a free port, see .port
+            host: bind address. Default every interface
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MetricsReporter:
+    def __init__(self, registry, client, index='importer_metrics', interval=60, logger=None):
+        """Indexes a snapshot of registry every interval seconds and once more on stop().
+
+        Args:
+            registry: MetricsRegistry
+            client: Elasticsearch
+            index: alias created with INDEX_MAPPINGS['importer_metrics']
+            interval: seconds between snapshots
+        """
+        self.registry = registry
+        self.client = client
+        self.index = index
+        self.interval = interval
+        self.logger = logger
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-reporter', daemon=True)
+
+    def report(self) -> int:
+        """Returns: number of indexed samples"""
+        docs = self.registry.snapshot()
+        if not docs:
+            return 0
+        operations = []
+        for doc in docs:
+            operations += [{'index': {'_index': self.index}}, doc]
+        resp = self.client.bulk(operations=operations)
+        if resp.get('errors') and self.logger:
+            self.logger.warning(f'Some metrics were not indexed into {self.index}')
+        return len(docs)
+
+    def _report_quietly(self):
+        try:
+            self.report()
+        except Exception as e:
+            # metrics 때문에 import 가 멈추면 안 된다
+            if self.logger:
+                self.logger.warning(f'Reporting metrics failed : {e!r}')
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._report_quietly()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._report_quietly()
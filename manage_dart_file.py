@@ -1,10 +1,136 @@
 #!/usr/bin/env python
+import json
 import os
 import re
+import threading
+import time
 import zipfile
 from collections import defaultdict
 from pathlib import Path
 
+# zipfile 이 지원하는 codec. zstd 는 표준 zipfile 에 없으므로 빠른 저장은 deflate + 낮은 level 을 쓴다
+COMPRESSION_CODECS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+DEFAULT_COMPRESSION = 'deflate'
+
+
+class DartCacheIndex:
+    def __init__(self, data_dir, data_file_prefix='financial-statements', logger=None):
+        """Manifest of every corp zip under data_dir/corp_data.
+
+            corp_code -> {year -> {quarters, bytes, compressed_bytes, fetched}}
+
+            It is persisted as an append-only json lines file. Each line is one
+            (corp_code, year) entry and later lines win, so an update costs one
+            small append. rebuild() scans the zips and writes a compact file.
+
+            Without the file, e.g. on the first run after an upgrade, the zips
+            are scanned once so corps cached before the index are not fetched
+            again.
+
+        Args:
+            data_dir: DART_RESULT_DIR
+            data_file_prefix: prefix of the zip members
+            logger:
+        """
+        self.data_dir = Path(data_dir)
+        self.prefix = data_file_prefix
+        self.logger = logger
+        self.path = self.data_dir.joinpath('corp_data', 'cache-index.jsonl')
+        self._corps = defaultdict(dict)
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        self._corps = defaultdict(dict)
+        if not self.path.exists():
+            n = self.rebuild(logger=self.logger)
+            if self.logger:
+                self.logger.info(f'Built the cache index of {n} corps from the zip files')
+            return
+        with open(self.path) as fd:
+            for line in fd:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    # 쓰다가 중단된 마지막 줄
+                    continue
+                self._corps[e['corp_code']][int(e['year'])] = e
+
+    def __len__(self):
+        return len(self._corps)
+
+    def years(self, corp_code) -> list:
+        return sorted(self._corps.get(corp_code, {}))
+
+    def has_year(self, corp_code, year) -> bool:
+        return year in self._corps.get(corp_code, {})
+
+    def has_quarter(self, corp_code, year, quarter) -> bool:
+        e = self._corps.get(corp_code, {}).get(year)
+        return e is not None and quarter in e['quarters']
+
+    def _entry(self, corp_code, year, quarters, size, compressed_size, fetched):
+        return {'corp_code': corp_code, 'year': year, 'quarters': sorted(quarters), 'bytes': size,
+                'compressed_bytes': compressed_size, 'fetched': fetched}
+
+    def update(self, corp_code, year, quarters, size, compressed_size, fetched=None):
+        e = self._entry(corp_code, year, quarters, size, compressed_size, fetched or time.time())
+        with self._lock:
+            self._corps[corp_code][year] = e
+            if not self.path.parent.exists():
+                os.makedirs(self.path.parent)
+            with open(self.path, 'a') as fd:
+                fd.write(json.dumps(e) + '\n')
+
+    def update_from_zip(self, corp_code, zip_filename):
+        """Updates every year found in zip_filename."""
+        for year, e in self._scan_zip(corp_code, zip_filename).items():
+            self.update(corp_code, year, e['quarters'], e['bytes'], e['compressed_bytes'], e['fetched'])
+
+    def _scan_zip(self, corp_code, zip_filename) -> dict:
+        years = dict()
+        with zipfile.ZipFile(zip_filename, mode='r') as zf:
+            for info in zf.infolist():
+                m = re.match(self.prefix + r'-([0-9]{4})-([1-4])Q.json', info.filename)
+                if not m:
+                    continue
+                year = int(m.group(1))
+                e = years.setdefault(year, self._entry(corp_code, year, [], 0, 0, None))
+                e['quarters'] = sorted(e['quarters'] + [int(m.group(2))])
+                e['bytes'] += info.file_size
+                e['compressed_bytes'] += info.compress_size
+                fetched = time.mktime(info.date_time + (0, 0, -1))
+                e['fetched'] = max(e['fetched'] or 0, fetched)
+        return years
+
+    def rebuild(self, logger=None) -> int:
+        """Scans every corp zip and rewrites the manifest. Returns the number of corps."""
+        corps = defaultdict(dict)
+        for zf in self.data_dir.joinpath('corp_data').glob(f'*/{self.prefix}-*.zip'):
+            corp_code = zf.parent.name.split('-', 1)[0]
+            try:
+                corps[corp_code].update(self._scan_zip(corp_code, zf))
+            except zipfile.BadZipFile:
+                if logger:
+                    logger.error(f'Bad zip file : {zf}')
+
+        with self._lock:
+            if not self.path.parent.exists():
+                os.makedirs(self.path.parent)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as fd:
+                for corp_code, years in corps.items():
+                    for year, e in sorted(years.items()):
+                        fd.write(json.dumps(e) + '\n')
+            os.replace(tmp, self.path)
+            self._corps = corps
+        return len(corps)
+
 
 class DartFileManager:
     def __init__(self, **kwargs):
@@ -16,6 +142,9 @@ class DartFileManager:
                 corp_code :
                 corp_name :
                 logger : None
+                cache_index : DartCacheIndex. None
+                compression : key of COMPRESSION_CODECS. 'deflate'
+                compresslevel : None (codec default)
         """
 
         self.config = kwargs
@@ -34,7 +163,11 @@ class DartFileManager:
 
     @property
     def logger(self):
-        return self.config['logger']
+        return self.config.get('logger')
+
+    @property
+    def cache_index(self):
+        return self.config.get('cache_index')
 
     def get_filelist(self):
         p = Path(self._corp_dir)
@@ -50,6 +183,10 @@ class DartFileManager:
         return None
 
     def has_year_data(self, year):
+        if self.cache_index is not None:
+            return self.cache_index.has_year(self.config['corp_code'], year)
+        if not Path(self._zipfile).exists():
+            return False
         zf = zipfile.ZipFile(self._zipfile, mode='r')
         for f in zf.namelist():
             m = re.match(self._prefix + r'-([0-9]{4})-([1-4])Q.json', f)
@@ -60,6 +197,11 @@ class DartFileManager:
         return False
 
     def has_quarter_data(self, quarter):
+        if self.cache_index is not None:
+            corp_code = self.config['corp_code']
+            return any(self.cache_index.has_quarter(corp_code, y, quarter) for y in self.cache_index.years(corp_code))
+        if not Path(self._zipfile).exists():
+            return False
         zf = zipfile.ZipFile(self._zipfile, mode='r')
         for f in zf.namelist():
             m = re.match(self._prefix + r'-([0-9]{4})-([1-4])Q.json', f)
@@ -86,7 +228,8 @@ class DartFileManager:
 
         corp_data = defaultdict(list)
         zf = zipfile.ZipFile(self._zipfile, mode='r')
-        for f in zf.namelist():
+        # 추가 저장된 member 는 뒤에 붙으므로 연도, 분기 순으로 정렬한다
+        for f in sorted(zf.namelist()):
             m = re.match(self._prefix + r'-([0-9]{4})-([1-4]Q).json', f)
             if m:
                 year = int(m.group(1))
@@ -95,18 +238,61 @@ class DartFileManager:
         zf.close()
         return corp_data
 
-    def save(self, corp_data: dict):
+    def load_quarter(self, year, quarter):
+        """Returns: the json string of one quarter (1 ~ 4), None if it is not in the zip"""
+        if not Path(self._zipfile).exists():
+            return None
+        with zipfile.ZipFile(self._zipfile, mode='r') as zf:
+            try:
+                with zf.open(f'{self._prefix}-{year}-{quarter}Q.json') as fd:
+                    return fd.read().decode()
+            except KeyError:
+                return None
+
+    @property
+    def _compression(self):
+        return COMPRESSION_CODECS[self.config.get('compression', DEFAULT_COMPRESSION)]
+
+    @property
+    def _compresslevel(self):
+        return self.config.get('compresslevel')
+
+    def save(self, corp_data: dict, overwrite=False):
+        """Saves corp_data into the corp zip.
+
+            Quarters already in the zip are kept and only new ones are appended,
+            unless overwrite is True, which rewrites the whole zip.
+
+        Args:
+            corp_data: year -> [1Q, 2Q, 3Q, 4Q] as dict or json string
+            overwrite: rewrite every quarter of corp_data
+
+        Returns:
+            int: number of quarters written
+        """
         cd = self._corp_dir
         if not cd.exists():
             os.makedirs(cd)
 
         prefix = self.config['data_file_prefix']
-        zf = zipfile.ZipFile(self._zipfile, mode='w', compression=zipfile.ZIP_BZIP2, compresslevel=9)
-        for year, ydata in corp_data.items():
-            for i, qdata in enumerate(ydata):
-                f = cd.joinpath(f'{prefix}-{year}-{i + 1}Q.json')
-                with open(f, 'w') as fd:
-                    fd.write(str(qdata))
-                zf.write(f, arcname=f.name)
-                f.unlink()
-        zf.close()
+        existing = set()
+        if not overwrite and Path(self._zipfile).exists():
+            with zipfile.ZipFile(self._zipfile, mode='r') as zf:
+                existing = set(zf.namelist())
+
+        n = 0
+        mode = 'w' if overwrite else 'a'
+        with zipfile.ZipFile(self._zipfile, mode=mode, compression=self._compression,
+                             compresslevel=self._compresslevel) as zf:
+            for year, ydata in corp_data.items():
+                for i, qdata in enumerate(ydata):
+                    name = f'{prefix}-{year}-{i + 1}Q.json'
+                    if name in existing:
+                        continue
+                    # load() 한 데이터는 이미 문자열
+                    zf.writestr(name, qdata if type(qdata) == str else json.dumps(qdata, ensure_ascii=False))
+                    n += 1
+
+        if self.cache_index is not None and n > 0:
+            self.cache_index.update_from_zip(self.config['corp_code'], self._zipfile)
+        return n
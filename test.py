@@ -1,14 +1,23 @@
 import logging
+import os
 import unittest
 from pathlib import Path
 
-from import_dart_data import esclient, ELASTICSEARCH_URL, ELASTIC_CERTFILE_FINGERPRINT, ELASTIC_PASSWORD, \
-    get_corp_data_from_dart, upload_year_corp_data, upload_quarter_corp_data, import_one_corp_data
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import streaming_bulk, scan
+import import_dart_data
+from import_dart_data import get_corp_data_from_dart, upload_year_corp_data, upload_quarter_corp_data, \
+    import_one_corp_data
 import sys
 
-from manage_dart_file import DartFileManager
+from fetch_engine import ordered_fetch
+from manage_dart_file import DartFileManager, DartCacheIndex
+
+
+def offline_config(**environ):
+    """Patches import_dart_data.config with environ only, so the test does not need a .env."""
+    from unittest import mock
+    from importer_config import ImporterConfig
+
+    return mock.patch.object(import_dart_data, 'config', ImporterConfig(env_file='/nonexistent/.env', environ=environ))
 
 
 class Test(unittest.TestCase):
@@ -22,7 +31,7 @@ class Test(unittest.TestCase):
         #     ssl_assert_fingerprint=ELASTIC_CERTFILE_FINGERPRINT,
         #     basic_auth=("elastic", ELASTIC_PASSWORD)
         # )
-        self.esclient = esclient
+        self.esclient = import_dart_data.get_esclient()
         self.corp_code = "00126380"
         self.corp_name = '삼성전자'
 
@@ -70,6 +79,8 @@ class Test(unittest.TestCase):
         self.assertEqual(resp['_source']['corp_name'], self.corp_name)
 
     def test_query_all_docs(self):
+        from elasticsearch.helpers import scan
+
         logging.disable(sys.maxsize)  # Python 3
         n = 0
         for doc in scan(self.esclient, query={"query": {"match_all": {}}}, index="corp_code"):
@@ -99,3 +110,1004 @@ class TestDFM(unittest.TestCase):
         zf = Path(self.dfm_save._zipfile)
         self.assertTrue(zf.exists())
         self.assertTrue(zf.lstat().st_size > 1024)
+
+
+class TestFetchEngine(unittest.TestCase):
+    def test_ordered_fetch_keeps_order(self):
+        import random
+        import time
+
+        def fetch(unit):
+            time.sleep(random.random() / 100)
+            return unit * 2
+
+        results = list(ordered_fetch(fetch, range(50), concurrency=8))
+        self.assertEqual([u for u, _ in results], list(range(50)))
+        self.assertEqual([r for _, r in results], [u * 2 for u in range(50)])
+
+    def test_ordered_fetch_sequential(self):
+        results = list(ordered_fetch(str, [3, 1, 2]))
+        self.assertEqual(results, [(3, '3'), (1, '1'), (2, '2')])
+
+    def test_buffered_stage_is_bounded(self):
+        import time
+        from fetch_engine import buffered
+
+        produced = []
+
+        def produce():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        items = buffered(produce(), 4)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.2)
+        # queue 4 개 + put 을 기다리는 1 개 + 꺼낸 1 개
+        self.assertLessEqual(len(produced), 6)
+        self.assertEqual(list(items), list(range(1, 100)))
+
+    def test_buffered_stage_raises_in_consumer(self):
+        from fetch_engine import buffered
+
+        def produce():
+            yield 1
+            raise ValueError('broken')
+
+        items = buffered(produce(), 2)
+        self.assertEqual(next(items), 1)
+        self.assertRaises(ValueError, next, items)
+
+    def test_buffered_sink(self):
+        from fetch_engine import BufferedSink
+
+        handled = []
+        with BufferedSink(handled.append, 2) as sink:
+            for i in range(20):
+                sink.put(i)
+        self.assertEqual(handled, list(range(20)))
+
+        def handle(item):
+            raise ValueError(item)
+
+        sink = BufferedSink(handle, 2)
+        sink.put(1)
+        self.assertRaises(ValueError, sink.close)
+
+
+class TestImporterMetrics(unittest.TestCase):
+    def test_prometheus_text(self):
+        from importer_metrics import MetricsRegistry
+
+        registry = MetricsRegistry()
+        responses = registry.counter('dart_responses_total', 'DART responses', ['status'])
+        responses.inc(status='000')
+        responses.inc(2, status='013')
+        latency = registry.histogram('dart_request_seconds', 'DART latency', buckets=(0.1, 1))
+        for seconds in (0.05, 0.5, 0.5, 5):
+            latency.observe(seconds)
+        self.assertIs(registry.counter('dart_responses_total', 'DART responses', ['status']), responses)
+        with self.assertRaises(ValueError):
+            responses.inc(code='000')
+
+        text = registry.render()
+        self.assertIn('# TYPE dart_responses_total counter', text)
+        self.assertIn('dart_responses_total{status="013"} 2', text)
+        self.assertIn('dart_request_seconds_bucket{le="1"} 3', text)
+        self.assertIn('dart_request_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('dart_request_seconds_count 4', text)
+        self.assertEqual(latency.quantile(0.5), 1)
+        self.assertEqual(latency.quantile(0.95), float('inf'))
+
+    def test_snapshot_and_server(self):
+        import urllib.request
+        from importer_metrics import MetricsRegistry, MetricsReporter, MetricsServer
+
+        registry = MetricsRegistry()
+        registry.gauge('fetch_pending', 'in flight').set(3)
+        registry.histogram('transform_seconds', 'transform').observe(0.002)
+        docs = {d['name']: d for d in registry.snapshot()}
+        self.assertEqual(docs['fetch_pending']['value'], 3)
+        self.assertEqual(docs['transform_seconds']['count'], 1)
+        self.assertEqual(docs['transform_seconds']['p50'], 0.005)
+
+        class Client:
+            operations = []
+
+            def bulk(self, operations):
+                self.operations += operations
+                return {'errors': False}
+
+        client = Client()
+        MetricsReporter(registry, client, interval=3600).start().stop()
+        self.assertEqual(len(client.operations), 4)
+
+        server = MetricsServer(registry, 0, host='127.0.0.1').start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as r:
+                self.assertIn('fetch_pending 3', r.read().decode())
+        finally:
+            server.stop()
+
+
+class TestImportProfiler(unittest.TestCase):
+    def test_sampled_units_and_summary(self):
+        import tempfile
+        from import_profiler import ImportProfiler
+
+        self.assertFalse(ImportProfiler().sampled('00126380'))
+        with tempfile.TemporaryDirectory() as d:
+            profiler = ImportProfiler(Path(d, 'run'), sample_rate=0.5, memory=True, top=5)
+            corps = [f'{i:08d}' for i in range(200)]
+            sampled = [c for c in corps if profiler.sampled(c)]
+            self.assertTrue(60 < len(sampled) < 140)
+            self.assertEqual(sampled, [c for c in corps if profiler.sampled(c)])
+
+            def transform(corp_code):
+                with profiler.profile('transform', corp_code):
+                    return sorted(str(i) for i in range(1000))
+
+            with profiler.stage('corp_data'):
+                for corp_code in corps:
+                    with profiler.profile('fetch', corp_code):
+                        transform(corp_code)
+            self.assertEqual(profiler.units['fetch'], len(sampled))
+            self.assertEqual(profiler.units['transform'], len(sampled))
+            self.assertEqual(list(profiler.iterate('bulk', range(10), batch_size=3)), list(range(10)))
+
+            output_dir = profiler.save()
+            self.assertTrue(output_dir.joinpath('transform.pstats').exists())
+            summary = output_dir.joinpath('summary.txt').read_text()
+            self.assertIn('==== fetch', summary)
+            self.assertIn('allocations, peak', summary)
+
+
+class TestStartup(unittest.TestCase):
+    # -X importtime 으로 잰 import_dart_data 의 누적 import 시간 상한(us).
+    # 느린 CI 에서도 client library 를 다시 import 할 때만 넘도록 넉넉히 둔다.
+    # 실제 예산은 benchmark/bench_startup.py --import-budget-ms 로 잰다
+    IMPORT_BUDGET_US = 2000000
+
+    def run_cold(self, *args):
+        """Runs python in a fresh process without credentials and outside the repo, so no .env is read."""
+        import subprocess
+        import tempfile
+
+        repo = str(Path(__file__).resolve().parent)
+        env = {'PATH': os.environ.get('PATH', ''), 'PYTHONPATH': repo}
+        with tempfile.TemporaryDirectory() as d:
+            return subprocess.run([sys.executable, *args], cwd=d, env=env, capture_output=True, text=True,
+                                  timeout=60)
+
+    def test_import_loads_no_client_library(self):
+        heavy = ['elasticsearch', 'bs4', 'pendulum', 'tqdm', 'requests', 'coloredlogs', 'dotenv']
+        p = self.run_cold('-c', f'import sys, import_dart_data; print([m for m in {heavy!r} if m in sys.modules])')
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertEqual(p.stdout.strip(), '[]')
+
+    def test_help_without_credentials(self):
+        repo = Path(__file__).resolve().parent
+        for args in (['--help'], ['import', '--help']):
+            p = self.run_cold(str(repo / 'import_dart_data.py'), *args)
+            self.assertEqual(p.returncode, 0, p.stderr)
+            self.assertIn('usage:', p.stdout)
+
+    @unittest.skipIf(os.environ.get('SKIP_TIMING_TESTS'), 'SKIP_TIMING_TESTS is set')
+    def test_import_time_budget(self):
+        p = self.run_cold('-X', 'importtime', '-c', 'import import_dart_data')
+        self.assertEqual(p.returncode, 0, p.stderr)
+        line = next(line for line in p.stderr.splitlines() if line.endswith('| import_dart_data'))
+        cumulative = int(line.split('|')[1])
+        self.assertLess(cumulative, self.IMPORT_BUDGET_US)
+
+    def test_parse_subcommands_and_legacy_flags(self):
+        from import_dart_data import parse_args
+
+        args = parse_args(['import', 'corp_data', '--fetch-concurrency', '4'])
+        self.assertEqual((args.command, args.import_data, args.fetch_concurrency), ('import', ['corp_data'], 4))
+        self.assertEqual((args.create_index, args.rebuild_years, args.rebuild_cache_index), ([], [], False))
+        args = parse_args(['rebuild-years', '2021', '2022', '--bulk-load'])
+        self.assertEqual((args.rebuild_years, args.bulk_load, args.import_data), ([2021, 2022], True, []))
+        self.assertTrue(parse_args(['rebuild-cache-index']).rebuild_cache_index)
+        # 예전 방식
+        args = parse_args(['--import-data', 'corp_code', 'corp_data', '--workers', '2'])
+        self.assertEqual((args.command, args.import_data, args.workers), (None, ['corp_code', 'corp_data'], 2))
+
+    def test_config_is_read_on_first_use(self):
+        from importer_config import ConfigError, ImporterConfig
+
+        config = ImporterConfig(env_file='/nonexistent/.env', environ={'DART_API_KEY': 'a, b'})
+        self.assertEqual(config.DART_API_KEYS, ['a', 'b'])
+        self.assertEqual(config.DART_REQUESTS_PER_SECOND, 10)
+        with self.assertRaises(ConfigError):
+            config.ELASTICSEARCH_URL
+        config.ELASTICSEARCH_URL = 'https://localhost:9200'
+        self.assertEqual(config.ELASTICSEARCH_URL, 'https://localhost:9200')
+
+
+class TestDartQuota(unittest.TestCase):
+    def test_token_bucket_paces_requests(self):
+        import time
+        from dart_quota import TokenBucket
+
+        bucket = TokenBucket(rate=100, capacity=1)
+        t = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - t, 0.09)
+
+    def test_scheduler_spreads_keys_and_stops_at_limit(self):
+        from dart_quota import DartKeyScheduler, QuotaExhausted
+
+        scheduler = DartKeyScheduler(['key1', 'key2'], daily_limit=3, requests_per_second=1000,
+                                     wait_for_reset=False)
+        keys = [scheduler.acquire() for _ in range(6)]
+        self.assertEqual(keys.count('key1'), 3)
+        self.assertEqual(keys.count('key2'), 3)
+        self.assertRaises(QuotaExhausted, scheduler.acquire)
+
+    def test_ledger_is_persisted(self):
+        import tempfile
+        from dart_quota import QuotaLedger
+
+        with tempfile.TemporaryDirectory() as d:
+            ledger = QuotaLedger(f'{d}/dart-quota.json')
+            ledger.add('key1', '20230417', 5)
+            ledger.mark_exhausted('key2', '20230417')
+            ledger = QuotaLedger(f'{d}/dart-quota.json')
+            self.assertEqual(ledger.used('key1', '20230417'), 5)
+            self.assertTrue(ledger.is_exhausted('key2', '20230417'))
+            self.assertNotIn('key1', Path(f'{d}/dart-quota.json').read_text())
+
+    def test_ledger_writes_used_counts_every_flush_interval(self):
+        import tempfile
+        from dart_quota import QuotaLedger
+
+        with tempfile.TemporaryDirectory() as d:
+            ledger = QuotaLedger(f'{d}/dart-quota.json', flush_interval=3600)
+            ledger.add('key1', '20230417')
+            ledger.add('key1', '20230417', 2)
+            self.assertEqual(QuotaLedger(f'{d}/dart-quota.json').used('key1', '20230417'), 1)
+            ledger.flush()
+            self.assertEqual(QuotaLedger(f'{d}/dart-quota.json').used('key1', '20230417'), 3)
+
+    def test_ledger_is_shared_between_processes(self):
+        import tempfile
+        from dart_quota import DartKeyScheduler, QuotaLedger, today_kst
+
+        with tempfile.TemporaryDirectory() as d:
+            # 같은 파일을 쓰는 두 worker
+            a = QuotaLedger(f'{d}/dart-quota.json', flush_interval=3600)
+            b = QuotaLedger(f'{d}/dart-quota.json', flush_interval=3600)
+            a.add('key1', '20230417', 2)
+            b.add('key1', '20230417', 3)
+            a.add('key1', '20230417')
+            a.flush()
+            self.assertEqual(a.used('key1', '20230417'), 6)
+            b.mark_exhausted('key2', '20230417')
+            ledger = QuotaLedger(f'{d}/dart-quota.json')
+            self.assertEqual(ledger.used('key1', '20230417'), 6)
+            self.assertTrue(ledger.is_exhausted('key2', '20230417'))
+
+            # 이전 실행이 쓴 요청도 한도에 포함된다
+            QuotaLedger(f'{d}/dart-quota.json').add('key1', today_kst(), 9)
+            scheduler = DartKeyScheduler(['key1'], daily_limit=10, ledger=QuotaLedger(f'{d}/dart-quota.json'))
+            self.assertEqual(scheduler.remaining(), 1)
+
+    def test_worker_quota_keeps_on_quota_exhausted(self):
+        import tempfile
+
+        scheduler = import_dart_data.dart_key_scheduler
+        with tempfile.TemporaryDirectory() as d, offline_config(DART_API_KEY='key1', DART_RESULT_DIR=d):
+            try:
+                import_dart_data.configure_worker_quota(2, wait_for_reset=False)
+                self.assertFalse(import_dart_data.dart_key_scheduler.wait_for_reset)
+            finally:
+                import_dart_data.dart_key_scheduler = scheduler
+
+
+class TestDartHttpClient(unittest.TestCase):
+    def setUp(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.requests = []
+
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                test.requests.append(self.path)
+                if self.path.startswith('/flaky') and len(test.requests) == 1:
+                    status, body, ctype = 503, b'busy', 'text/plain'
+                elif self.path.startswith('/html'):
+                    status, body, ctype = 200, b'<html>error</html>', 'text/html'
+                else:
+                    status, body, ctype = 200, b'{"status": "000"}', 'application/json;charset=UTF-8'
+                self.send_response(status)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_on_5xx(self):
+        from dart_http import DartHttpClient
+
+        client = DartHttpClient(backoff_factor=0)
+        r = client.get(self.url + '/flaky', params={'crtfc_key': 'secret'})
+        self.assertEqual(client.decode_json(r), {'status': '000'})
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(client.latency.summary()['count'], 1)
+
+    def test_non_json_body(self):
+        from dart_http import DartHttpClient, DartResponseError
+
+        client = DartHttpClient()
+        r = client.get(self.url + '/html', params={'crtfc_key': 'secret'})
+        self.assertFalse(client.is_json(r))
+        with self.assertRaises(DartResponseError) as cm:
+            client.decode_json(r)
+        self.assertNotIn('secret', str(cm.exception))
+
+    def test_connection_error_hides_the_key(self):
+        from dart_http import DartHttpClient, DartResponseError
+
+        self.server.shutdown()
+        self.server.server_close()
+        client = DartHttpClient(retries=0)
+        with self.assertRaises(DartResponseError) as cm:
+            client.get(self.url + '/api/list.json', params={'crtfc_key': 'secret', 'page_no': '1'})
+        self.assertIn('ConnectionError', str(cm.exception))
+        self.assertNotIn('secret', repr(cm.exception))
+
+
+class TestDartResponseCache(unittest.TestCase):
+    def test_key_ignores_crtfc_key_and_param_order(self):
+        from dart_cache import cache_key
+
+        url = 'https://opendart.fss.or.kr/api/fnlttSinglAcntAll.json'
+        a = cache_key(url, {'crtfc_key': 'a', 'corp_code': '00126380', 'bsns_year': 2022, 'reprt_code': '11013'})
+        b = cache_key(url, {'reprt_code': '11013', 'bsns_year': '2022', 'corp_code': '00126380', 'crtfc_key': 'b'})
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, cache_key(url, {'corp_code': '00126380', 'bsns_year': 2022, 'reprt_code': '11012'}))
+
+    def test_ttl_per_status(self):
+        import tempfile
+        import time
+        from datetime import datetime
+        from dart_cache import DartResponseCache, is_closed_year
+
+        self.assertTrue(is_closed_year(2021, datetime(2022, 7, 1)))
+        self.assertFalse(is_closed_year(2021, datetime(2022, 3, 31)))
+
+        url = 'https://opendart.fss.or.kr/api/fnlttSinglAcntAll.json'
+        open_year = str(datetime.now().year)
+        with tempfile.TemporaryDirectory() as d:
+            cache = DartResponseCache(f'{d}/cache.sqlite', ttl=60, no_data_ttl=0.05)
+            cache.put(url, {'bsns_year': '2017', 'corp_code': '1'}, {'status': '000', 'list': [{'a': '가'}]})
+            cache.put(url, {'bsns_year': open_year, 'corp_code': '1'}, {'status': '000', 'list': []})
+            cache.put(url, {'bsns_year': '2017', 'corp_code': '2'}, {'status': '013', 'message': 'no data'})
+            cache.put(url, {'bsns_year': '2017', 'corp_code': '3'}, {'status': '020', 'message': 'quota'})
+
+            self.assertEqual(cache.get(url, {'bsns_year': '2017', 'corp_code': '1'})['list'], [{'a': '가'}])
+            self.assertIsNotNone(cache.get(url, {'bsns_year': open_year, 'corp_code': '1'}))
+            self.assertEqual(cache.get(url, {'bsns_year': '2017', 'corp_code': '2'})['status'], '013')
+            self.assertIsNone(cache.get(url, {'bsns_year': '2017', 'corp_code': '3'}))
+            time.sleep(0.1)
+            self.assertIsNone(cache.get(url, {'bsns_year': '2017', 'corp_code': '2'}))
+            self.assertEqual(cache.summary()['hits'], 3)
+            self.assertEqual(cache.summary()['expired'], 1)
+            self.assertEqual(cache.purge_expired(), 1)
+            cache.close()
+
+
+class TestParseCorpCode(unittest.TestCase):
+    def test_parse_corp_code_from_zip(self):
+        import tempfile
+        import zipfile
+        from import_dart_data import parse_corp_code, generate_corp_code_doc
+
+        xml = '<?xml version="1.0" encoding="UTF-8"?>\n<result>' \
+              '<list><corp_code>00126380</corp_code><corp_name>삼성전자</corp_name>' \
+              '<stock_code>005930</stock_code><modify_date>20230110</modify_date></list>' \
+              '<list><corp_code>00434003</corp_code><corp_name>다코</corp_name>' \
+              '<stock_code> </stock_code><modify_date>20170630</modify_date></list>' \
+              '</result>'
+        with tempfile.TemporaryDirectory() as d:
+            zip_filename = f'{d}/corp-code.zip'
+            with zipfile.ZipFile(zip_filename, 'w') as zf:
+                zf.writestr('CORPCODE.xml', xml)
+            docs = list(generate_corp_code_doc(parse_corp_code(zip_filename)))
+
+        self.assertEqual(len(docs), 2)
+        self.assertEqual(docs[0], {'_id': '00126380', 'corp_code': '00126380', 'corp_name': '삼성전자',
+                                   'stock_code': '005930', 'modify_date': '20230110'})
+        self.assertEqual(docs[1]['stock_code'], ' ')
+
+
+class TestCorpCodeSnapshot(unittest.TestCase):
+    def test_diff_finds_new_and_modified_corps(self):
+        import tempfile
+        from corp_code_snapshot import CorpCodeSnapshot
+
+        with tempfile.TemporaryDirectory() as d:
+            snapshot = CorpCodeSnapshot(f'{d}/corp-code-snapshot.json')
+            self.assertFalse(snapshot.exists())
+            snapshot.update([{'corp_code': '00126380', 'modify_date': '20220101'},
+                             {'corp_code': '00100000', 'modify_date': '20200101'},
+                             {'corp_code': '00200000', 'modify_date': '20200101'}])
+            snapshot.save()
+
+            records = [{'corp_code': '00126380', 'corp_name': '삼성전자', 'modify_date': '20220517'},
+                       {'corp_code': '00100000', 'corp_name': 'corp', 'modify_date': '20200101'},
+                       {'corp_code': '00300000', 'corp_name': 'new corp', 'modify_date': '20220601'}]
+            changes = dict()
+            changed = list(CorpCodeSnapshot(snapshot.path).diff(records, changes))
+
+        self.assertEqual([r['corp_code'] for r in changed], ['00126380', '00300000'])
+        self.assertEqual(changes, {'new': 1, 'modified': 1, 'unchanged': 1, 'missing': 1})
+
+
+class TestCorpDataDocId(unittest.TestCase):
+    def test_doc_id_is_deterministic(self):
+        from import_dart_data import corp_data_doc_id
+
+        doc = {'rcept_no': '20220516001751', 'reprt_code': '11013', 'bsns_year': '2022', 'sj_div': 'BS',
+               'account_id': 'ifrs-full_CurrentLiabilities', 'account_nm': '유동부채', 'account_detail': '-',
+               'ord': '20', 'thstrm_amount': '56799776000000'}
+        self.assertEqual(corp_data_doc_id(doc), corp_data_doc_id(dict(doc, thstrm_amount='0')))
+        self.assertNotEqual(corp_data_doc_id(doc), corp_data_doc_id(dict(doc, ord='21')))
+        self.assertNotEqual(corp_data_doc_id(doc), corp_data_doc_id(dict(doc, account_detail='자본 [member]')))
+
+
+class TestBulkIndexCorpData(unittest.TestCase):
+    def test_results_are_credited_by_id(self):
+        from unittest import mock
+        from import_dart_data import bulk_index_corp_data
+
+        def quarter(reprt_code, n):
+            return {'status': '000', 'list': [
+                {'corp_code': '00126380', 'rcept_no': reprt_code, 'bsns_year': '2022', 'reprt_code': reprt_code,
+                 'sj_div': 'BS', 'ord': str(i)}
+                for i in range(n)]}
+
+        def streaming_bulk(client, actions, **kwargs):
+            actions = list(actions)
+            for a in actions[1:]:
+                yield True, {'index': {'_index': a['_index'], '_id': a['_id'], 'status': 201}}
+            # 429 로 재시도된 첫 문서의 결과는 chunk 의 끝에 온다
+            self.assertEqual(done, [])
+            yield False, {'index': {'_index': actions[0]['_index'], '_id': actions[0]['_id'], 'status': 429}}
+
+        done = []
+        with mock.patch('elasticsearch.helpers.streaming_bulk', streaming_bulk):
+            total = bulk_index_corp_data(None, [('1Q', quarter('11013', 2)), ('2Q', quarter('11012', 3))],
+                                         on_quarter_done=lambda key, qdata, n: done.append((key, n)),
+                                         index_for_year=lambda year: 'corp_data-2022')
+        self.assertEqual(done, [('1Q', 1), ('2Q', 3)])
+        self.assertEqual((total['successes'], total['failures']), (4, 1))
+
+
+class TestImportAllCorpData(unittest.TestCase):
+    def test_import_with_progress_bar(self):
+        import tempfile
+        from unittest import mock
+        import import_dart_data
+
+        def quarter(reprt_code):
+            return {'status': '000', 'list': [
+                {'corp_code': '00126380', 'rcept_no': reprt_code, 'bsns_year': '2022', 'reprt_code': reprt_code,
+                 'sj_div': 'IS', 'account_id': 'ifrs-full_Revenue', 'ord': '1', 'thstrm_amount': '10',
+                 'thstrm_add_amount': '10'}]}
+
+        units = [('00126380', '삼성전자', 2022, rt) for rt in import_dart_data.QUARTER_CODES]
+
+        def fetch_year_corp_data(units, *args, **kwargs):
+            units = list(units)
+            yield '00126380', '삼성전자', 2022, [(u, quarter(u[3])) for u in units]
+
+        def streaming_bulk(client, actions, **kwargs):
+            for a in actions:
+                yield True, {'index': {'_index': a['_index'], '_id': a['_id'], 'status': 201}}
+
+        with tempfile.TemporaryDirectory() as d, offline_config(DART_RESULT_DIR=d), \
+                mock.patch.object(import_dart_data, 'load_import_manifest', lambda client: set()), \
+                mock.patch.object(import_dart_data, 'iter_corps', lambda client, source: []), \
+                mock.patch.object(import_dart_data, 'generate_prioritized_units', lambda *args, **kwargs: units), \
+                mock.patch.object(import_dart_data, 'fetch_year_corp_data', fetch_year_corp_data), \
+                mock.patch('elasticsearch.helpers.streaming_bulk', streaming_bulk):
+            stats = import_dart_data.import_all_corp_data(mock.MagicMock(), show_progress=True, years=[2022])
+        self.assertEqual((stats['quarters'], stats['documents'], stats['failures']), (4, 4, 0))
+        self.assertGreater(stats['derived'], 0)
+
+
+class TestImportManifest(unittest.TestCase):
+    def test_generate_units_skips_imported_quarters(self):
+        import tempfile
+        import import_dart_data
+        from import_dart_data import generate_corp_data_units, Corp
+
+        manifest = {('00126380', 2021, q) for q in import_dart_data.QUARTER_CODES} | {('00126380', 2022, '11013')}
+        # cache index 는 임시 디렉터리의 것이므로 test 가 끝나면 버린다
+        self.addCleanup(import_dart_data.get_dart_cache_index.reset)
+        with tempfile.TemporaryDirectory() as d, offline_config(DART_RESULT_DIR=d):
+            import_dart_data.get_dart_cache_index.reset()
+            corps = [Corp('00126380', '삼성전자', '005930')]
+            units = list(generate_corp_data_units(manifest, corps, [2021, 2022]))
+        self.assertEqual([u[3] for u in units], ['11012', '11014', '11011'])
+        self.assertTrue(all(u[2] == 2022 for u in units))
+
+
+class TestFilingSync(unittest.TestCase):
+    def test_parse_report_name(self):
+        from import_dart_data import parse_report_name
+
+        self.assertEqual(parse_report_name('분기보고서 (2022.03)'), [(2022, '11013')])
+        self.assertEqual(parse_report_name('[기재정정]분기보고서 (2021.09)'), [(2021, '11014')])
+        self.assertEqual(parse_report_name('반기보고서 (2022.06)'), [(2022, '11012')])
+        self.assertEqual(parse_report_name('[첨부정정]사업보고서 (2021.12)'), [(2021, '11011')])
+        # 12월 결산이 아니면 1분기, 3분기를 구분할 수 없다
+        self.assertEqual(parse_report_name('분기보고서 (2022.05)'), [(2022, '11013'), (2022, '11014')])
+        self.assertEqual(parse_report_name('주요사항보고서(자기주식취득결정)'), [])
+        self.assertEqual(parse_report_name('사업보고서 (2014.12)'), [])
+
+    def test_generate_filing_units(self):
+        from import_dart_data import generate_filing_units
+
+        filings = [
+            {'corp_code': '00126380', 'corp_name': '삼성전자', 'report_nm': '사업보고서 (2021.12)'},
+            {'corp_code': '00126380', 'corp_name': '삼성전자', 'report_nm': '분기보고서 (2022.03)'},
+            {'corp_code': '00126380', 'corp_name': '삼성전자', 'report_nm': '[기재정정]사업보고서 (2021.12)'},
+            {'corp_code': '00100000', 'corp_name': 'corp', 'report_nm': '반기보고서 (2022.06)'},
+            {'corp_code': '00100000', 'corp_name': 'corp', 'report_nm': '감사보고서제출'},
+        ]
+        self.assertEqual(generate_filing_units(filings), [
+            ('00100000', 'corp', 2022, '11012'),
+            ('00126380', '삼성전자', 2021, '11011'),
+            ('00126380', '삼성전자', 2022, '11013'),
+        ])
+
+    def test_date_windows(self):
+        from import_dart_data import iter_date_windows
+
+        windows = list(iter_date_windows('20220101', '20221231'))
+        self.assertEqual(windows[0], ('20220101', '20220331'))
+        self.assertEqual(windows[-1][1], '20221231')
+        self.assertEqual(len(windows), 5)
+        self.assertEqual(list(iter_date_windows('20220105', '20220105')), [('20220105', '20220105')])
+
+
+class TestPriority(unittest.TestCase):
+    def test_watchlist_then_listed_then_recent_years(self):
+        import tempfile
+        import import_dart_data
+        from import_dart_data import generate_prioritized_units, prioritize_corps, Corp
+
+        corps = [Corp('00000001', 'unlisted', ' '), Corp('00000002', 'listed', '000020'),
+                 Corp('00126380', '삼성전자', '005930'), Corp('00000003', 'watched', ' ')]
+        tiers = prioritize_corps(corps, watchlist=['00000003', '005930'])
+        self.assertEqual([[c.corp_code for c in t] for t in tiers],
+                         [['00000003', '00126380'], ['00000002'], ['00000001']])
+        tiers = prioritize_corps(corps, only_listed=True)
+        self.assertEqual([len(t) for t in tiers], [0, 2, 0])
+
+        self.addCleanup(import_dart_data.get_dart_cache_index.reset)
+        with tempfile.TemporaryDirectory() as d, offline_config(DART_RESULT_DIR=d):
+            import_dart_data.get_dart_cache_index.reset()
+            units = list(generate_prioritized_units(set(), corps[:2], [2021, 2022]))
+        self.assertEqual([(u[0], u[2]) for u in units[::4]],
+                         [('00000002', 2022), ('00000002', 2021), ('00000001', 2022), ('00000001', 2021)])
+
+    def test_watchlist_stock_codes_are_resolved(self):
+        from import_dart_data import watchlist_corp_codes, Corp
+
+        corps = [Corp('00000001', 'unlisted', ' '), Corp('00126380', '삼성전자', '005930')]
+        self.assertEqual(watchlist_corp_codes(['00000003', '005930'], corps), {'00000003', '00126380'})
+        # corp_code 만 있으면 corp 목록을 읽지 않는다
+        self.assertEqual(watchlist_corp_codes(['00000003'], None), {'00000003'})
+        self.assertEqual(watchlist_corp_codes(None, None), set())
+
+
+class FakeIndicesClient:
+    """Records the index calls es_index makes. Indices are {name: {'aliases': set, 'settings': dict}}."""
+
+    def __init__(self, indices):
+        self.indices_state = indices
+        self.calls = []
+
+    def exists_alias(self, name):
+        return any(name in i['aliases'] for i in self.indices_state.values())
+
+    def get_alias(self, name):
+        return {k: {} for k, i in self.indices_state.items() if name in i['aliases']}
+
+    def exists(self, index):
+        return index in self.indices_state or self.exists_alias(index)
+
+    def create(self, index, settings=None, mappings=None, aliases=None):
+        self.indices_state[index] = {'aliases': set(aliases or []), 'settings': dict(settings or {})}
+
+    def delete(self, index):
+        self.calls.append(('delete', index))
+        self.indices_state.pop(index, None)
+
+    def get_settings(self, index, flat_settings=True):
+        return {k: {'settings': dict(self.indices_state[k]['settings'])} for k in index.split(',')}
+
+    def put_settings(self, index, settings):
+        self.calls.append(('put_settings', index, settings))
+        for k in index.split(','):
+            self.indices_state[k]['settings'].update(settings)
+
+    def refresh(self, index, ignore_unavailable=False):
+        pass
+
+    def put_index_template(self, **kwargs):
+        self.calls.append(('put_index_template', kwargs['name']))
+
+    def update_aliases(self, actions):
+        self.calls.append(('update_aliases', actions))
+
+
+class FakeEsClient:
+    def __init__(self, indices):
+        self.indices = FakeIndicesClient(indices)
+
+    def options(self, **kwargs):
+        return self
+
+    def reindex(self, **kwargs):
+        return {'task': 'node:1'}
+
+    @property
+    def tasks(self):
+        return self
+
+    def get(self, task_id):
+        return {'completed': True, 'response': {'failures': []}}
+
+
+class TestEsIndex(unittest.TestCase):
+    def test_bulk_load_restores_settings(self):
+        from es_index import bulk_load
+
+        client = FakeEsClient({'corp_data-1': {'aliases': {'corp_data'}, 'settings': {'index.refresh_interval': '5s'}}})
+        with bulk_load(client, ['corp_data', 'corp_metrics']):
+            self.assertEqual(client.indices.indices_state['corp_data-1']['settings']['index.refresh_interval'], '-1')
+        self.assertEqual(client.indices.indices_state['corp_data-1']['settings'],
+                         {'index.refresh_interval': '5s', 'index.number_of_replicas': None})
+
+    def test_bulk_load_restores_year_indices_created_meanwhile(self):
+        from es_index import BULK_LOAD_SETTINGS, YearIndexRouter, bulk_load
+
+        client = FakeEsClient({})
+        with bulk_load(client, ['corp_data']):
+            alias = YearIndexRouter(client, settings=BULK_LOAD_SETTINGS)(2022)
+            index = client.indices.get_alias(name=alias).popitem()[0]
+            self.assertEqual(client.indices.indices_state[index]['settings'], BULK_LOAD_SETTINGS)
+        self.assertEqual(client.indices.indices_state[index]['settings'],
+                         {'index.refresh_interval': None, 'index.number_of_replicas': None})
+
+    def test_create_corp_data_also_creates_corp_metrics(self):
+        from import_dart_data import create_index
+
+        client = FakeEsClient({})
+        create_index(client, ['corp_data'])
+        self.assertTrue(client.indices.exists_alias('corp_metrics'))
+        self.assertTrue(client.indices.exists_alias('corp_import_history'))
+        self.assertFalse(client.indices.exists_alias('corp_code'))
+        self.assertIn(('put_index_template', 'corp_data'), client.indices.calls)
+
+    def test_migrate_plain_index_swaps_alias(self):
+        from es_index import migrate_index
+
+        client = FakeEsClient({'corp_code': {'aliases': set(), 'settings': {}}})
+        index = migrate_index(client, 'corp_code')
+        self.assertTrue(index.startswith('corp_code-'))
+        self.assertEqual(client.indices.calls[-1], ('update_aliases', [
+            {'remove_index': {'index': 'corp_code'}},
+            {'add': {'index': index, 'alias': 'corp_code', 'is_write_index': True}}]))
+
+    def test_year_router_creates_year_indices_once(self):
+        from es_index import YearIndexRouter
+
+        client = FakeEsClient({'corp_data-2021-20230101000000': {'aliases': {'corp_data', 'corp_data-2021'},
+                                                                 'settings': {}}})
+        router = YearIndexRouter(client, indices={2020: 'corp_data-2020-20230102000000'})
+        self.assertEqual(router('2021'), 'corp_data-2021')
+        self.assertEqual(router('2022'), 'corp_data-2022')
+        self.assertEqual(router(2022), 'corp_data-2022')
+        self.assertEqual(router('2020'), 'corp_data-2020-20230102000000')
+        created = [i for i in client.indices.indices_state if i.startswith('corp_data-2022-')]
+        self.assertEqual(len(created), 1)
+        self.assertEqual(client.indices.indices_state[created[0]]['aliases'], {'corp_data', 'corp_data-2022'})
+        self.assertEqual([c for c in client.indices.calls if c[0] == 'put_index_template'],
+                         [('put_index_template', 'corp_data')])
+
+    def test_swap_year_index(self):
+        from es_index import swap_year_index
+
+        client = FakeEsClient({'corp_data-2021-1': {'aliases': {'corp_data', 'corp_data-2021'}, 'settings': {}},
+                               'corp_data-2021-2': {'aliases': set(), 'settings': {}}})
+        swap_year_index(client, 2021, 'corp_data-2021-2')
+        self.assertEqual(client.indices.calls[-1], ('update_aliases', [
+            {'remove': {'index': 'corp_data-2021-1', 'aliases': ['corp_data', 'corp_data-2021']}},
+            {'add': {'index': 'corp_data-2021-2', 'alias': 'corp_data-2021', 'is_write_index': True}},
+            {'add': {'index': 'corp_data-2021-2', 'alias': 'corp_data'}}]))
+
+    def test_rebuild_is_swapped_only_when_complete(self):
+        import tempfile
+        from import_dart_data import prepare_rebuild_indices, swap_rebuild_indices
+
+        client = FakeEsClient({'corp_data-2021-1': {'aliases': {'corp_data', 'corp_data-2021'}, 'settings': {}}})
+        stats = {'failures': 0, 'retry_queue': 0}
+        with tempfile.TemporaryDirectory() as d, offline_config(DART_RESULT_DIR=d):
+            self.assertIsNone(prepare_rebuild_indices(client, [2021], resume=True))
+            indices = prepare_rebuild_indices(client, [2021])
+            swap_rebuild_indices(client, indices, stats | {'retry_queue': 1})
+            swap_rebuild_indices(client, indices, stats | {'failed_workers': 1})
+            self.assertFalse(any(c[0] == 'update_aliases' for c in client.indices.calls))
+            # 중단된 rebuild 는 같은 index 에 이어서 쓴다
+            self.assertEqual(prepare_rebuild_indices(client, [2021], resume=True), indices)
+            swap_rebuild_indices(client, indices, stats)
+            self.assertEqual(client.indices.calls[-1][0], 'update_aliases')
+            self.assertNotIn({'remove_index': {'index': 'corp_data-2021-1'}}, client.indices.calls[-1][1])
+            self.assertIsNone(prepare_rebuild_indices(client, [2021], resume=True))
+
+
+class TestPartition(unittest.TestCase):
+    def test_partitions_are_disjoint_and_complete(self):
+        from import_dart_data import partition_corps, Corp
+
+        corps = [Corp(f'{i:08d}', f'corp-{i}', ' ') for i in range(1000)]
+        parts = [list(partition_corps(corps, k, 4)) for k in range(4)]
+        self.assertEqual(sorted(c.corp_code for p in parts for c in p), [c.corp_code for c in corps])
+        self.assertTrue(all(len(p) > 150 for p in parts))
+        self.assertEqual(parts[1], list(partition_corps(corps, 1, 4)))
+
+    def test_local_workers_split_the_host_partition(self):
+        from import_dart_data import partition_corps, Corp
+
+        corps = [Corp(f'{i:08d}', f'corp-{i}', ' ') for i in range(1000)]
+        host = list(partition_corps(corps, 1, 2))
+        # --worker-id 1 --num-workers 2 --workers 3 : worker k 는 1 + 2 * k of 6
+        local = [c for k in range(3) for c in partition_corps(corps, 1 + 2 * k, 6)]
+        self.assertEqual(sorted(local), sorted(host))
+
+
+class TestImportCheckpoint(unittest.TestCase):
+    def test_completed_and_retry_queue(self):
+        import tempfile
+        from import_checkpoint import ImportCheckpoint
+
+        with tempfile.TemporaryDirectory() as d:
+            checkpoint = ImportCheckpoint(f'{d}/import-checkpoint.sqlite')
+            checkpoint.mark_completed(('00126380', '삼성전자', 2022, '11013'), 180)
+            checkpoint.mark_failed(('00126380', '삼성전자', 2022, '11012'), 'timeout')
+            checkpoint.mark_failed(('00164779', 'SK하이닉스', 2022, '11011'), 'timeout')
+            checkpoint.close()
+
+            checkpoint = ImportCheckpoint(f'{d}/import-checkpoint.sqlite')
+            self.assertEqual(checkpoint.completed_units(), {('00126380', 2022, '11013')})
+            self.assertEqual(checkpoint.retry_units(), [('00126380', '삼성전자', 2022, '11012'),
+                                                        ('00164779', 'SK하이닉스', 2022, '11011')])
+            checkpoint.mark_failed(('00164779', 'SK하이닉스', 2022, '11011'), 'timeout')
+            self.assertEqual(len(checkpoint.retry_units(max_attempts=2)), 1)
+            checkpoint.mark_completed(('00126380', '삼성전자', 2022, '11012'), 170)
+            self.assertEqual(checkpoint.retry_units(), [('00164779', 'SK하이닉스', 2022, '11011')])
+            checkpoint.reset()
+            self.assertEqual(checkpoint.completed_units(), set())
+            checkpoint.close()
+
+
+class TestDartCacheIndex(unittest.TestCase):
+    def test_save_updates_index(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as d:
+            index = DartCacheIndex(d)
+            dfm = DartFileManager(data_dir=d, corp_code="00126380", corp_name='삼성전자',
+                                  data_file_prefix='financial-statements', cache_index=index)
+            self.assertFalse(dfm.has_year_data(2022))
+            dfm.save({2022: [{'status': '000', 'list': []}] * 4})
+            self.assertTrue(dfm.has_year_data(2022))
+            self.assertTrue(index.has_quarter("00126380", 2022, 4))
+            self.assertFalse(index.has_year("00126380", 2021))
+
+            # 파일에서 다시 읽기
+            self.assertTrue(DartCacheIndex(d).has_year("00126380", 2022))
+
+            Path(index.path).unlink()
+            index = DartCacheIndex(d)
+            self.assertEqual(len(index), 1)
+            self.assertEqual(index.rebuild(), 1)
+            self.assertEqual(index.years("00126380"), [2022])
+            self.assertEqual(DartCacheIndex(d).years("00126380"), [2022])
+
+    def test_zips_cached_before_the_index_are_indexed_on_first_use(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as d:
+            options = dict(data_dir=d, corp_code="00126380", corp_name='삼성전자',
+                           data_file_prefix='financial-statements')
+            DartFileManager(**options).save({2021: [{'status': '000', 'list': []}] * 4})
+
+            # cache-index.jsonl 이 없으면 zip 들로 한 번 만든다
+            index = DartCacheIndex(d)
+            self.assertEqual(len(index), 1)
+            self.assertTrue(index.path.exists())
+            dfm = DartFileManager(**options, cache_index=index)
+            self.assertTrue(dfm.has_year_data(2021))
+            self.assertFalse(dfm.has_year_data(2022))
+            self.assertTrue(DartCacheIndex(d).has_year("00126380", 2021))
+
+
+class TestDartFileManagerAppend(unittest.TestCase):
+    def test_save_appends_new_quarters_only(self):
+        import json
+        import tempfile
+        import zipfile
+
+        with tempfile.TemporaryDirectory() as d:
+            dfm = DartFileManager(data_dir=d, corp_code="00126380", corp_name='삼성전자',
+                                  data_file_prefix='financial-statements', compression='stored')
+            q = {'status': '000', 'list': [{'account_nm': '유동부채'}]}
+            self.assertEqual(dfm.save({2022: [q] * 4}), 4)
+            self.assertEqual(dfm.save({2021: [q] * 4, 2022: [dict(q, status='013')] * 4}), 4)
+            with zipfile.ZipFile(dfm._zipfile) as zf:
+                self.assertEqual(len(zf.namelist()), 8)
+                self.assertTrue(all(i.compress_type == zipfile.ZIP_STORED for i in zf.infolist()))
+
+            corp_data = dfm.load()
+            self.assertEqual(list(corp_data.keys()), [2021, 2022])
+            self.assertEqual(json.loads(corp_data[2022][0])['status'], '000')
+            self.assertEqual(dfm.save(corp_data), 0)
+            self.assertEqual(json.loads(dfm.load_quarter(2021, 4)), q)
+            self.assertIsNone(dfm.load_quarter(2020, 1))
+
+
+class TestColumnarStore(unittest.TestCase):
+    def test_append_and_read_account(self):
+        import tempfile
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        from columnar_store import ColumnarStore
+
+        def quarter(corp_code, reprt_code, amount):
+            return {'status': '000', 'list': [
+                {'rcept_no': '20220516001751', 'reprt_code': reprt_code, 'bsns_year': '2022', 'corp_code': corp_code,
+                 'sj_div': 'BS', 'sj_nm': '재무상태표', 'account_id': 'ifrs-full_CurrentLiabilities',
+                 'account_nm': '유동부채', 'account_detail': '-', 'thstrm_nm': '제 54 기 1분기말',
+                 'thstrm_amount': amount, 'frmtrm_amount': '-', 'ord': '20', 'currency': 'KRW'},
+                {'rcept_no': '20220516001751', 'reprt_code': reprt_code, 'bsns_year': '2022', 'corp_code': corp_code,
+                 'sj_div': 'BS', 'sj_nm': '재무상태표', 'account_id': 'ifrs-full_Assets', 'account_nm': '자산총계',
+                 'account_detail': '-', 'thstrm_amount': '1', 'ord': '30', 'currency': 'KRW'}]}
+
+        with tempfile.TemporaryDirectory() as d:
+            with ColumnarStore(d) as store:
+                self.assertEqual(store.append(quarter('00126380', '11013', '56,799,776,000,000')), 2)
+                self.assertEqual(store.append(quarter('00126380', '11013', '1')), 0)
+            with ColumnarStore(d) as store:
+                self.assertEqual(store.append(quarter('00164779', '11012', '')), 2)
+                self.assertEqual(store.append(quarter('00126380', '11013', '1')), 0)
+
+            table = ColumnarStore(d).read_account(account_id='ifrs-full_CurrentLiabilities')
+            rows = sorted(table.to_pylist(), key=lambda r: r['corp_code'])
+            self.assertEqual([r['thstrm_amount'] for r in rows], [56799776000000, None])
+            self.assertEqual(rows[1]['reprt_code'], '11012')
+            self.assertTrue(pyarrow.types.is_dictionary(table.schema.field('account_nm').type))
+
+
+class TestCorpDataTransform(unittest.TestCase):
+    def test_parse_amount_column(self):
+        from corp_data_transform import parse_amount_column
+
+        self.assertEqual(parse_amount_column(['56,799,776,000,000', '-', '', None, '-1234', '(1,000)', 'N/A', 7]),
+                         [56799776000000, None, None, None, -1234, -1000, None, 7])
+
+    def test_transform_quarter(self):
+        from corp_data_transform import transform_quarter
+
+        rows = [{'bsns_year': '2022', 'reprt_code': '11011', 'ord': '20', 'thstrm_amount': '1,000',
+                 'frmtrm_amount': '-'},
+                {'bsns_year': '2022', 'reprt_code': '11011', 'ord': '21', 'thstrm_amount': ''}]
+        rows = transform_quarter(rows)
+        self.assertEqual(rows[0]['thstrm_amount'], 1000)
+        self.assertIsNone(rows[0]['frmtrm_amount'])
+        self.assertIsNone(rows[1]['thstrm_amount'])
+        self.assertNotIn('frmtrm_amount', rows[1])
+        self.assertEqual(rows[1]['ord'], 21)
+        self.assertEqual(rows[0]['time_frame'], {'gte': '2022-10-01T09:00:00+09:00',
+                                                 'lte': '2023-01-01T08:59:59.999999+09:00'})
+        # 행마다 다른 dict 이다
+        rows[0]['time_frame']['gte'] = None
+        self.assertEqual(rows[1]['time_frame']['gte'], '2022-10-01T09:00:00+09:00')
+
+
+class TestCorpMetrics(unittest.TestCase):
+    def test_standalone_quarters_ttm_and_yoy(self):
+        from corp_data_transform import transform_quarter
+        from corp_metrics import derive_year_metrics
+
+        def row(reprt_code, **amounts):
+            return {'bsns_year': '2022', 'reprt_code': reprt_code, 'sj_div': 'IS', 'account_id': 'ifrs-full_Revenue',
+                    'account_nm': '매출액', 'currency': 'KRW', **{k: f'{v:,}' for k, v in amounts.items()}}
+
+        # 전년 분기 10, 20, 30, 40 / 올해 분기 11, 22, 33, 44
+        year_rows = {
+            '11013': [row('11013', thstrm_amount=11, thstrm_add_amount=11, frmtrm_q_amount=10,
+                          frmtrm_add_amount=10),
+                      {'bsns_year': '2022', 'reprt_code': '11013', 'sj_div': 'BS', 'account_id': 'ifrs-full_Assets',
+                       'thstrm_amount': '1'}],
+            '11012': [row('11012', thstrm_amount=22, thstrm_add_amount=33, frmtrm_q_amount=20,
+                          frmtrm_add_amount=30)],
+            '11014': [row('11014', thstrm_amount=33, thstrm_add_amount=66, frmtrm_q_amount=30,
+                          frmtrm_add_amount=60)],
+            '11011': [row('11011', thstrm_amount=110, frmtrm_amount=100)],
+        }
+        year_rows = {rt: transform_quarter(rows) for rt, rows in year_rows.items()}
+        docs = sorted(derive_year_metrics('00126380', year_rows), key=lambda d: d['quarter'])
+        self.assertEqual([d['quarter_amount'] for d in docs], [11, 22, 33, 44])
+        self.assertEqual([d['prior_quarter_amount'] for d in docs], [10, 20, 30, 40])
+        self.assertEqual([d['ttm_amount'] for d in docs], [101, 103, 106, 110])
+        self.assertEqual([d['yoy_delta'] for d in docs], [1, 2, 3, 4])
+        self.assertAlmostEqual(docs[3]['yoy_rate'], 0.1)
+
+        del year_rows['11014']
+        self.assertEqual(derive_year_metrics('00126380', year_rows), [])
+
+    def test_missing_quarters_are_loaded_for_metrics(self):
+        from import_dart_data import with_year_metrics
+
+        def qdata(reprt_code, thstrm_amount, thstrm_add_amount=None):
+            return {'status': '000', 'list': [{
+                'bsns_year': '2022', 'reprt_code': reprt_code, 'sj_div': 'IS', 'account_id': 'ifrs-full_Revenue',
+                'thstrm_amount': str(thstrm_amount), 'thstrm_add_amount': str(thstrm_add_amount or thstrm_amount)}]}
+
+        cached = {'11013': qdata('11013', 11), '11012': qdata('11012', 22, 33), '11014': qdata('11014', 33, 66)}
+        # --since 로 사업보고서만 새로 받은 경우
+        batch = [('4Q', qdata('11011', 110))]
+        self.assertEqual(list(with_year_metrics('00126380', batch)), batch)
+        quarters = list(with_year_metrics('00126380', batch, load_quarter=lambda year, rt: cached.get(rt)))
+        key, _, actions = quarters[0]
+        self.assertEqual(key, '4Q')
+        self.assertEqual(sorted(a['_source']['quarter_amount'] for a in actions), [11, 22, 33, 44])
+
+    def test_cached_quarters_in_repr_are_decoded(self):
+        import functools
+        from unittest import mock
+        import import_dart_data
+        from import_dart_data import load_cached_quarter_corp_data, with_year_metrics
+
+        q = {'status': '000', 'list': [{'bsns_year': '2022', 'reprt_code': '11013', 'thstrm_amount': '11'}]}
+
+        class FakeFileManager:
+            def has_year_data(self, year):
+                return True
+
+            def load_quarter(self, year, quarter):
+                # 예전 zip 은 dict 의 repr 을 저장했다
+                return repr(q) if quarter == 1 else 'not a quarter'
+
+        with mock.patch.object(import_dart_data, 'get_dart_response_cache', lambda: None), \
+                mock.patch.object(import_dart_data, 'corp_file_manager', lambda *args: FakeFileManager()):
+            self.assertEqual(load_cached_quarter_corp_data('00126380', '삼성전자', 2022, '11013'), q)
+            # 읽을 수 없는 분기가 있으면 그 연도의 지표만 건너뛴다
+            batch = [('4Q', dict(q, list=[dict(q['list'][0], reprt_code='11011')]))]
+            load_quarter = functools.partial(load_cached_quarter_corp_data, '00126380', '삼성전자')
+            self.assertEqual(list(with_year_metrics('00126380', batch, load_quarter=load_quarter)), batch)